@@ -1,14 +1,26 @@
+import json
+from functools import wraps
 import streamlit as st
 import pandas as pd
-import numpy as np
-from io import BytesIO
-import re
-from datetime import date
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
+from db import check_health, run_migrations, OFFLINE_DB_URL
+from utils import norm_name_value, to_num_or_none
+from search import search_products
+from catalog import catalog_write, get_product, load_catalog
+from importers import SOURCE_YEAR, SOURCE_30D, KIND_PRODUCTS, KIND_MOVES, default_period
+from jobs import submit_import, list_jobs, retry_job, recover_interrupted, STATE_RUNNING, STATE_FAILED
+from matching import run_mapping, pending_reviews, apply_matches, AUTO_THRESHOLD, REVIEW_THRESHOLD
+from competitors import COMPETITORS, competitor_names, latest_for_code, record_prices, ingest_competitor_prices, price_position
+from sales_summary import check_sales_summary, rebuild_sales_summary
+from replenishment import order_report, DEFAULT_LEAD_TIME_DAYS, DEFAULT_TARGET_DAYS, DEFAULT_WEIGHT_30D
+from export import EXPORTS, FORMATS, MIME, export_to_file, iter_frame, iter_query
+from perf import KEEP_RUNS, begin_run, end_run, muted, recent_runs, run as perf_run, run_table, slowest_queries, slowest_stages
+
+begin_run("rerun")  # timings of this script run, shown in the sidebar perf panel
 
 st.set_page_config(page_title="ServicePack – DB (v3.1 FIX3+batch)", layout="wide")
 st.title("ServicePack – Bază de date produse & rapoarte (v3.1 FIX3+batch)")
-st.caption("Persistență în Postgres (Neon/Supabase). Auto-migrations ON, CRUD manual, importuri (batch), mapare, rapoarte.")
+st.caption("Persistență în Postgres (Neon/Supabase) sau offline în SQLite local. Auto-migrations ON, CRUD manual, importuri (batch), mapare, rapoarte.")
 
 # ---------------- Helpers ----------------
 def get_engine():
@@ -16,125 +28,128 @@ def get_engine():
     if not db_url:
         st.warning("Nu ai setat DB_URL în Secrets. Poți seta temporar mai jos.")
         db_url = st.text_input("DB_URL (temporar, sesiunea curentă)", type="password")
+        if not db_url and st.checkbox(f"Lucrez offline (SQLite local: {OFFLINE_DB_URL.split('///')[-1]})"):
+            db_url = OFFLINE_DB_URL
         if db_url:
             st.session_state["DB_URL"] = db_url
     if not db_url:
         return None
     try:
-        engine = create_engine(db_url, pool_pre_ping=True)
-        with engine.connect() as conn:
-            conn.execute(text("SELECT 1"))
-        return engine
+        # Shared pool per DB_URL; "SELECT 1" runs at most once per HEALTH_CHECK_INTERVAL.
+        return check_health(db_url)
     except Exception as e:
         st.error(f"Conexiune DB eșuată: {e}")
         return None
 
-def run_migrations(engine):
-    ddl = '''
-    CREATE TABLE IF NOT EXISTS products (
-        code TEXT PRIMARY KEY,
-        name TEXT,
-        name_key TEXT,
-        grup_sku TEXT,
-        purchase_price_no_vat NUMERIC,
-        purchase_price_with_vat NUMERIC,
-        sale_price_no_vat NUMERIC,
-        sale_price_with_vat NUMERIC,
-        sale_price_site_109 NUMERIC,
-        profit_lei NUMERIC,
-        profit_pct NUMERIC,
-        competitor_gsmnet NUMERIC,
-        competitor_moka NUMERIC,
-        competitor_sep NUMERIC,
-        competitor_square NUMERIC,
-        competitor_ecranegsm NUMERIC,
-        competitor_distrizone NUMERIC,
-        created_at TIMESTAMPTZ DEFAULT now(),
-        updated_at TIMESTAMPTZ DEFAULT now()
-    );
-
-    CREATE TABLE IF NOT EXISTS stock_moves (
-        id BIGSERIAL PRIMARY KEY,
-        code TEXT REFERENCES products(code) ON DELETE SET NULL,
-        product_name TEXT,
-        stoc_initial NUMERIC,
-        intrari NUMERIC,
-        iesiri NUMERIC,
-        stoc_final NUMERIC,
-        period_start DATE,
-        period_end DATE,
-        source_tag TEXT,
-        uploaded_at TIMESTAMPTZ DEFAULT now()
-    );
-
-    CREATE INDEX IF NOT EXISTS idx_moves_code ON stock_moves(code);
-    CREATE INDEX IF NOT EXISTS idx_moves_period ON stock_moves(period_start, period_end);
-    CREATE INDEX IF NOT EXISTS idx_products_namekey ON products(name_key);
-    '''
-    with engine.begin() as conn:
-        for stmt in ddl.split(';'):
-            s = stmt.strip()
-            if s:
-                conn.execute(text(s))
-
-def norm_name_value(x: str) -> str:
-    if x is None:
-        return ""
-    x = str(x).strip().lower()
-    x = re.sub(r"\s+", " ", x)
-    return x
-
-def to_num_or_none(x):
-    if x is None or str(x).strip() == "":
-        return None
-    try:
-        return float(x)
-    except Exception:
-        return None
-
-def to_num(s):
-    return pd.to_numeric(s, errors="coerce")
-
-def norm_name_series(s: pd.Series) -> pd.Series:
-    return s.fillna("").map(norm_name_value)
-
 # ---------------- DB boot ----------------
 st.sidebar.header("Bază de date")
 engine = get_engine()
 if engine:
     try:
-        run_migrations(engine)
+        run_migrations(engine)  # no-op after the first successful run in this process
+        recover_interrupted(engine)  # once per process
         st.sidebar.success("Conexiune OK • Tabele verificate.")
     except Exception as e:
         st.sidebar.error(f"Eroare migrații: {e}")
 
+@st.fragment(run_every="3s")
+def jobs_panel():
+    # Polls import_jobs; reruns on its own without rerunning the whole page
+    try:
+        with muted():  # polling every 3s would crowd the perf panel
+            jobs = list_jobs(engine, limit=10)
+    except Exception as e:
+        st.caption(f"Nu pot citi joburile: {e}")
+        return
+    if jobs.empty:
+        st.caption("Niciun import încă.")
+        return
+    for _, j in jobs.iterrows():
+        label = f"#{j['id']} {j['kind']} • {j['filename']} • {j['state']}"
+        if j["state"] == STATE_RUNNING and j["rows_total"]:
+            st.progress(min(1.0, (j["rows_done"] or 0) / j["rows_total"]), text=label)
+        else:
+            st.caption(label + (f" • {j['rows_done']} rânduri" if j["rows_done"] else ""))
+            s = json.loads(j["stats"]) if j["stats"] else {}
+            if "unchanged" in s:
+                st.caption(f"↳ {s['inserted']} noi • {s['updated']} modificate • {s['unchanged']} neschimbate")
+        if j["state"] == STATE_FAILED:
+            st.caption(f"⚠️ {j['error']}")
+            if st.button("Reîncearcă", key=f"retry_job_{j['id']}"):
+                if not retry_job(engine, int(j["id"])):
+                    st.error("Nu pot relua jobul; reîncarcă fișierul.")
+
+if engine:
+    with st.sidebar:
+        st.header("Importuri în fundal")
+        jobs_panel()
+
+# ---------------- Lazy tabs ----------------
+def tab_fragment(label: str):
+    """st.fragment for a tab body: its widgets rerun only that body. A fragment
+    rerun skips the script-level perf run, so each body is timed as its own run."""
+    def deco(fn):
+        @wraps(fn)
+        def body():
+            with perf_run(label):
+                fn()
+        return st.fragment(body)
+    return deco
+
+def session_result(name: str, inputs: tuple, compute):
+    """Keep an expensive result in session_state until its inputs or the data
+    (catalog.data_version) change, so reruns and tab switches reuse it."""
+    key = (inputs, load_catalog(engine).version)
+    hit = st.session_state.get(name)
+    if hit is None or hit[0] != key:
+        hit = (key, compute())
+        st.session_state[name] = hit
+    return hit[1]
+
 tabs = st.tabs([
     "✏️ Produse (add/edit)",
     "📦 Import produse în DB",
     "🔁 Import mișcări în DB",
     "🧩 Mapare grup_sku",
     "📊 Rapoarte & Recomandări",
-])
+], key="main_tab", on_change="rerun")  # only the open tab's body runs
 
 # ---------------- Tab 0: CRUD ----------------
-with tabs[0]:
+@tab_fragment("căutare")
+def search_panel():
+    # Its own fragment: typing in the box reruns only the search, not the tab
+    q = st.text_input("Căutare după nume sau cod", value="", key="search_q")
+    # Keyset pagination: keep the cursor of every page visited for this query
+    if st.session_state.get("__search_q__") != q:
+        st.session_state["__search_q__"] = q
+        st.session_state["__search_pages__"] = [None]
+    pages = st.session_state["__search_pages__"]
+    try:
+        df_list, next_cursor = session_result("__search_result__", (q, pages[-1]),
+                                              lambda: search_products(engine, q, after=pages[-1]))
+        st.dataframe(df_list, use_container_width=True)
+        nav1, nav2, nav3 = st.columns([1, 1, 4])
+        with nav1:
+            if st.button("◀ Anterior", disabled=len(pages) == 1, key="search_prev"):
+                pages.pop()
+                st.rerun(scope="fragment")
+        with nav2:
+            if st.button("Următor ▶", disabled=next_cursor is None, key="search_next"):
+                pages.append(next_cursor)
+                st.rerun(scope="fragment")
+        with nav3:
+            st.caption(f"Pagina {len(pages)}")
+    except Exception as e:
+        st.warning(f"Nu pot lista produse încă: {e}")
+
+@tab_fragment("tab produse")
+def products_tab():
     st.subheader("✏️ Adaugă / Editează produse în DB")
     if not engine:
         st.info("Configurează mai întâi conexiunea la DB în sidebar.")
     else:
         with st.expander("🔎 Caută produse"):
-            q = st.text_input("Căutare după nume sau cod", value="")
-            sql = "select code, name, grup_sku, purchase_price_no_vat, sale_price_no_vat from products"
-            params = {}
-            if q.strip():
-                sql += " where lower(name) like :q or lower(code) like :q"
-                params["q"] = f"%{q.lower()}%"
-            sql += " order by name limit 500"
-            try:
-                df_list = pd.read_sql(text(sql), engine, params=params)
-                st.dataframe(df_list, use_container_width=True)
-            except Exception as e:
-                st.warning(f"Nu pot lista produse încă: {e}")
+            search_panel()
 
         st.markdown("---")
         colA, colB = st.columns(2)
@@ -149,37 +164,25 @@ with tabs[0]:
                 pp_no_vat = st.text_input("Preț intrare fără TVA (C)", key="add_pp_no_vat")
                 sp_no_vat = st.text_input("Preț vânzare fără TVA (E)", key="add_sp_no_vat")
                 with st.expander("Concurență (opțional)"):
-                    c_gsmnet = st.text_input("GSMNET", key="add_cgsm")
-                    c_moka = st.text_input("MOKA", key="add_cmoka")
-                    c_sep = st.text_input("SEP", key="add_csep")
-                    c_square = st.text_input("SQUARE", key="add_csq")
-                    c_ecranegsm = st.text_input("ECRANEGSM", key="add_ceg")
-                    c_distrizone = st.text_input("DISTRIZONE", key="add_cdz")
+                    comp_new = {c: st.text_input(c.upper(), key=f"add_c_{c}") for c in COMPETITORS}
                 submitted = st.form_submit_button("Adaugă")
                 if submitted:
                     if not code_new:
                         st.error("COD este obligatoriu.")
                     else:
-                        with engine.begin() as conn:
+                        # row_hash=NULL: a manual edit no longer matches any imported row
+                        with catalog_write(engine) as conn:
                             conn.execute(text(
                                 "INSERT INTO products(code, name, name_key, grup_sku, "
-                                "purchase_price_no_vat, sale_price_no_vat, "
-                                "competitor_gsmnet, competitor_moka, competitor_sep, "
-                                "competitor_square, competitor_ecranegsm, competitor_distrizone, updated_at) "
-                                "VALUES (:code, :name, :nk, nullif(:g,''), :pp, :sp, :cg, :cm, :cs, :csq, :ceg, :cdz, now()) "
+                                "purchase_price_no_vat, sale_price_no_vat, updated_at) "
+                                "VALUES (:code, :name, :nk, nullif(:g,''), :pp, :sp, now()) "
                                 "ON CONFLICT (code) DO UPDATE SET "
                                 "name=EXCLUDED.name, "
                                 "name_key=EXCLUDED.name_key, "
                                 "grup_sku=COALESCE(NULLIF(EXCLUDED.grup_sku,''), products.grup_sku), "
                                 "purchase_price_no_vat=COALESCE(EXCLUDED.purchase_price_no_vat, products.purchase_price_no_vat), "
                                 "sale_price_no_vat=COALESCE(EXCLUDED.sale_price_no_vat, products.sale_price_no_vat), "
-                                "competitor_gsmnet=COALESCE(EXCLUDED.competitor_gsmnet, products.competitor_gsmnet), "
-                                "competitor_moka=COALESCE(EXCLUDED.competitor_moka, products.competitor_moka), "
-                                "competitor_sep=COALESCE(EXCLUDED.competitor_sep, products.competitor_sep), "
-                                "competitor_square=COALESCE(EXCLUDED.competitor_square, products.competitor_square), "
-                                "competitor_ecranegsm=COALESCE(EXCLUDED.competitor_ecranegsm, products.competitor_ecranegsm), "
-                                "competitor_distrizone=COALESCE(EXCLUDED.competitor_distrizone, products.competitor_distrizone), "
-                                "updated_at=now()"
+                                "row_hash=NULL, updated_at=now()"
                             ), {
                                 "code": code_new,
                                 "name": name_new,
@@ -187,13 +190,8 @@ with tabs[0]:
                                 "g": grup_sku_new,
                                 "pp": to_num_or_none(pp_no_vat),
                                 "sp": to_num_or_none(sp_no_vat),
-                                "cg": to_num_or_none(c_gsmnet),
-                                "cm": to_num_or_none(c_moka),
-                                "cs": to_num_or_none(c_sep),
-                                "csq": to_num_or_none(c_square),
-                                "ceg": to_num_or_none(c_ecranegsm),
-                                "cdz": to_num_or_none(c_distrizone),
                             })
+                            record_prices(conn, code_new, {c: to_num_or_none(v) for c, v in comp_new.items()})
                         st.success(f"Produsul {code_new} a fost adăugat/actualizat.")
 
         # Edit
@@ -209,151 +207,235 @@ with tabs[0]:
             code_target = st.session_state.get("__editing_code__")
             if code_target:
                 try:
-                    row = pd.read_sql(text("select * from products where code=:c"), engine, params={"c": code_target})
+                    r = get_product(engine, code_target)  # shared in-process catalog
                 except Exception as e:
                     st.error(f"Nu pot citi produsul: {e}")
-                    row = pd.DataFrame()
-                if row.empty:
+                    r = None
+                if r is None:
                     st.warning(f"Nu am găsit COD={code_target}")
                 else:
-                    r = row.iloc[0]
                     with st.form("edit_form"):
                         name = st.text_input("NUME", value=r.get("name") or "")
                         grup = st.text_input("grup_sku", value=r.get("grup_sku") or "")
                         pp = st.text_input("Preț intrare fără TVA (C)", value=str(r.get("purchase_price_no_vat") or ""))
                         sp = st.text_input("Preț vânzare fără TVA (E)", value=str(r.get("sale_price_no_vat") or ""))
-                        c1, c2, c3 = st.columns(3)
-                        with c1:
-                            gsm = st.text_input("GSMNET", value=str(r.get("competitor_gsmnet") or ""))
-                            moka = st.text_input("MOKA", value=str(r.get("competitor_moka") or ""))
-                        with c2:
-                            sep = st.text_input("SEP", value=str(r.get("competitor_sep") or ""))
-                            square = st.text_input("SQUARE", value=str(r.get("competitor_square") or ""))
-                        with c3:
-                            egsm = st.text_input("ECRANEGSM", value=str(r.get("competitor_ecranegsm") or ""))
-                            dz = st.text_input("DISTRIZONE", value=str(r.get("competitor_distrizone") or ""))
+                        st.caption("Concurență (ultimul preț înregistrat; o valoare nouă se adaugă în istoric, un câmp golit șterge prețul)")
+                        latest, names = session_result("__edit_competitors__", (code_target,), lambda: (
+                            latest_for_code(engine, code_target), competitor_names(engine)))
+                        comp_cols = st.columns(3)
+                        comp_edit = {}
+                        for i, c in enumerate(names):
+                            with comp_cols[i % 3]:
+                                v = latest.get(c)
+                                comp_edit[c] = st.text_input(c.upper(), value="" if v is None else str(v))
                         save = st.form_submit_button("💾 Salvează")
                         if save:
-                            with engine.begin() as conn:
+                            with catalog_write(engine) as conn:
                                 conn.execute(text(
                                     "update products set "
                                     "name=:name, name_key=:nk, grup_sku=nullif(:g,''), "
                                     "purchase_price_no_vat=:pp, sale_price_no_vat=:sp, "
-                                    "competitor_gsmnet=:cg, competitor_moka=:cm, competitor_sep=:cs, "
-                                    "competitor_square=:csq, competitor_ecranegsm=:ceg, competitor_distrizone=:cdz, "
-                                    "updated_at=now() where code=:code"
+                                    "row_hash=NULL, updated_at=now() where code=:code"
                                 ), {
                                     "name": name, "nk": norm_name_value(name), "g": grup,
                                     "pp": to_num_or_none(pp), "sp": to_num_or_none(sp),
-                                    "cg": to_num_or_none(gsm), "cm": to_num_or_none(moka), "cs": to_num_or_none(sep),
-                                    "csq": to_num_or_none(square), "ceg": to_num_or_none(egsm), "cdz": to_num_or_none(dz),
                                     "code": code_target
                                 })
+                                record_prices(conn, code_target, {c: to_num_or_none(v) for c, v in comp_edit.items()})
                             st.success("Salvat.")
                     with st.expander("🗑 Șterge produs (atenție!)"):
                         if st.button("Șterge", type="primary"):
-                            with engine.begin() as conn:
+                            with catalog_write(engine) as conn:
                                 conn.execute(text("delete from products where code=:c"), {"c": code_target})
                             st.success(f"Șters {code_target}")
                             st.session_state.pop("__editing_code__", None)
 
 # ---------------- Tab 1: Import produse (BATCH) ----------------
-with tabs[1]:
+@tab_fragment("tab import produse")
+def product_import_tab():
     st.subheader("📦 Import produse în DB (bulk din Excel)")
     st.caption("Așteptat: coloanele tale A..R. `grup_sku` se va seta pe tab-ul Mapare.")
     up_prod = st.file_uploader("Excel produse (.xlsx)", type=["xlsx"], key="prodfile_db")
     if engine and up_prod is not None:
-        raw = pd.read_excel(up_prod, sheet_name=0)
-        raw = raw.loc[:, ~raw.columns.astype(str).str.contains("^Unnamed", case=False)]
-        cols = raw.columns.astype(str).str.strip().str.lower().str.replace("\n"," ", regex=True)
-        raw.columns = cols
-
-        def find_col(cands):
-            for c in cands:
-                if c in raw.columns:
-                    return c
-            return None
-
-        df = pd.DataFrame()
-        df["name"] = raw.get(find_col(["nume","name","denumire","produs"]), pd.Series(dtype="object")).astype(str).str.strip()
-        df["code"] = raw.get(find_col(["cod","sku","cod.1","product code","id"]), pd.Series(dtype="object")).astype(str).str.strip()
-        df["purchase_price_no_vat"] = to_num(raw.get(find_col(["pret intrare fara tva","pret achizitie","pret achiziție fara tva","pret achiziție"]), np.nan))
-        df["sale_price_no_vat"] = to_num(raw.get(find_col(["pret vanzare fara tva","pret vânzare fara tva","pret fara tva"]), np.nan))
-
-        df = df[df["code"].str.len() > 0].copy()
-        df["name_key"] = norm_name_series(df["name"])
-        rows = df.to_dict("records")
-
-        run_migrations(engine)
-        upsert_sql = text(
-            "INSERT INTO products (code, name, name_key, purchase_price_no_vat, sale_price_no_vat, updated_at) "
-            "VALUES (:code, :name, :name_key, :purchase_price_no_vat, :sale_price_no_vat, now()) "
-            "ON CONFLICT (code) DO UPDATE SET "
-            "name=EXCLUDED.name, name_key=EXCLUDED.name_key, "
-            "purchase_price_no_vat=EXCLUDED.purchase_price_no_vat, "
-            "sale_price_no_vat=EXCLUDED.sale_price_no_vat, updated_at=now()"
-        )
+        # Runs as a background job (see the sidebar). Queued once per uploaded
+        # file; the imports ledger turns a re-upload of the same content into "skipped".
+        if st.session_state.get("__prod_upload__") != up_prod.file_id:
+            st.session_state["__prod_upload__"] = up_prod.file_id
+            job_id, queued = submit_import(engine, KIND_PRODUCTS, up_prod)
+            if queued:
+                st.success(f"Import trimis în fundal (job #{job_id}). Progresul apare în sidebar.")
+            else:
+                st.info(f"Fișierul se importă deja (job #{job_id}).")
+        if st.button("Reimportă oricum", key="force_prod_import"):
+            job_id, queued = submit_import(engine, KIND_PRODUCTS, up_prod, {"force": True})
+            if queued:
+                st.success(f"Reimport trimis în fundal (job #{job_id}).")
+            else:
+                st.info(f"Reimportul acestui fișier rulează deja (job #{job_id}).")
 
-        # --- BATCH INSERT with progress ---
-        batch_size = 500
-        total = len(rows)
-        p = st.progress(0, text="Import produse în DB...")
-        done = 0
-        with engine.begin() as conn:
-            for i in range(0, total, batch_size):
-                chunk = rows[i:i+batch_size]
-                conn.execute(upsert_sql, chunk)
-                done = min(total, i + len(chunk))
-                p.progress(int(done / total * 100), text=f"Import produse… {done}/{total}")
-        p.empty()
-        st.success(f"Import/actualizare produse: {total} rânduri în DB (batch-uri de {batch_size}).")
+    st.markdown("---")
+    st.markdown("### 🏷 Prețuri concurență")
+    st.caption("Fișier lung (cod, concurent, preț), fișier pe un singur concurent (cod, preț) sau o coloană de preț per concurent (" + ", ".join(COMPETITORS) + " sau competitor_<nume>).")
+    up_comp = st.file_uploader("Excel prețuri concurență (.xlsx)", type=["xlsx"], key="compfile_db")
+    comp_name = st.text_input("Concurent (doar pentru fișiere cu un singur concurent)", key="comp_name")
+    if engine and up_comp is not None and st.button("Importă prețurile", key="import_comp"):
+        try:
+            cstats = ingest_competitor_prices(engine, up_comp, competitor=comp_name.strip() or None)
+            if cstats["skipped"]:
+                st.info(f"Fișierul a fost deja importat ({cstats['applied_at']}).")
+            else:
+                st.success(f"{cstats['rows']} prețuri citite • {cstats['inserted']} noi/modificate • {cstats['unchanged']} neschimbate.")
+                if cstats["unknown_codes"]:
+                    st.warning(f"{cstats['unknown_codes']} prețuri ignorate: coduri care nu există în produse.")
+        except Exception as e:
+            st.error(f"Import eșuat: {e}")
 
 # ---------------- Tab 2: Import mișcări (BATCH) ----------------
-with tabs[2]:
+@tab_fragment("tab import mișcări")
+def moves_import_tab():
     st.subheader("🔁 Import mișcări SmartBill în DB")
     c1, c2 = st.columns(2)
     with c1:
         up_all = st.file_uploader("Anul în curs (.xlsx)", type=["xlsx"], key="an_db")
-        d1 = st.date_input("Perioadă AN – început", date(date.today().year,1,1))
-        d2 = st.date_input("Perioadă AN – sfârșit", date.today())
+        year_start, year_end = default_period(SOURCE_YEAR)
+        d1 = st.date_input("Perioadă AN – început", year_start)
+        d2 = st.date_input("Perioadă AN – sfârșit", year_end)
     with c2:
         up_30 = st.file_uploader("Ultimele 30 zile (.xlsx)", type=["xlsx"], key="z30_db")
-        d3 = st.date_input("Perioadă 30z – început", date.today().replace(day=1))
-        d4 = st.date_input("Perioadă 30z – sfârșit", date.today())
+        d30_start, d30_end = default_period(SOURCE_30D)
+        d3 = st.date_input("Perioadă 30z – început", d30_start)
+        d4 = st.date_input("Perioadă 30z – sfârșit", d30_end)
 
-    def read_sb(file):
-        df = pd.read_excel(file, sheet_name=0, header=1)
-        df = df.loc[:, ~df.columns.astype(str).str.contains("^Unnamed", case=False)]
-        cols = df.columns.astype(str).str.strip().str.lower().str.replace("\n"," ", regex=True)
-        df.columns = cols
-        c_prod = None
-        for n in ["produs","denumire","nume"]:
-            if n in df.columns:
-                c_prod = n
-                break
-        c_cod = "cod" if "cod" in df.columns else df.columns[1]
+    if engine and (up_all is not None or up_30 is not None):
+        force_moves = st.checkbox("Reimportă chiar dacă fișierul a fost deja aplicat", value=False)
+        if st.button("Importă mișcările", key="import_moves"):
+            # One background job per file; each (source, period) is replaced atomically
+            for up, tag, ps, pe in [(up_all, SOURCE_YEAR, d1, d2), (up_30, SOURCE_30D, d3, d4)]:
+                if up is None:
+                    continue
+                job_id, queued = submit_import(engine, KIND_MOVES, up, {
+                    "source_tag": tag, "period_start": ps, "period_end": pe, "force": force_moves,
+                })
+                if queued:
+                    st.success(f"{up.name}: import trimis în fundal (job #{job_id}).")
+                else:
+                    st.info(f"{up.name}: se importă deja (job #{job_id}).")
 
-        def find(kws):
-            for c in df.columns:
-                low = c
-                if all(kw in low for kw in kws):
-                    return c
-            return None
+# ---------------- Tab 3: Mapare grup_sku ----------------
+@tab_fragment("tab mapare")
+def mapping_tab():
+    st.subheader("🧩 Mapare grup_sku (nume SmartBill → produse)")
+    if not engine:
+        st.info("Configurează mai întâi conexiunea la DB în sidebar.")
+    else:
+        st.caption(f"Potrivirile cu scor ≥ {AUTO_THRESHOLD:.2f} se aplică automat; cele ≥ {REVIEW_THRESHOLD:.2f} așteaptă confirmare. "
+                   "Numele deja procesate se recalculează doar dacă au rămas fără potrivire sau în verificare și s-au schimbat produsele.")
+        if st.button("Rulează maparea pentru nume noi", key="run_mapping"):
+            try:
+                stats = run_mapping(engine)
+                st.success(f"Nume noi: {stats['new_names']} • automat: {stats['auto']} (aplicate {stats['applied']}) • "
+                           f"de verificat: {stats['review']} • fără potrivire: {stats['unmatched']}")
+            except Exception as e:
+                st.error(f"Mapare eșuată: {e}")
+        try:
+            review = session_result("__pending_reviews__", (), lambda: pending_reviews(engine))
+        except Exception as e:
+            st.warning(f"Nu pot citi potrivirile: {e}")
+            review = pd.DataFrame()
+        if not review.empty:
+            st.markdown(f"### De verificat ({len(review)})")
+            review = review.copy()  # the session keeps the original
+            review.insert(0, "aplică", False)
+            edited = st.data_editor(review, use_container_width=True, disabled=list(review.columns[1:]), key="review_editor")
+            overwrite = st.checkbox("Suprascrie grup_sku existent", value=False)
+            if st.button("Aplică selectate", key="apply_review"):
+                n = apply_matches(engine, edited[edited["aplică"]], overwrite=overwrite)
+                st.success(f"grup_sku actualizat pentru {n} produse.")
+
+# ---------------- Tab 4: Rapoarte ----------------
+@tab_fragment("tab rapoarte")
+def reports_tab():
+    st.subheader("📊 Ce comand azi")
+    if not engine:
+        st.info("Configurează mai întâi conexiunea la DB în sidebar.")
+    else:
+        r1, r2, r3 = st.columns(3)
+        with r1:
+            lead_time = st.number_input("Lead-time (zile)", min_value=0, value=DEFAULT_LEAD_TIME_DAYS, step=1)
+        with r2:
+            target = st.number_input("Zile țintă de acoperire", min_value=1, value=DEFAULT_TARGET_DAYS, step=1)
+        with r3:
+            w30 = st.slider("Pondere viteză 30 zile", 0.0, 1.0, DEFAULT_WEIGHT_30D, 0.05)
+        try:
+            report, periods = session_result("__order_report__", (lead_time, target, w30),
+                                             lambda: order_report(engine, lead_time, target, w30))
+        except Exception as e:
+            st.warning(f"Nu pot calcula raportul: {e}")
+            report, periods = None, {}
+        if report is not None:
+            if not periods:
+                st.info("Nu există încă mișcări importate.")
+            else:
+                st.caption(" • ".join(f"{tag}: {ps} – {pe}" for tag, (ps, pe) in periods.items()))
+                only_order = st.checkbox("Doar produsele de comandat", value=True)
+                view = report[report["reorder_qty"] > 0] if only_order else report
+                st.dataframe(view, use_container_width=True)
+                # The file is only generated on click, chunk by chunk
+                st.download_button("⬇️ Export Excel", lambda: export_to_file(iter_frame(view), "xlsx"),
+                                   file_name="ce_comand_azi.xlsx", mime=MIME["xlsx"])
+
+        with st.expander("🛠 Întreținere agregate (sku_period_totals)"):
+            m1, m2 = st.columns(2)
+            with m1:
+                if st.button("Verifică consistența", key="summary_check"):
+                    diff = check_sales_summary(engine)
+                    if diff.empty:
+                        st.success("Agregatele corespund cu stock_moves.")
+                    else:
+                        st.warning(f"{len(diff)} diferențe față de stock_moves.")
+                        st.dataframe(diff, use_container_width=True)
+            with m2:
+                if st.button("Reconstruiește complet", key="summary_rebuild"):
+                    n = rebuild_sales_summary(engine)
+                    st.success(f"Reconstruit: {n} rânduri.")
+
+        with st.expander("📤 Export complet (fișiere mari)"):
+            e1, e2 = st.columns(2)
+            with e1:
+                export_name = st.selectbox("Raport", list(EXPORTS))
+            with e2:
+                export_fmt = st.selectbox("Format", FORMATS)
+            # Rows stream from the DB into the file; nothing runs until the click
+            st.download_button("⬇️ Descarcă", lambda: export_to_file(iter_query(engine, EXPORTS[export_name]), export_fmt),
+                               file_name=f"{export_name}.{export_fmt}", mime=MIME[export_fmt], key="full_export")
+
+        st.markdown("---")
+        st.subheader("🏷 Poziționare preț vs concurență")
+        try:
+            pos = session_result("__price_position__", (), lambda: price_position(engine))
+        except Exception as e:
+            st.warning(f"Nu pot calcula poziționarea: {e}")
+            pos = pd.DataFrame()
+        if pos.empty:
+            st.info("Nu există încă prețuri de concurență.")
+        else:
+            only_pricier = st.checkbox("Doar produsele unde nu suntem cei mai ieftini", value=True)
+            view_pos = pos[pos["gap_to_min"] > 0] if only_pricier else pos
+            st.dataframe(view_pos.sort_values("gap_to_min_pct", ascending=False), use_container_width=True)
 
-        c_stoci = find(["stoc","initial"]) or (df.columns[2] if len(df.columns) > 2 else None)
-        c_intrari = "intrari" if "intrari" in df.columns else (df.columns[3] if len(df.columns) > 3 else None)
-        c_iesiri = None
-        for key in ["iesiri","ieșiri"]:
-            if key in df.columns:
-                c_iesiri = key
-                break
-        if c_iesiri is None and len(df.columns) > 4:
-            c_iesiri = df.columns[4]
-        c_stocf = find(["stoc","final"])
+# ---------------- Render the open tab ----------------
+for tab, body in zip(tabs, [products_tab, product_import_tab, moves_import_tab, mapping_tab, reports_tab]):
+    with tab:
+        if tab.open:
+            body()
 
-        out = pd.DataFrame()
-        out["code"] = df[c_cod].astype(str).str.strip()
-        out["product_name"] = df[c_prod].astype(str).str.strip() if c_prod else ""
-        out["stoc_initial"] = pd.to_numeric(df[c_stoci], errors="coerce") if c_stoci else 0
-        out["intrari"] = pd.to_numeric(df[c_intrari], errors="coerce") if c_intrari else 0
-        out["iesiri"] = pd.to_numeric(df[c_iesiri], errors="coerce")
+# ---------------- Perf panel ----------------
+with st.sidebar.expander("⏱ Performanță (ultimele rulări)"):
+    n_runs = st.slider("Rulări analizate", 1, KEEP_RUNS, 5, key="perf_runs")
+    runs = recent_runs(n_runs)
+    st.dataframe(run_table(runs), hide_index=True, use_container_width=True)
+    st.caption("Cele mai lente etape")
+    st.dataframe(slowest_stages(runs).head(10), hide_index=True, use_container_width=True)
+    st.caption("Cele mai lente interogări")
+    st.dataframe(slowest_queries(runs, 10), hide_index=True, use_container_width=True)
+end_run()
@@ -0,0 +1,362 @@
+"""Synthetic-data benchmarks for the import and normalization hot paths.
+
+    python bench.py                         # 10k, 100k and 1M rows -> bench_results.json
+    python bench.py --sizes 10k,100k --compare bench_baseline.json
+
+Generates realistic product, SmartBill and stock-move workbooks (Romanian
+headers, blank "Unnamed" columns, the SmartBill title row above the header),
+then times every stage in a fresh process so peak memory is per stage.
+Peak memory is sampled from /proc (Linux); elsewhere it falls back to ru_maxrss.
+"""
+from __future__ import annotations
+import argparse
+import gc
+import json
+import os
+import pickle
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+DEFAULT_SIZES = "10k,100k,1M"
+DEFAULT_OUT = "bench_results.json"
+REGRESSION_TOLERANCE = 0.20  # --compare flags stages >20% slower or bigger
+
+# ---------------- Synthetic workbooks ----------------
+BRANDS = ["Samsung", "Apple", "Xiaomi", "Huawei", "Motorola", "Oppo", "Realme", "Nokia"]
+PARTS = ["Display", "Ecran", "Baterie", "Mufa incarcare", "Camera spate", "Difuzor", "Capac baterie", "Banda flex"]
+VARIANTS = ["cu rama", "fara rama", "OLED", "Service Pack", "original", "compatibil", "TFT", "incell"]
+COLORS = ["negru", "alb", "albastru", "verde", "gri", "auriu"]
+
+def parse_size(s: str) -> int:
+    s = s.strip().lower()
+    mult = {"k": 1_000, "m": 1_000_000}.get(s[-1:], 1)
+    return int(float(s.rstrip("km")) * mult)
+
+def size_label(n: int) -> str:
+    return f"{n // 1_000_000}M" if n % 1_000_000 == 0 else f"{n // 1_000}k" if n % 1_000 == 0 else str(n)
+
+def _names(rng: np.random.Generator, n: int) -> np.ndarray:
+    pick = lambda xs: np.asarray(xs, dtype=object)[rng.integers(0, len(xs), n)]
+    model = rng.integers(1, 99, n).astype(str)
+    return pick(PARTS) + " " + pick(BRANDS) + " " + model.astype(object) + " " + pick(VARIANTS) + " " + pick(COLORS)
+
+def _with_blanks(rng: np.random.Generator, values: np.ndarray, share: float) -> np.ndarray:
+    out = values.astype(object)
+    out[rng.random(len(out)) < share] = None
+    return out
+
+def _write_xlsx(path: Path, header: List[Optional[str]], columns: List[np.ndarray],
+                title: Optional[str] = None, footer: Optional[List[Any]] = None) -> None:
+    wb = xlsxwriter.Workbook(str(path), {"constant_memory": True, "nan_inf_to_errors": True})
+    ws = wb.add_worksheet("Sheet1")
+    r = 0
+    if title:
+        ws.write(r, 0, title)
+        r += 1
+    ws.write_row(r, 0, [h or "" for h in header])
+    r += 1
+    for row in zip(*columns):
+        ws.write_row(r, 0, row)
+        r += 1
+    if footer:
+        ws.write_row(r, 0, footer)
+    wb.close()
+
+def generate_products(path: Path, n: int, seed: int = 1, changed: float = 0.0) -> None:
+    # Old-style product workbook: the aliases utils.map_product_columns knows,
+    # plus the "fara TVA" columns of the streaming importer and empty columns.
+    # `changed`: share of rows whose sale price differs from the seed's workbook.
+    rng = np.random.default_rng(seed)
+    cost = np.round(rng.gamma(2.0, 60.0, n), 2)
+    sale = np.round(cost * rng.uniform(1.1, 1.9, n), 2)
+    if changed:
+        # Own generator, so every other column stays identical
+        bump = np.random.default_rng(seed + 1000).random(n) < changed
+        sale[bump] = np.round(sale[bump] * 1.05, 2)
+    header = ["Cod", "Nume", "Pret achizitie", "Pret vanzare", "Profit", "Pret vanzare -20%",
+              "Profit -20%", "Concurenta", None, "Pret vanzare fara TVA", None]
+    blank = np.full(n, None, dtype=object)
+    cols = [
+        np.char.add("SP-", np.char.zfill(np.arange(n).astype(str), 7)).astype(object),
+        _names(rng, n),
+        _with_blanks(rng, cost, 0.02), sale, np.round(sale - cost, 2), np.round(sale * 0.8, 2),
+        np.round(sale * 0.8 - cost, 2), _with_blanks(rng, np.round(sale * rng.uniform(0.85, 1.15, n), 2), 0.4),
+        blank, np.round(sale / 1.19, 2), blank,
+    ]
+    _write_xlsx(path, header, cols)
+
+def generate_smartbill(path: Path, n: int, seed: int = 2) -> None:
+    # SmartBill stock situation: title row, then the real header, then a total row
+    rng = np.random.default_rng(seed)
+    start = rng.poisson(6, n).astype(float)
+    intrari = rng.poisson(10, n).astype(float)
+    iesiri = np.minimum(rng.poisson(9, n), start + intrari)
+    header = ["Nr. crt.", "Cod", "Produs", "Stoc initial", "Intrari", "Iesiri", "Stoc final", "UM", None]
+    cols = [np.arange(1, n + 1), np.char.add("SP-", np.char.zfill(np.arange(n).astype(str), 7)).astype(object),
+            _names(rng, n), start, intrari, iesiri, start + intrari - iesiri, np.full(n, "buc", dtype=object),
+            np.full(n, None, dtype=object)]
+    title = f"Situatie stocuri - perioada 01.01.{date.today().year} - {date.today():%d.%m.%Y}"
+    _write_xlsx(path, header, cols, title=title,
+                footer=[None, None, "Total", start.sum(), intrari.sum(), iesiri.sum(), None])
+
+def generate_moves(path: Path, n: int, seed: int = 3) -> None:
+    # Line-level moves export, the input utils.normalize_stock_moves expects
+    rng = np.random.default_rng(seed)
+    days = rng.integers(0, 365, n)
+    dates = (np.datetime64(date(date.today().year - 1, 1, 1)) + days.astype("timedelta64[D]")).astype(str)
+    skus = rng.integers(0, max(n // 10, 1), n)
+    header = ["Data", "Cod produs", "Denumire", "Cantitate", "Tip", "Gestiune", None]
+    cols = [dates.astype(object), np.char.add("SP-", np.char.zfill(skus.astype(str), 7)).astype(object),
+            _names(rng, n), rng.integers(1, 20, n).astype(float),
+            np.where(rng.random(n) < 0.6, "Iesire", "Intrare").astype(object),
+            np.full(n, "Magazin", dtype=object), np.full(n, None, dtype=object)]
+    _write_xlsx(path, header, cols)
+
+PRODUCT_CHANGE_SHARE = 0.10  # rows repriced in the re-imported products workbook
+
+GENERATORS: Dict[str, Callable[[Path, int], None]] = {
+    "products": generate_products, "smartbill": generate_smartbill, "moves": generate_moves,
+    "products_changed": lambda path, n: generate_products(path, n, changed=PRODUCT_CHANGE_SHARE),
+}
+
+def ensure_workbooks(data_dir: Path, n: int) -> Dict[str, str]:
+    """Generate the workbooks for `n` rows once; later runs reuse them."""
+    data_dir.mkdir(parents=True, exist_ok=True)
+    paths = {}
+    for kind, gen in GENERATORS.items():
+        path = data_dir / f"{kind}_{size_label(n)}.xlsx"
+        if not path.exists():
+            t0 = time.perf_counter()
+            tmp = path.with_suffix(".tmp.xlsx")
+            gen(tmp, n)
+            os.replace(tmp, path)
+            print(f"  generated {path.name} in {time.perf_counter() - t0:.1f}s", flush=True)
+        paths[kind] = str(path)
+    return paths
+
+# ---------------- Memory ----------------
+class PeakRSS:
+    """Peak resident memory above the starting point while the block runs."""
+    INTERVAL = 0.005
+
+    def __enter__(self):
+        self.base = self.peak = self._rss()
+        self._stop = threading.Event()
+        if self.base is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        else:
+            self._max0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self.base is not None:
+            self._thread.join()
+            self.peak = max(self.peak, self._rss())
+            self.mb = (self.peak - self.base) / 2**20
+        else:
+            # ru_maxrss is KiB on Linux, bytes on macOS
+            scale = 1 if sys.platform == "darwin" else 1024
+            self.mb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - self._max0) * scale / 2**20
+        return False
+
+    @staticmethod
+    def _rss() -> Optional[int]:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            return None
+
+    def _sample(self):
+        while not self._stop.wait(self.INTERVAL):
+            self.peak = max(self.peak, self._rss())
+
+# ---------------- Stages ----------------
+# Each stage: setup(paths, work) -> input (untimed), run(input, work) -> rows processed.
+def _raw(paths: Dict[str, str], kind: str) -> pd.DataFrame:
+    # The read_excel frame, pickled next to the workbook so later stages skip the parse
+    pkl = Path(paths[kind]).with_suffix(".pkl")
+    if pkl.exists():
+        with open(pkl, "rb") as f:
+            return pickle.load(f)
+    df = pd.read_excel(paths[kind])
+    with open(pkl, "wb") as f:
+        pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return df
+
+def _read_excel(kind: str):
+    return (lambda paths, work: paths[kind]), (lambda path, work: len(pd.read_excel(path)))
+
+def _bench_engine(work: Path):
+    # A fresh database on the offline SQLite backend, tuned by db.get_engine as in the app
+    from db import get_engine, run_migrations
+    for f in work.glob("bench.db*"):
+        f.unlink()
+    engine = get_engine(f"sqlite:///{work / 'bench.db'}")
+    run_migrations(engine)
+    return engine
+
+def _import_setup(kind: str, seed_with: Optional[str] = None):
+    def setup(paths, work):
+        import importers
+        engine = _bench_engine(work)
+        if seed_with:
+            importers.import_products(engine, paths[seed_with])
+        # Parse into the cache now, so the timed import is the database part only
+        for _ in importers.iter_product_chunks(paths[kind]):
+            pass
+        return engine, paths[kind]
+    return setup
+
+def _import_products(inp, work) -> int:
+    # importers.import_products as the app and the CLI call it, with the parse
+    # served from the warm cache: stage, row-hash diff, merge of the changed
+    # rows, ledger entry. Its rows/s is the database write rate.
+    import importers
+    engine, path = inp
+    res = importers.import_products(engine, path)
+    engine.dispose()
+    return int(res["rows"])
+
+def _read_sb(paths, work):
+    import importers
+    return len(importers.read_sb(paths["smartbill"]))
+
+def _sales_analytics(moves, work) -> int:
+    # Rows in = moves, so rows/s compares with the other stages (it returns one row per SKU)
+    __import__("sales_analytics").sales_analytics(moves)
+    return len(moves)
+
+def _lazy(mod: str, fn: str):
+    def run(df, work):
+        return len(getattr(__import__(mod), fn)(df))
+    return run
+
+STAGES: List[Tuple[str, Callable, Callable, Optional[str]]] = [
+    # name, setup, run, source workbook (for MB/s)
+    ("read_excel_products", *_read_excel("products"), "products"),
+    ("normalize_columns", lambda p, w: _raw(p, "products"), _lazy("utils", "normalize_columns"), None),
+    ("map_product_columns", lambda p, w: __import__("utils").normalize_columns(_raw(p, "products")),
+     _lazy("utils", "map_product_columns"), None),
+    ("read_excel_moves", *_read_excel("moves"), "moves"),
+    ("normalize_stock_moves", lambda p, w: _raw(p, "moves"), _lazy("utils", "normalize_stock_moves"), None),
+    ("sales_analytics", lambda p, w: __import__("utils").normalize_stock_moves(_raw(p, "moves")),
+     _sales_analytics, None),
+    ("read_sb", lambda p, w: p, _read_sb, "smartbill"),          # cold: parse + write the parse cache
+    ("read_sb_cached", lambda p, w: p, _read_sb, "smartbill"),   # warm: served from the Parquet cache
+    ("import_products_fresh", _import_setup("products"), _import_products, None),
+    # Re-import with PRODUCT_CHANGE_SHARE of the rows repriced, over the imported catalog
+    ("import_products_changed", _import_setup("products_changed", seed_with="products"), _import_products, None),
+]
+DB_STAGES = {"import_products_fresh", "import_products_changed"}
+
+def _run_stage(name: str, paths: Dict[str, str], work: str) -> Dict[str, Any]:
+    # Runs in a fresh spawned process
+    _, setup, run, source = next(s for s in STAGES if s[0] == name)
+    work_dir = Path(work)
+    import db, importers, sales_analytics, storage, utils  # noqa: F401  (module import time stays out of the timings)
+    inp = setup(paths, work_dir)
+    gc.collect()
+    with PeakRSS() as mem:
+        t0 = time.perf_counter()
+        rows = run(inp, work_dir)
+        seconds = time.perf_counter() - t0
+    res = {"seconds": round(seconds, 4), "rows_out": rows,
+           "rows_per_s": round(rows / seconds, 1) if seconds else None, "peak_mb": round(mem.mb, 1)}
+    if source:
+        res["mb_per_s"] = round(os.path.getsize(paths[source]) / 2**20 / seconds, 2) if seconds else None
+    if name in DB_STAGES:
+        res["db_rows_per_s"] = res["rows_per_s"]
+    return res
+
+def run_size(n: int, data_dir: Path, only: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    paths = ensure_workbooks(data_dir, n)
+    results = []
+    with tempfile.TemporaryDirectory(prefix="servicepack-bench-") as work:
+        # Isolated parse cache, so read_sb starts cold
+        os.environ["SERVICEPACK_CACHE_DIR"] = str(Path(work) / "cache")
+        for name, *_ in STAGES:
+            if only and name not in only:
+                continue
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                res = pool.submit(_run_stage, name, paths, work).result()
+            res = {"stage": name, "size": size_label(n), "rows": n, **res}
+            print(f"  {name:<24} {res['seconds']:>9.3f}s {res['rows_per_s'] or 0:>12,.0f} rows/s "
+                  f"{res['peak_mb']:>8.1f} MB", flush=True)
+            results.append(res)
+    return results
+
+# ---------------- Baseline ----------------
+def _git_rev() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any],
+            tolerance: float = REGRESSION_TOLERANCE) -> int:
+    """Print time / memory ratios against a baseline file; returns the number of regressions."""
+    old = {(r["stage"], r["rows"]): r for r in baseline.get("results", [])}
+    regressions = 0
+    print(f"\nvs baseline {baseline.get('meta', {}).get('git') or ''} ({baseline.get('meta', {}).get('created')})")
+    for r in results:
+        b = old.get((r["stage"], r["rows"]))
+        if not b:
+            continue
+        t = r["seconds"] / b["seconds"] if b["seconds"] else float("nan")
+        m = (r["peak_mb"] + 1) / (b["peak_mb"] + 1)  # +1 MB keeps tiny stages from dominating
+        flag = t > 1 + tolerance or m > 1 + tolerance
+        regressions += flag
+        print(f"  {r['stage']:<24} {r['size']:>5}  time x{t:.2f}  memory x{m:.2f}{'  <-- REGRESSION' if flag else ''}")
+    return regressions
+
+def main(argv: Optional[List[str]] = None) -> int:
+    p = argparse.ArgumentParser(description="ServicePack import / normalization benchmarks")
+    p.add_argument("--sizes", default=DEFAULT_SIZES, help=f"comma separated row counts (default {DEFAULT_SIZES})")
+    p.add_argument("--data-dir", default=".cache/bench", help="generated workbooks, reused between runs")
+    p.add_argument("--stages", help="comma separated subset of: " + ", ".join(s[0] for s in STAGES))
+    p.add_argument("--out", default=DEFAULT_OUT, help="results JSON (use as the next --compare baseline)")
+    p.add_argument("--compare", help="baseline JSON to compare against; exit 1 on regressions")
+    p.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    args = p.parse_args(argv)
+
+    only = args.stages.split(",") if args.stages else None
+    results = []
+    for s in args.sizes.split(","):
+        n = parse_size(s)
+        print(f"{size_label(n)} rows", flush=True)
+        results += run_size(n, Path(args.data_dir), only)
+
+    out = {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"), "git": _git_rev(),
+            "python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__,
+            "platform": platform.platform(), "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+    Path(args.out).write_text(json.dumps(out, indent=2))
+    print(f"results -> {args.out}")
+    if args.compare:
+        return 1 if compare(results, json.loads(Path(args.compare).read_text()), args.tolerance) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+from __future__ import annotations
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from perf import read_sql
+
+# Process-wide snapshot of `products`, shared by every Streamlit session and
+# rerun (and the import job threads). Writes to products, and to the tables
+# the reports read (moves, totals, competitor prices, name matches), go through
+# catalog_write(): it bumps the data_version row in the same transaction and,
+# once committed, a counter local to this process. A reader goes back to the
+# database only when this process wrote since its last check, or when
+# VERSION_CHECK_INTERVAL has passed (writes from other processes, e.g. the
+# CLI); the table is reloaded only when data_version moved. The app also keys
+# the results it keeps per session on data_version.
+VERSION_CHECK_INTERVAL = 5.0  # seconds
+PRICE_COLUMNS = ["purchase_price_no_vat", "sale_price_no_vat"]
+
+CATALOG_SQL = '''
+SELECT code, name, name_key, grup_sku, purchase_price_no_vat, sale_price_no_vat, updated_at
+FROM products
+'''
+VERSION_SQL = "SELECT coalesce(max(version), 0) FROM data_version"
+# Upsert, so a database without the row yet works too
+BUMP_SQL = ('INSERT INTO data_version (id, version) VALUES (1, 1) '
+            'ON CONFLICT (id) DO UPDATE SET version = data_version.version + 1')
+
+@dataclass
+class Catalog:
+    frame: pd.DataFrame   # one row per product in (name_key, code) order; read-only
+    version: int          # data_version it was loaded at
+    rows: np.ndarray      # code category id -> row in `frame`
+
+    def row(self, code: str) -> Optional[int]:
+        try:
+            return int(self.rows[self.frame["code"].cat.categories.get_loc(code)])
+        except KeyError:
+            return None
+
+    def get(self, code: str) -> Optional[Dict[str, Any]]:
+        """One product as a dict (NULLs as None), or None if the code is unknown."""
+        i = self.row(code)
+        if i is None:
+            return None
+        return {k: (None if pd.isna(v) else v) for k, v in self.frame.iloc[i].items()}
+
+@dataclass
+class _Entry:
+    catalog: Catalog
+    local: int        # local write counter when last checked
+    checked: float    # monotonic time of the last data_version check
+
+_local_writes: Dict[str, int] = {}
+_entries: Dict[str, _Entry] = {}
+_lock = threading.Lock()
+_load_lock = threading.Lock()  # one reload at a time, not one per session
+
+def _key(engine: Engine) -> str:
+    return engine.url.render_as_string(hide_password=False)
+
+def _build(df: pd.DataFrame, version: int) -> Catalog:
+    df["name_key"] = df["name_key"].fillna("")
+    df = df.sort_values(["name_key", "code"], ignore_index=True)
+    # Categories come out sorted, so the category id doubles as the lookup key
+    df["code"] = df["code"].astype("category")
+    df["grup_sku"] = df["grup_sku"].astype("category")
+    # float64, not float32: the edit form is prefilled from here and saved
+    # back, so a price must round-trip to the value stored in NUMERIC
+    for c in PRICE_COLUMNS:
+        df[c] = pd.to_numeric(df[c], errors="coerce").astype(np.float64)
+    rows = np.empty(len(df), np.int32)
+    rows[df["code"].cat.codes.to_numpy()] = np.arange(len(df), dtype=np.int32)
+    return Catalog(df, version, rows)
+
+def load_catalog(engine: Engine) -> Catalog:
+    """The current products snapshot of this process (see module comment)."""
+    key = _key(engine)
+    with _lock:
+        local, ent = _local_writes.get(key, 0), _entries.get(key)
+    if ent is not None and ent.local == local and time.monotonic() - ent.checked < VERSION_CHECK_INTERVAL:
+        return ent.catalog
+    with _load_lock:
+        with _lock:
+            local, ent = _local_writes.get(key, 0), _entries.get(key)
+        checked = time.monotonic()
+        # Version first, then rows: a write committed in between only makes
+        # the snapshot look older than it is (one extra reload), never newer
+        with engine.connect() as conn:
+            version = int(conn.execute(text(VERSION_SQL)).scalar() or 0)
+            cat = ent.catalog if ent is not None and ent.catalog.version == version else None
+            if cat is None:
+                cat = _build(read_sql(CATALOG_SQL, conn), version)
+        with _lock:
+            _entries[key] = _Entry(cat, local, checked)
+    return cat
+
+def get_product(engine: Engine, code: str) -> Optional[Dict[str, Any]]:
+    return load_catalog(engine).get(code)
+
+@contextmanager
+def catalog_write(engine: Engine) -> Iterator[Connection]:
+    """engine.begin() for transactions that change business data. data_version is
+    bumped as the last statement (its row lock is held only until commit);
+    the local counter only after the commit, so no reader can cache the old
+    rows under the new version."""
+    with engine.begin() as conn:
+        yield conn
+        conn.execute(text(BUMP_SQL))
+    key = _key(engine)
+    with _lock:
+        _local_writes[key] = _local_writes.get(key, 0) + 1
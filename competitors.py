@@ -0,0 +1,187 @@
+from __future__ import annotations
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from catalog import catalog_write
+from importers import CHUNK_ROWS, iter_excel_chunks, ledger_lookup, record_import, source_name
+from parse_cache import file_digest
+from perf import read_sql, timed_iter
+from storage import copy_frame, create_stage
+from utils import find_col, to_num
+
+# Competitors shown in the CRUD forms. Prices live in competitor_prices
+# (code, competitor, price, observed_at), so any other name found in an
+# imported file works too, without a migration.
+COMPETITORS = ["gsmnet", "moka", "sep", "square", "ecranegsm", "distrizone"]
+
+KIND_COMPETITORS = "competitors"
+
+CODE_COLUMNS = ["cod", "code", "sku", "product code", "id"]
+NAME_COLUMNS = ["nume", "name", "denumire", "produs"]
+COMPETITOR_COLUMNS = ["concurent", "concurenta", "competitor"]
+PRICE_COLUMNS = ["pret", "price", "pret concurenta", "competitor price", "pret cu tva", "pret vanzare"]
+DATE_COLUMNS = ["data", "date", "observed_at"]
+
+def norm_competitor(name) -> str:
+    s = str(name).strip().lower()
+    return s[len("competitor_"):] if s.startswith("competitor_") else s
+
+def is_competitor_column(name) -> bool:
+    s = str(name).strip().lower()
+    return s.startswith("competitor_") or s in COMPETITORS
+
+def competitor_names(engine: Engine) -> List[str]:
+    with engine.connect() as conn:
+        seen = conn.execute(text("SELECT DISTINCT competitor FROM competitor_prices")).scalars().all()
+    return COMPETITORS + sorted(set(seen) - set(COMPETITORS))
+
+# ---------------- Writes ----------------
+# Only a changed price becomes a new observation, so re-saving a form or
+# re-importing the same file doesn't grow the history. A cleared price is a
+# NULL observation (no latest price); a competitor never priced gets none.
+_RECORD_ONE_SQL = '''
+INSERT INTO competitor_prices (code, competitor, price)
+SELECT :code, :comp, CAST(:price AS NUMERIC)
+WHERE (SELECT price FROM competitor_prices
+       WHERE code=:code AND competitor=:comp ORDER BY observed_at DESC, id DESC LIMIT 1) IS DISTINCT FROM CAST(:price AS NUMERIC)
+'''
+
+def record_prices(conn: Connection, code: str, prices: Dict[str, Optional[float]]) -> None:
+    """Record the prices entered for one product (CRUD forms); None clears
+    a competitor's price."""
+    rows = [{"code": code, "comp": norm_competitor(c), "price": p} for c, p in prices.items()]
+    if rows:
+        conn.execute(text(_RECORD_ONE_SQL), rows)
+
+_INGEST_SQL = '''
+INSERT INTO competitor_prices (code, competitor, price, observed_at)
+SELECT s.code, s.competitor, s.price, coalesce(s.observed_at, now())
+FROM (SELECT *, row_number() OVER (PARTITION BY code, competitor ORDER BY seq DESC) AS rn FROM _stage_cp) s
+JOIN products p ON p.code = s.code
+WHERE s.rn = 1
+  AND (SELECT c.price FROM competitor_prices c
+       WHERE c.code = s.code AND c.competitor = s.competitor
+       ORDER BY c.observed_at DESC, c.id DESC LIMIT 1) IS DISTINCT FROM s.price
+'''
+
+def normalize_competitor_chunk(raw: pd.DataFrame, competitor: Optional[str] = None) -> pd.DataFrame:
+    """Long (code, competitor, price, observed_at) rows from one chunk of a price file.
+    Accepts a long file (code + competitor + price columns), a single-competitor
+    file (code + price, with `competitor` given) or a wide file with one
+    price column per competitor."""
+    c_code = find_col(raw.columns, CODE_COLUMNS)
+    if c_code is None:
+        raise ValueError("Fișierul nu are coloană de cod (cod / sku).")
+    c_date = find_col(raw.columns, DATE_COLUMNS)
+    base = pd.DataFrame({"code": raw[c_code].fillna("").astype(str).str.strip()})
+    base["observed_at"] = pd.to_datetime(raw[c_date], errors="coerce") if c_date else pd.NaT
+    c_comp = find_col(raw.columns, COMPETITOR_COLUMNS)
+    c_price = find_col(raw.columns, PRICE_COLUMNS)
+    if competitor or c_comp:
+        if c_price is None:
+            raise ValueError("Fișierul nu are coloană de preț.")
+        out = base.assign(
+            competitor=norm_competitor(competitor) if competitor else raw[c_comp].map(norm_competitor),
+            price=to_num(raw[c_price]),
+        )
+    else:
+        # Wide file: only known competitors or explicit competitor_<name>
+        # columns, so stock or cost columns don't turn into fake competitors
+        skip = {c_code, c_date, find_col(raw.columns, NAME_COLUMNS)}
+        rest = [c for c in raw.columns if c not in skip]
+        price_cols = [c for c in rest if is_competitor_column(c)]
+        unknown = [str(c) for c in rest if c not in price_cols]
+        if unknown:
+            raise ValueError(f"Coloane necunoscute: {', '.join(unknown)}. Coloanele de preț trebuie să fie "
+                             f"{', '.join(COMPETITORS)} sau competitor_<nume>; pentru un singur concurent "
+                             "completează numele lui.")
+        wide = pd.concat([base, raw[price_cols].apply(to_num)], axis=1)
+        out = wide.melt(id_vars=["code", "observed_at"], value_vars=price_cols,
+                        var_name="competitor", value_name="price")
+        out["competitor"] = out["competitor"].map(norm_competitor)
+    out = out[(out["code"].str.len() > 0) & out["price"].notna()]
+    return out[["code", "competitor", "price", "observed_at"]].reset_index(drop=True)
+
+def ingest_competitor_prices(engine: Engine, file, competitor: Optional[str] = None,
+                             chunk_rows: int = CHUNK_ROWS, force: bool = False) -> Dict[str, object]:
+    """Bulk-load a competitor price file into competitor_prices: chunks are
+    COPY'd into staging, then one INSERT ... SELECT keeps rows for known
+    products whose price differs from the latest observation. Rows for codes
+    not in products are counted as unknown_codes and dropped."""
+    digest = file_digest(file)
+    scope = norm_competitor(competitor) if competitor else ""
+    if not force:
+        prev = ledger_lookup(engine, digest, KIND_COMPETITORS, scope)
+        if prev is not None:
+            return {"skipped": True, "rows": prev["rows"], "applied_at": prev["applied_at"]}
+    staged = 0
+    with catalog_write(engine) as conn:
+        create_stage(conn, "_stage_cp", "seq BIGINT, code TEXT, competitor TEXT, price NUMERIC, observed_at TIMESTAMPTZ")
+        for raw in timed_iter("read_excel", iter_excel_chunks(file, header=0, chunk_rows=chunk_rows)):
+            df = normalize_competitor_chunk(raw, competitor)
+            df["seq"] = np.arange(staged, staged + len(df))
+            copy_frame(conn, "_stage_cp", df, ["seq", "code", "competitor", "price", "observed_at"])
+            staged += len(df)
+        inserted = conn.execute(text(_INGEST_SQL)).rowcount if staged else 0
+        unknown = conn.execute(text(
+            "SELECT count(*) FROM _stage_cp s WHERE NOT EXISTS (SELECT 1 FROM products p WHERE p.code = s.code)"
+        )).scalar() if staged else 0
+        record_import(conn, digest, KIND_COMPETITORS, scope, source_name(file), staged)
+    return {"skipped": False, "rows": staged, "inserted": inserted, "unknown_codes": int(unknown),
+            "unchanged": staged - inserted - int(unknown)}
+
+# ---------------- Reads ----------------
+# Latest observation per (code, competitor), the later insert first on equal
+# timestamps (SQLite stamps whole seconds); a cleared (NULL) one hides older prices
+_LATEST_SQL = '''
+SELECT code, competitor, price, observed_at FROM (
+    SELECT code, competitor, price, observed_at,
+           row_number() OVER (PARTITION BY code, competitor ORDER BY observed_at DESC, id DESC) AS rn
+    FROM competitor_prices
+    WHERE true{where}
+) l WHERE rn = 1 AND price IS NOT NULL
+'''
+
+def latest_for_code(engine: Engine, code: str) -> Dict[str, float]:
+    df = read_sql(_LATEST_SQL.format(where=" AND code=:c"), engine, params={"c": code})
+    return dict(zip(df["competitor"], df["price"].astype(float)))
+
+_POSITION_SQL = f'''
+WITH latest AS ({_LATEST_SQL.format(where="")})
+SELECT l.code, p.name, p.{{our_col}} AS our_price, l.competitor, l.price
+FROM latest l JOIN products p ON p.code = l.code
+'''
+
+POSITION_COLUMNS = ["code", "name", "our_price", "n_competitors", "min_price", "median_price",
+                    "cheapest_competitor", "our_rank", "gap_to_min", "gap_to_min_pct"]
+
+def compute_price_position(df: pd.DataFrame) -> pd.DataFrame:
+    """Per SKU: competitor min/median, cheapest competitor, our rank among
+    everyone's prices (1 = cheapest) and our gap to the cheapest competitor.
+    `df` is long: one row per (code, competitor) with our_price repeated."""
+    if df.empty:
+        return pd.DataFrame(columns=POSITION_COLUMNS)
+    df = df.assign(price=pd.to_numeric(df["price"], errors="coerce"),
+                   our_price=pd.to_numeric(df["our_price"], errors="coerce"))
+    g = df.groupby("code", sort=False)
+    out = g.agg(name=("name", "first"), our_price=("our_price", "first"),
+                n_competitors=("price", "size"), min_price=("price", "min"),
+                median_price=("price", "median"))
+    out["cheapest_competitor"] = df.loc[g["price"].idxmin(), ["code", "competitor"]].set_index("code")["competitor"]
+    cheaper = (df["price"] < df["our_price"]).groupby(df["code"], sort=False).sum()
+    out["our_rank"] = np.where(out["our_price"].notna(), cheaper.reindex(out.index) + 1, np.nan)
+    out["gap_to_min"] = out["our_price"] - out["min_price"]
+    out["gap_to_min_pct"] = out["gap_to_min"] / out["min_price"] * 100
+    return out.reset_index()[POSITION_COLUMNS]
+
+def price_position(engine: Engine, our_col: str = "sale_price_no_vat") -> pd.DataFrame:
+    """Catalog-wide price position: one query for the latest competitor prices
+    plus one pandas pass."""
+    if our_col not in ("sale_price_no_vat", "sale_price_with_vat", "sale_price_site_109"):
+        raise ValueError(f"Coloană de preț necunoscută: {our_col}")
+    df = read_sql(_POSITION_SQL.format(our_col=our_col), engine)
+    return compute_price_position(df)
@@ -1,50 +1,441 @@
 from __future__ import annotations
-from typing import Optional, Dict, Any
-from sqlalchemy import create_engine, Column, Integer, String, Float, Date, DateTime, Text, UniqueConstraint
-from sqlalchemy.orm import declarative_base, sessionmaker
-from datetime import datetime
-
-DB_PATH = "sqlite:///servicepack.db"
-
-Base = declarative_base()
-engine = create_engine(DB_PATH, echo=False, future=True)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
-
-class Product(Base):
-    __tablename__ = "products"
-    id = Column(Integer, primary_key=True)
-    code = Column(String, index=True)
-    name = Column(Text)
-    purchase_price = Column(Float)     # Pret achizitie
-    sale_price = Column(Float)         # Pret vanzare
-    profit_abs = Column(Float)         # Profit absolut din fisier, daca exista
-    sale_price_minus20 = Column(Float)
-    profit_minus20 = Column(Float)
-    competitor_price = Column(Float)   # Pret concurenta (manual / import separat)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow)
-
-    __table_args__ = (UniqueConstraint("code", name="uq_products_code"),)
-
-class StockMove(Base):
-    __tablename__ = "stock_moves"
-    id = Column(Integer, primary_key=True)
-    product_code = Column(String, index=True)   # legam pe cod
-    date = Column(Date, index=True)
-    qty = Column(Float)                         # pozitiv intrari, negativ iesiri
-    source = Column(String)                     # ex: SmartBill, manual
-
-class Inventory(Base):
-    __tablename__ = "inventory"
-    id = Column(Integer, primary_key=True)
-    product_code = Column(String, index=True)
-    on_hand = Column(Float, default=0.0)
-    updated_at = Column(DateTime, default=datetime.utcnow)
-
-def init_db():
-    Base.metadata.create_all(engine)
-    return engine
-
-def ensure_db():
-    init_db()
-    return SessionLocal()
\ No newline at end of file
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+from sqlalchemy import (
+    DDL, BigInteger, Column, Date, DateTime, ForeignKey, Index, Integer, MetaData, Numeric,
+    PrimaryKeyConstraint, Table, Text, create_engine, event, func, inspect, text,
+)
+from sqlalchemy.engine import Engine
+
+from perf import instrument_engine
+
+# Local database for offline use (a laptop without Postgres); same schema and code paths.
+OFFLINE_DB_URL = "sqlite:///servicepack.db"
+
+# ---------------- Schema ----------------
+# The one schema definition. A new database (Postgres or SQLite) is created
+# from it directly; MIGRATIONS below upgrade Postgres databases created by
+# earlier versions and must leave them matching these tables.
+metadata = MetaData()
+
+TS = DateTime(timezone=True)
+Id = BigInteger().with_variant(Integer, "sqlite")  # SQLite only autoincrements INTEGER PRIMARY KEY
+
+products = Table(
+    "products", metadata,
+    Column("code", Text, primary_key=True),
+    Column("name", Text),
+    Column("name_key", Text),
+    Column("grup_sku", Text),
+    Column("purchase_price_no_vat", Numeric),
+    Column("purchase_price_with_vat", Numeric),
+    Column("sale_price_no_vat", Numeric),
+    Column("sale_price_with_vat", Numeric),
+    Column("sale_price_site_109", Numeric),
+    Column("profit_lei", Numeric),
+    Column("profit_pct", Numeric),
+    Column("row_hash", Text),  # content hash of the imported fields (importers.PRODUCT_HASH_COLUMNS)
+    # Legacy wide competitor columns, superseded by competitor_prices (not written)
+    *[Column(f"competitor_{c}", Numeric) for c in ("gsmnet", "moka", "sep", "square", "ecranegsm", "distrizone")],
+    Column("created_at", TS, server_default=func.now()),
+    Column("updated_at", TS, server_default=func.now()),
+    Index("idx_products_namekey", "name_key"),
+    Index("idx_products_namekey_code", "name_key", "code"),
+)
+
+stock_moves = Table(
+    "stock_moves", metadata,
+    Column("id", Id, primary_key=True, autoincrement=True),
+    Column("code", Text, ForeignKey("products.code", ondelete="SET NULL")),
+    Column("product_name", Text),
+    Column("stoc_initial", Numeric),
+    Column("intrari", Numeric),
+    Column("iesiri", Numeric),
+    Column("stoc_final", Numeric),
+    Column("period_start", Date),
+    Column("period_end", Date),
+    Column("source_tag", Text),
+    Column("uploaded_at", TS, server_default=func.now()),
+    Column("sb_code", Text),
+    Index("idx_moves_code", "code"),
+    Index("idx_moves_period", "period_start", "period_end"),
+    Index("idx_moves_partition", "source_tag", "period_start", "period_end"),
+)
+
+sku_period_totals = Table(
+    "sku_period_totals", metadata,
+    Column("sku", Text, nullable=False),
+    Column("source_tag", Text, nullable=False),
+    Column("period_start", Date, nullable=False),
+    Column("period_end", Date, nullable=False),
+    Column("product_name", Text),
+    Column("intrari", Numeric),
+    Column("iesiri", Numeric),
+    Column("stoc_final", Numeric),
+    PrimaryKeyConstraint("source_tag", "period_start", "period_end", "sku"),
+    Index("idx_totals_sku", "sku"),
+)
+
+name_matches = Table(
+    "name_matches", metadata,
+    Column("sb_code", Text, primary_key=True),
+    Column("product_name", Text),
+    Column("name_key", Text),
+    Column("code", Text),
+    Column("score", Numeric),
+    Column("status", Text),
+    Column("index_version", BigInteger),  # matching.NameIndex.fingerprint it was scored against
+    Column("matched_at", TS, server_default=func.now()),
+    Index("idx_name_matches_status", "status"),
+)
+
+imports = Table(
+    "imports", metadata,
+    Column("content_hash", Text, primary_key=True),
+    Column("kind", Text, primary_key=True),
+    Column("scope", Text, primary_key=True, server_default=""),
+    Column("filename", Text),
+    Column("rows", Integer),
+    Column("applied_at", TS, server_default=func.now()),
+)
+
+import_jobs = Table(
+    "import_jobs", metadata,
+    Column("id", Id, primary_key=True, autoincrement=True),
+    Column("kind", Text, nullable=False),
+    Column("filename", Text),
+    Column("content_hash", Text),
+    Column("scope", Text, nullable=False, server_default=""),
+    Column("params", Text),
+    Column("spool_path", Text),
+    Column("state", Text, nullable=False),
+    Column("rows_done", Integer, server_default=text("0")),
+    Column("rows_total", Integer),
+    Column("stats", Text),
+    Column("error", Text),
+    Column("created_at", TS, server_default=func.now()),
+    Column("started_at", TS),
+    Column("finished_at", TS),
+    Index("idx_import_jobs_hash", "content_hash", "kind", "scope"),
+    Index("idx_import_jobs_state", "state"),
+)
+
+competitor_prices = Table(
+    "competitor_prices", metadata,
+    Column("id", Id, primary_key=True, autoincrement=True),
+    Column("code", Text, ForeignKey("products.code", ondelete="CASCADE"), nullable=False),
+    Column("competitor", Text, nullable=False),
+    Column("price", Numeric),
+    Column("observed_at", TS, nullable=False, server_default=func.now()),
+)
+Index("idx_cprices_code_time", competitor_prices.c.code, competitor_prices.c.observed_at)
+Index("idx_cprices_latest", competitor_prices.c.code, competitor_prices.c.competitor,
+      competitor_prices.c.observed_at.desc())
+
+# Single-row counter bumped by every write to products (catalog.catalog_write)
+data_version_table = Table(
+    "data_version", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("version", BigInteger, nullable=False, server_default=text("0")),
+)
+
+schema_version_table = Table(
+    "schema_version", metadata,
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("applied_at", TS, server_default=func.now()),
+)
+
+# Postgres-only search support (trigram name search, code prefix match)
+event.listen(metadata, "before_create",
+             DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
+for _ddl in (
+    "CREATE INDEX IF NOT EXISTS idx_products_namekey_trgm ON products USING gin (name_key gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS idx_products_code_prefix ON products (lower(code) text_pattern_ops)",
+):
+    event.listen(products, "after_create", DDL(_ddl).execute_if(dialect="postgresql"))
+
+# ---------------- Offline SQLite tuning ----------------
+# The shared SQL needs IS DISTINCT FROM, RETURNING, UPDATE ... FROM and
+# FULL OUTER JOIN; the last one arrived in SQLite 3.39
+MIN_SQLITE_VERSION = (3, 39, 0)
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",        # readers don't block the import writer
+    "synchronous": "NORMAL",      # fsync at checkpoints only; safe with WAL
+    "cache_size": -262144,        # 256 MB page cache (negative = KiB)
+    "mmap_size": 1 << 30,         # read through a 1 GB memory map
+    "temp_store": "MEMORY",       # staging tables stay in RAM
+    "busy_timeout": 30000,        # wait for the writer instead of failing
+    "foreign_keys": "ON",
+}
+
+def _sqlite_now() -> str:
+    # Same text format as CURRENT_TIMESTAMP (UTC), plus microseconds
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+def _tune_sqlite(dbapi_conn, _record) -> None:
+    cur = dbapi_conn.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cur.execute(f"PRAGMA {name}={value}")
+    cur.close()
+    # The shared SQL says now(), as on Postgres
+    dbapi_conn.create_function("now", 0, _sqlite_now)
+
+# ---------------- Shared engine + versioned migrations ----------------
+# Streamlit re-executes app.py on every interaction, but imported modules stay
+# loaded, so module-level state here lives for the whole server process.
+
+HEALTH_CHECK_INTERVAL = 60.0  # seconds between "SELECT 1" probes per engine
+
+_engines: Dict[str, Engine] = {}
+_last_ping: Dict[str, float] = {}
+_migrated: set = set()
+_lock = threading.Lock()
+
+def get_engine(db_url: str) -> Engine:
+    """One engine (and connection pool) per DB_URL, shared across sessions and reruns."""
+    eng = _engines.get(db_url)
+    if eng is not None:
+        return eng
+    with _lock:
+        eng = _engines.get(db_url)
+        if eng is None:
+            if db_url.startswith("sqlite"):
+                if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+                    raise RuntimeError(
+                        f"Modul offline cere SQLite {'.'.join(map(str, MIN_SQLITE_VERSION))}+, "
+                        f"Python-ul acesta are {sqlite3.sqlite_version}. Actualizează Python-ul."
+                    )
+                eng = create_engine(db_url, future=True)
+                event.listen(eng, "connect", _tune_sqlite)
+            else:
+                # Neon/Supabase drop idle connections after a few minutes; recycle
+                # before that instead of pre-pinging on every checkout.
+                eng = create_engine(db_url, pool_size=5, max_overflow=5, pool_recycle=280, future=True)
+            _engines[db_url] = instrument_engine(eng)
+        return eng
+
+def dispose_engine(db_url: str) -> None:
+    with _lock:
+        eng = _engines.pop(db_url, None)
+        _last_ping.pop(db_url, None)
+        if eng is not None:
+            _migrated.discard(eng.url.render_as_string(hide_password=False))
+            eng.dispose()
+
+def check_health(db_url: str, max_age: float = HEALTH_CHECK_INTERVAL) -> Engine:
+    """Return the shared engine, running "SELECT 1" at most once per `max_age` seconds.
+    Raises on connection failure (and drops the engine so the next call starts fresh)."""
+    eng = get_engine(db_url)
+    now = time.monotonic()
+    if now - _last_ping.get(db_url, float("-inf")) < max_age:
+        return eng
+    try:
+        with eng.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    except Exception:
+        dispose_engine(db_url)
+        raise
+    _last_ping[db_url] = now
+    return eng
+
+# (version, DDL). Append new entries, never edit applied ones. 1-8 are Postgres
+# upgrades; later entries must also work on SQLite and keep `metadata` in step.
+MIGRATIONS: List[Tuple[int, str]] = [
+    (1, '''
+    CREATE TABLE IF NOT EXISTS products (
+        code TEXT PRIMARY KEY,
+        name TEXT,
+        name_key TEXT,
+        grup_sku TEXT,
+        purchase_price_no_vat NUMERIC,
+        purchase_price_with_vat NUMERIC,
+        sale_price_no_vat NUMERIC,
+        sale_price_with_vat NUMERIC,
+        sale_price_site_109 NUMERIC,
+        profit_lei NUMERIC,
+        profit_pct NUMERIC,
+        competitor_gsmnet NUMERIC,
+        competitor_moka NUMERIC,
+        competitor_sep NUMERIC,
+        competitor_square NUMERIC,
+        competitor_ecranegsm NUMERIC,
+        competitor_distrizone NUMERIC,
+        created_at TIMESTAMPTZ DEFAULT now(),
+        updated_at TIMESTAMPTZ DEFAULT now()
+    );
+
+    CREATE TABLE IF NOT EXISTS stock_moves (
+        id BIGSERIAL PRIMARY KEY,
+        code TEXT REFERENCES products(code) ON DELETE SET NULL,
+        product_name TEXT,
+        stoc_initial NUMERIC,
+        intrari NUMERIC,
+        iesiri NUMERIC,
+        stoc_final NUMERIC,
+        period_start DATE,
+        period_end DATE,
+        source_tag TEXT,
+        uploaded_at TIMESTAMPTZ DEFAULT now()
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_moves_code ON stock_moves(code);
+    CREATE INDEX IF NOT EXISTS idx_moves_period ON stock_moves(period_start, period_end);
+    CREATE INDEX IF NOT EXISTS idx_products_namekey ON products(name_key);
+    '''),
+    (2, '''
+    ALTER TABLE stock_moves ADD COLUMN IF NOT EXISTS sb_code TEXT;
+    UPDATE stock_moves SET sb_code = code WHERE sb_code IS NULL;
+    CREATE INDEX IF NOT EXISTS idx_moves_partition ON stock_moves(source_tag, period_start, period_end);
+    '''),
+    (3, '''
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    UPDATE products SET name_key = coalesce(lower(regexp_replace(trim(name), '\\s+', ' ', 'g')), '')
+        WHERE name_key IS NULL;
+    CREATE INDEX IF NOT EXISTS idx_products_namekey_trgm ON products USING gin (name_key gin_trgm_ops);
+    CREATE INDEX IF NOT EXISTS idx_products_code_prefix ON products (lower(code) text_pattern_ops);
+    CREATE INDEX IF NOT EXISTS idx_products_namekey_code ON products (name_key, code);
+    '''),
+    (4, '''
+    CREATE TABLE IF NOT EXISTS sku_period_totals (
+        sku TEXT NOT NULL,
+        source_tag TEXT NOT NULL,
+        period_start DATE NOT NULL,
+        period_end DATE NOT NULL,
+        product_name TEXT,
+        intrari NUMERIC,
+        iesiri NUMERIC,
+        stoc_final NUMERIC,
+        PRIMARY KEY (source_tag, period_start, period_end, sku)
+    );
+    CREATE INDEX IF NOT EXISTS idx_totals_sku ON sku_period_totals(sku);
+    INSERT INTO sku_period_totals (sku, source_tag, period_start, period_end, product_name, intrari, iesiri, stoc_final)
+    SELECT coalesce(code, sb_code), source_tag, period_start, period_end, max(product_name),
+           sum(intrari), sum(iesiri), sum(stoc_final)
+    FROM stock_moves
+    WHERE coalesce(code, sb_code) IS NOT NULL
+      AND source_tag IS NOT NULL AND period_start IS NOT NULL AND period_end IS NOT NULL
+    GROUP BY source_tag, period_start, period_end, coalesce(code, sb_code)
+    ON CONFLICT DO NOTHING;
+    '''),
+    (5, '''
+    CREATE TABLE IF NOT EXISTS name_matches (
+        sb_code TEXT PRIMARY KEY,
+        product_name TEXT,
+        name_key TEXT,
+        code TEXT,
+        score NUMERIC,
+        status TEXT,
+        matched_at TIMESTAMPTZ DEFAULT now()
+    );
+    CREATE INDEX IF NOT EXISTS idx_name_matches_status ON name_matches(status);
+    '''),
+    (6, '''
+    CREATE TABLE IF NOT EXISTS imports (
+        content_hash TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        scope TEXT NOT NULL DEFAULT '',
+        filename TEXT,
+        rows INTEGER,
+        applied_at TIMESTAMPTZ DEFAULT now(),
+        PRIMARY KEY (content_hash, kind, scope)
+    );
+    '''),
+    (7, '''
+    CREATE TABLE IF NOT EXISTS import_jobs (
+        id BIGSERIAL PRIMARY KEY,
+        kind TEXT NOT NULL,
+        filename TEXT,
+        content_hash TEXT,
+        scope TEXT NOT NULL DEFAULT '',
+        params TEXT,
+        spool_path TEXT,
+        state TEXT NOT NULL,
+        rows_done INTEGER DEFAULT 0,
+        rows_total INTEGER,
+        stats TEXT,
+        error TEXT,
+        created_at TIMESTAMPTZ DEFAULT now(),
+        started_at TIMESTAMPTZ,
+        finished_at TIMESTAMPTZ
+    );
+    CREATE INDEX IF NOT EXISTS idx_import_jobs_hash ON import_jobs(content_hash, kind, scope);
+    CREATE INDEX IF NOT EXISTS idx_import_jobs_state ON import_jobs(state);
+    '''),
+    # Competitor prices move to a long history table; the wide competitor_*
+    # columns on products are kept as-is (backfilled here, no longer written).
+    (8, '''
+    CREATE TABLE IF NOT EXISTS competitor_prices (
+        id BIGSERIAL PRIMARY KEY,
+        code TEXT NOT NULL REFERENCES products(code) ON DELETE CASCADE,
+        competitor TEXT NOT NULL,
+        price NUMERIC,
+        observed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    CREATE INDEX IF NOT EXISTS idx_cprices_code_time ON competitor_prices(code, observed_at);
+    CREATE INDEX IF NOT EXISTS idx_cprices_latest ON competitor_prices(code, competitor, observed_at DESC);
+    INSERT INTO competitor_prices (code, competitor, price, observed_at)
+    SELECT p.code, c.competitor, c.price, coalesce(p.updated_at, now())
+    FROM products p
+    CROSS JOIN LATERAL (VALUES
+        ('gsmnet', p.competitor_gsmnet), ('moka', p.competitor_moka), ('sep', p.competitor_sep),
+        ('square', p.competitor_square), ('ecranegsm', p.competitor_ecranegsm),
+        ('distrizone', p.competitor_distrizone)
+    ) AS c(competitor, price)
+    WHERE c.price IS NOT NULL;
+    '''),
+    # Rows imported before this have no hash yet; their next import rewrites them once.
+    (9, '''
+    ALTER TABLE products ADD COLUMN row_hash TEXT;
+    '''),
+    (10, '''
+    CREATE TABLE IF NOT EXISTS data_version (
+        id INTEGER PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 0
+    );
+    '''),
+    (11, '''
+    ALTER TABLE name_matches ADD COLUMN index_version BIGINT;
+    '''),
+]
+
+def _split_sql(ddl: str) -> List[str]:
+    return [s.strip() for s in ddl.split(";") if s.strip()]
+
+def schema_version(conn) -> int:
+    schema_version_table.create(conn, checkfirst=True)
+    return conn.execute(text("SELECT coalesce(max(version), 0) FROM schema_version")).scalar() or 0
+
+def run_migrations(engine: Engine) -> int:
+    """Bring the schema up to date once; later calls in the same process are no-ops.
+    An empty database is created from `metadata` and stamped with every
+    migration version; an older one gets the pending MIGRATIONS.
+    Returns the number of versions applied."""
+    key = engine.url.render_as_string(hide_password=False)
+    if key in _migrated:
+        return 0
+    applied = 0
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            # Serialize concurrent app processes migrating the same database.
+            conn.execute(text("SELECT pg_advisory_xact_lock(728310)"))
+        current = schema_version(conn)
+        if current == 0 and not inspect(conn).has_table("products"):
+            metadata.create_all(conn)
+            pending = [v for v, _ in MIGRATIONS]
+        else:
+            pending = []
+            for version, ddl in MIGRATIONS:
+                if version <= current:
+                    continue
+                for stmt in _split_sql(ddl):
+                    conn.execute(text(stmt))
+                pending.append(version)
+        for version in pending:
+            conn.execute(text("INSERT INTO schema_version(version) VALUES (:v)"), {"v": version})
+        applied = len(pending)
+    _migrated.add(key)
+    return applied
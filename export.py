@@ -0,0 +1,153 @@
+from __future__ import annotations
+import os
+import tempfile
+from decimal import Decimal
+from typing import Any, Callable, Dict, IO, Iterable, Iterator, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xlsxwriter
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+# Report exports stream rows from a server-side cursor straight into the
+# output file, chunk by chunk, so peak memory doesn't grow with the row count.
+EXPORT_CHUNK_ROWS = 5000
+FORMATS = ("xlsx", "csv", "parquet")
+MIME = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+    "parquet": "application/octet-stream",
+}
+
+# Named catalog-wide exports; the profitability columns are computed in SQL
+EXPORTS: Dict[str, str] = {
+    "produse_profitabilitate": '''
+        SELECT code, name, grup_sku, purchase_price_no_vat, sale_price_no_vat,
+               sale_price_no_vat - purchase_price_no_vat AS profit_no_vat,
+               -- 100.0 first: SQLite keeps whole NUMERIC values as INTEGER and would divide as integers
+               CASE WHEN sale_price_no_vat > 0
+                    THEN 100.0 * (sale_price_no_vat - purchase_price_no_vat) / sale_price_no_vat END AS margin_pct,
+               CASE WHEN purchase_price_no_vat > 0
+                    THEN 100.0 * (sale_price_no_vat - purchase_price_no_vat) / purchase_price_no_vat END AS markup_pct,
+               updated_at
+        FROM products ORDER BY code''',
+    "totaluri_miscari": '''
+        SELECT source_tag, period_start, period_end, sku, product_name, intrari, iesiri, stoc_final
+        FROM sku_period_totals ORDER BY source_tag, period_start, sku''',
+    "istoric_concurenta": '''
+        SELECT code, competitor, price, observed_at
+        FROM competitor_prices ORDER BY code, competitor, observed_at''',
+}
+
+# ---------------- Sources ----------------
+def _plain(df: pd.DataFrame) -> pd.DataFrame:
+    # NUMERIC comes back as Decimal on Postgres and as int or float per value
+    # on SQLite, so a chunk of whole prices would come out int64 and the next
+    # one float64: numbers are always float64. Timestamps with tz don't fit xlsx.
+    for c in df.columns:
+        s = df[c]
+        if s.dtype == object:
+            first = s.dropna().head(1)
+            if len(first) and isinstance(first.iloc[0], Decimal):
+                df[c] = pd.to_numeric(s, errors="coerce").astype(float)
+        elif pd.api.types.is_integer_dtype(s.dtype):
+            df[c] = s.astype(float)
+        elif isinstance(s.dtype, pd.DatetimeTZDtype):
+            df[c] = s.dt.tz_localize(None)
+    return df
+
+def iter_query(engine: Engine, sql: str, params: Optional[Dict[str, Any]] = None,
+               chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Yield the result of `sql` as DataFrames of `chunk_rows` rows, fetched
+    through a server-side cursor (stream_results / yield_per)."""
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_rows).execute(text(sql), params or {})
+        cols = list(result.keys())
+        for part in result.partitions(chunk_rows):
+            yield _plain(pd.DataFrame(part, columns=cols))
+
+def iter_frame(df: pd.DataFrame, chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    for i in range(0, len(df), chunk_rows):
+        yield df.iloc[i:i + chunk_rows]
+
+# ---------------- Writers ----------------
+def write_xlsx(chunks: Iterable[pd.DataFrame], path: str, sheet_name: str = "raport") -> int:
+    # constant_memory: xlsxwriter flushes each row to disk once the next one starts.
+    # DATE columns come back from Postgres as datetime.date objects, which
+    # write_row() writes with default_date_format (else as bare serial numbers).
+    wb = xlsxwriter.Workbook(path, {"constant_memory": True, "nan_inf_to_errors": True,
+                                    "default_date_format": "yyyy-mm-dd"})
+    ws = wb.add_worksheet(sheet_name[:31])
+    date_fmt = wb.add_format({"num_format": "yyyy-mm-dd hh:mm"})
+    r = 0
+    try:
+        for df in chunks:
+            if r == 0:
+                ws.write_row(0, 0, [str(c) for c in df.columns])
+                r = 1
+            dates = [i for i, t in enumerate(df.dtypes) if pd.api.types.is_datetime64_any_dtype(t)]
+            for row in df.astype(object).where(df.notna(), None).itertuples(index=False):
+                for i in dates:
+                    if row[i] is not None:
+                        ws.write_datetime(r, i, row[i].to_pydatetime(), date_fmt)
+                ws.write_row(r, 0, [None if i in dates else v for i, v in enumerate(row)])
+                r += 1
+    finally:
+        wb.close()
+    return max(r - 1, 0)
+
+def write_csv(chunks: Iterable[pd.DataFrame], path: str) -> int:
+    n = 0
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        for df in chunks:
+            df.to_csv(f, index=False, header=(n == 0))
+            n += len(df)
+    return n
+
+def write_parquet(chunks: Iterable[pd.DataFrame], path: str) -> int:
+    n, writer, schema = 0, None, None
+    try:
+        for df in chunks:
+            if writer is None:
+                # All-NULL columns in the first chunk would pin the type to null
+                schema = pa.Schema.from_pandas(df, preserve_index=False)
+                schema = pa.schema([pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f for f in schema])
+                writer = pq.ParquetWriter(path, schema)
+            # ... and the values those columns get in later chunks are written as text
+            texts = [f.name for f in schema if pa.types.is_string(f.type)
+                     and not (df[f.name].dtype == object or pd.api.types.is_string_dtype(df[f.name].dtype))]
+            if texts:
+                df = df.copy()
+                for c in texts:
+                    df[c] = df[c].astype(object).where(df[c].isna(), df[c].astype(str))
+            writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+            n += len(df)
+    finally:
+        if writer is not None:
+            writer.close()
+    return n
+
+WRITERS: Dict[str, Callable[[Iterable[pd.DataFrame], str], int]] = {
+    "xlsx": write_xlsx, "csv": write_csv, "parquet": write_parquet,
+}
+
+def write_chunks(chunks: Iterable[pd.DataFrame], path: str, fmt: Optional[str] = None) -> int:
+    """Write frames to `path`; format from `fmt` or the file extension. Returns rows written."""
+    fmt = fmt or os.path.splitext(path)[1].lstrip(".").lower()
+    if fmt not in WRITERS:
+        raise ValueError(f"Format necunoscut: {fmt} (xlsx, csv, parquet)")
+    return WRITERS[fmt](chunks, path)
+
+def export_to_file(chunks: Iterable[pd.DataFrame], fmt: str) -> IO[bytes]:
+    """Write to a temp file and return it opened for reading (already unlinked,
+    so it disappears once closed). Suits st.download_button(data=callable)."""
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}")
+    os.close(fd)
+    try:
+        write_chunks(chunks, path, fmt)
+        f = open(path, "rb")
+    finally:
+        os.unlink(path)
+    return f
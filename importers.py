@@ -0,0 +1,351 @@
+from __future__ import annotations
+from datetime import date, timedelta
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from openpyxl import load_workbook
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+import parse_cache
+from catalog import catalog_write
+from parse_cache import cached_chunks, file_digest
+from perf import timed, timed_iter
+from sales_summary import refresh_partition_from_stage
+from storage import copy_frame, create_stage, upsert_sql, xact_lock
+from utils import clean_header, find_col, norm_name_series, row_digest, to_num
+
+CHUNK_ROWS = 5000
+PARSER_VERSION = 3  # bump when normalization changes, invalidates the parse cache
+
+# Candidate headers for the products workbook (first match wins)
+PRODUCT_IMPORT_COLUMNS = {
+    "name": ["nume", "name", "denumire", "produs"],
+    "code": ["cod", "sku", "cod.1", "product code", "id"],
+    "purchase_price_no_vat": ["pret intrare fara tva", "pret achizitie", "pret achiziție fara tva", "pret achiziție"],
+    "sale_price_no_vat": ["pret vanzare fara tva", "pret vânzare fara tva", "pret fara tva"],
+}
+
+# Imported fields covered by products.row_hash; a row whose hash is unchanged is not rewritten
+PRODUCT_HASH_COLUMNS = ["name", "purchase_price_no_vat", "sale_price_no_vat"]
+
+PRODUCT_STAGE_COLUMNS = ["seq", "code", "name", "name_key", "purchase_price_no_vat", "sale_price_no_vat", "row_hash"]
+
+PRODUCT_CACHE_SCHEMA = pa.schema([
+    ("code", pa.string()), ("name", pa.string()), ("name_key", pa.string()),
+    ("purchase_price_no_vat", pa.float64()), ("sale_price_no_vat", pa.float64()), ("row_hash", pa.string()),
+])
+
+ProgressFn = Callable[[int, Optional[int]], None]
+
+# ---------------- Streaming Excel reader ----------------
+def _header_names(values) -> List[str]:
+    # Mirror pandas.read_excel: blank headers -> "Unnamed: i", duplicates -> "x.1", "x.2"
+    names, seen = [], {}
+    for i, v in enumerate(values):
+        name = f"Unnamed: {i}" if v is None or str(v).strip() == "" else str(v)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+def iter_excel_chunks(file, header: int = 0, chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Yield the first sheet as DataFrames of at most `chunk_rows` rows.
+    Uses openpyxl read-only mode, so memory stays bounded by the chunk size.
+    Columns get the same cleanup as the import tabs (Unnamed dropped, lowercased).
+    Cells stay as openpyxl returns them (object columns): a per-chunk type guess
+    would turn int codes into "111.0" in any chunk that also has a blank code.
+    The normalizers convert the numeric columns themselves."""
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        rows = ws.iter_rows(values_only=True)
+        for _ in range(header):
+            next(rows, None)
+        head = next(rows, None)
+        if head is None:
+            return
+        names = _header_names(head)
+        keep = [i for i, n in enumerate(names) if not n.lower().startswith("unnamed")]
+        cols = clean_header([names[i] for i in keep])
+        buf = []
+        for r in rows:
+            if r is None or all(v is None for v in r):
+                continue
+            buf.append([r[i] if i < len(r) else None for i in keep])
+            if len(buf) >= chunk_rows:
+                yield pd.DataFrame(buf, columns=cols, dtype=object)
+                buf = []
+        if buf:
+            yield pd.DataFrame(buf, columns=cols, dtype=object)
+    finally:
+        wb.close()
+
+def excel_row_count(file, header: int = 0) -> Optional[int]:
+    # Read-only sheets report the stored dimension; it can be missing, hence Optional.
+    wb = load_workbook(file, read_only=True)
+    try:
+        n = wb.worksheets[0].max_row
+    finally:
+        wb.close()
+    if hasattr(file, "seek"):
+        file.seek(0)
+    return max(n - header - 1, 0) if n else None
+
+# ---------------- Import ledger ----------------
+# One row per applied upload, keyed by content hash + what it was applied to,
+# so Streamlit reruns with the file still in the uploader don't re-import it.
+KIND_PRODUCTS = "products"
+KIND_MOVES = "moves"
+
+def ledger_lookup(engine: Engine, digest: str, kind: str, scope: str = "") -> Optional[Dict[str, object]]:
+    with engine.connect() as conn:
+        row = conn.execute(text(
+            "SELECT rows, applied_at FROM imports WHERE content_hash=:h AND kind=:k AND scope=:s"
+        ), {"h": digest, "k": kind, "s": scope}).mappings().first()
+    return dict(row) if row else None
+
+def source_name(file) -> str:
+    return getattr(file, "name", str(file))
+
+def record_import(conn: Connection, digest: str, kind: str, scope: str, filename: str, rows: int) -> None:
+    conn.execute(text(
+        "INSERT INTO imports (content_hash, kind, scope, filename, rows) VALUES (:h, :k, :s, :f, :n) "
+        "ON CONFLICT (content_hash, kind, scope) DO UPDATE SET "
+        "filename=EXCLUDED.filename, rows=EXCLUDED.rows, applied_at=now()"
+    ), {"h": digest, "k": kind, "s": scope, "f": filename, "n": rows})
+
+# ---------------- Products ----------------
+@timed("normalize_product_chunk")
+def normalize_product_chunk(raw: pd.DataFrame) -> pd.DataFrame:
+    def col(key, default):
+        c = find_col(raw.columns, PRODUCT_IMPORT_COLUMNS[key])
+        return raw[c] if c is not None else default
+
+    empty = pd.Series("", index=raw.index, dtype="object")
+    missing = pd.Series(np.nan, index=raw.index, dtype=float)
+    df = pd.DataFrame(index=raw.index)
+    df["code"] = col("code", empty).fillna("").astype(str).str.strip()
+    df["name"] = col("name", empty).fillna("").astype(str).str.strip()
+    df["purchase_price_no_vat"] = to_num(col("purchase_price_no_vat", missing)).astype(float)
+    df["sale_price_no_vat"] = to_num(col("sale_price_no_vat", missing)).astype(float)
+    df = df[df["code"].str.len() > 0].copy()
+    df["name_key"] = norm_name_series(df["name"])
+    df["row_hash"] = row_digest(df, PRODUCT_HASH_COLUMNS)
+    return df.reset_index(drop=True)
+
+# Last staged row per code (row_number rather than DISTINCT ON, so SQLite runs it
+# too), kept only when it is new or its hash differs from the stored one.
+PRODUCT_CHANGES_SQL = '''
+INSERT INTO _stage_product_changes
+SELECT s.code, s.name, s.name_key, s.purchase_price_no_vat, s.sale_price_no_vat, s.row_hash,
+       CASE WHEN p.code IS NULL THEN 1 ELSE 0 END
+FROM (SELECT *, row_number() OVER (PARTITION BY code ORDER BY seq DESC) AS rn FROM _stage_products) s
+LEFT JOIN products p ON p.code = s.code
+WHERE s.rn = 1 AND (p.code IS NULL OR p.row_hash IS DISTINCT FROM s.row_hash)
+'''
+
+# Only the changed rows reach products, so unchanged ones cost no write and keep updated_at
+PRODUCT_MERGE_COLUMNS = ["code", "name", "name_key", "purchase_price_no_vat", "sale_price_no_vat", "row_hash"]
+PRODUCT_MERGE_SQL = upsert_sql("products", "_stage_product_changes", PRODUCT_MERGE_COLUMNS, keys=["code"])
+
+def iter_product_chunks(file, digest: Optional[str] = None,
+                        chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Normalized product frames, served from the parse cache when the same
+    file content was parsed before."""
+    digest = digest or file_digest(file)
+    return cached_chunks(
+        f"products-v{PARSER_VERSION}-{digest}", PRODUCT_CACHE_SCHEMA,
+        lambda: (normalize_product_chunk(raw)
+                 for raw in timed_iter("read_excel", iter_excel_chunks(file, header=0, chunk_rows=chunk_rows))),
+    )
+
+def import_products(engine: Engine, file, progress: Optional[ProgressFn] = None,
+                    chunk_rows: int = CHUNK_ROWS, force: bool = False,
+                    filename: Optional[str] = None) -> Dict[str, object]:
+    """Stream a products workbook into `products`.
+    Chunks are COPY'd into a temp staging table; one join against products keeps
+    the codes that are new or whose row_hash changed, and only those are merged
+    with INSERT ... SELECT ... ON CONFLICT. The last occurrence of a duplicate code wins.
+    All of it runs in one transaction, so a failed import leaves `products` untouched.
+    A file whose content is already in the `imports` ledger is skipped unless `force`.
+    `filename` is what the ledger records (default: the file's own name)."""
+    digest = file_digest(file)
+    if not force:
+        prev = ledger_lookup(engine, digest, KIND_PRODUCTS)
+        if prev is not None:
+            return {"skipped": True, "rows": prev["rows"], "applied_at": prev["applied_at"]}
+    key = f"products-v{PARSER_VERSION}-{digest}"
+    total = parse_cache.cached_rows(key)
+    if total is None:
+        total = excel_row_count(file)
+    staged = 0
+    with catalog_write(engine) as conn:
+        create_stage(conn, "_stage_products",
+                     "seq BIGINT, code TEXT, name TEXT, name_key TEXT, "
+                     "purchase_price_no_vat NUMERIC, sale_price_no_vat NUMERIC, row_hash TEXT")
+        for df in iter_product_chunks(file, digest, chunk_rows):
+            df["seq"] = np.arange(staged, staged + len(df))  # file order, last duplicate wins
+            copy_frame(conn, "_stage_products", df, PRODUCT_STAGE_COLUMNS)
+            staged += len(df)
+            if progress:
+                progress(staged, total)
+        create_stage(conn, "_stage_product_changes",
+                     "code TEXT, name TEXT, name_key TEXT, purchase_price_no_vat NUMERIC, "
+                     "sale_price_no_vat NUMERIC, row_hash TEXT, is_new INTEGER")
+        conn.execute(text(PRODUCT_CHANGES_SQL))
+        codes, inserted, updated = conn.execute(text(
+            "SELECT (SELECT count(DISTINCT code) FROM _stage_products), "
+            "coalesce(sum(is_new), 0), coalesce(sum(1 - is_new), 0) FROM _stage_product_changes"
+        )).one()
+        if inserted or updated:
+            conn.execute(text(PRODUCT_MERGE_SQL))
+        record_import(conn, digest, KIND_PRODUCTS, "", filename or source_name(file), staged)
+    return {"skipped": False, "rows": staged, "inserted": int(inserted), "updated": int(updated),
+            "unchanged": int(codes - inserted - updated)}
+
+# ---------------- SmartBill stock moves ----------------
+SOURCE_YEAR = "sb_an"
+SOURCE_30D = "sb_30z"
+
+def default_period(source_tag: str, today: Optional[date] = None) -> Tuple[date, date]:
+    """Default period of an export, shared by the app and the CLI so the same file
+    lands in the same (source_tag, period) partition and ledger scope from both:
+    the year so far, or the last 30 days (today included) for the 30-day export.
+    The replenishment report divides the exits by this period's length."""
+    today = today or date.today()
+    start = date(today.year, 1, 1) if source_tag == SOURCE_YEAR else today - timedelta(days=29)
+    return start, today
+
+MOVE_STAGE_COLUMNS = ["sb_code", "product_name", "stoc_initial", "intrari", "iesiri", "stoc_final"]
+
+MOVE_CACHE_SCHEMA = pa.schema([
+    ("code", pa.string()), ("product_name", pa.string()), ("stoc_initial", pa.float64()),
+    ("intrari", pa.float64()), ("iesiri", pa.float64()), ("stoc_final", pa.float64()),
+])
+
+def sb_columns(columns) -> Dict[str, Optional[str]]:
+    """Locate the SmartBill columns (by name, falling back to export position)."""
+    columns = list(columns)
+
+    def find(kws):
+        for c in columns:
+            if all(kw in c for kw in kws):
+                return c
+        return None
+
+    def at(i):
+        return columns[i] if len(columns) > i else None
+
+    c_iesiri = find_col(columns, ["iesiri", "ieșiri"]) or at(4)
+    return {
+        "product_name": find_col(columns, ["produs", "denumire", "nume"]),
+        "code": "cod" if "cod" in columns else at(1),
+        "stoc_initial": find(["stoc", "initial"]) or at(2),
+        "intrari": "intrari" if "intrari" in columns else at(3),
+        "iesiri": c_iesiri,
+        "stoc_final": find(["stoc", "final"]),
+    }
+
+@timed("normalize_sb_chunk")
+def normalize_sb_chunk(df: pd.DataFrame, cols: Optional[Dict[str, Optional[str]]] = None) -> pd.DataFrame:
+    cols = cols or sb_columns(df.columns)
+
+    def num(key, default=0):
+        return to_num(df[cols[key]]) if cols[key] else default
+
+    out = pd.DataFrame(index=df.index)
+    out["code"] = df[cols["code"]].fillna("").astype(str).str.strip()
+    out["product_name"] = df[cols["product_name"]].fillna("").astype(str).str.strip() if cols["product_name"] else ""
+    out["stoc_initial"] = num("stoc_initial")
+    out["intrari"] = num("intrari")
+    out["iesiri"] = num("iesiri", np.nan)
+    out["stoc_final"] = num("stoc_final", np.nan)
+    out[["stoc_initial", "intrari", "iesiri", "stoc_final"]] = out[["stoc_initial", "intrari", "iesiri", "stoc_final"]].astype(float)
+    # Drop footer/total rows without a product code
+    return out[out["code"].str.len() > 0].reset_index(drop=True)
+
+def _parse_sb_chunks(file, chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    # SmartBill exports carry a title row above the real header
+    cols = None
+    for raw in timed_iter("read_excel", iter_excel_chunks(file, header=1, chunk_rows=chunk_rows)):
+        cols = cols or sb_columns(raw.columns)
+        yield normalize_sb_chunk(raw, cols)
+
+def iter_sb_chunks(file, digest: Optional[str] = None, chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Normalized SmartBill frames, served from the parse cache when possible."""
+    digest = digest or file_digest(file)
+    return cached_chunks(f"moves-v{PARSER_VERSION}-{digest}", MOVE_CACHE_SCHEMA,
+                         lambda: _parse_sb_chunks(file, chunk_rows))
+
+def read_sb(file) -> pd.DataFrame:
+    chunks = list(iter_sb_chunks(file))
+    if not chunks:
+        return pd.DataFrame(columns=["code", "product_name", "stoc_initial", "intrari", "iesiri", "stoc_final"])
+    return pd.concat(chunks, ignore_index=True)
+
+MOVES_RESOLVE_SQL = '''
+UPDATE _stage_moves AS s SET code = p.code
+FROM products p
+WHERE p.code = s.sb_code
+'''
+
+MOVES_INSERT_SQL = '''
+INSERT INTO stock_moves (code, sb_code, product_name, stoc_initial, intrari, iesiri, stoc_final,
+                         period_start, period_end, source_tag)
+SELECT code, sb_code, product_name, stoc_initial, intrari, iesiri, stoc_final, :ps, :pe, :tag
+FROM _stage_moves
+'''
+
+def import_stock_moves(engine: Engine, file, period_start, period_end, source_tag: str,
+                       progress: Optional[ProgressFn] = None, chunk_rows: int = CHUNK_ROWS,
+                       force: bool = False, filename: Optional[str] = None) -> Dict[str, object]:
+    """Replace the (source_tag, period_start, period_end) partition of `stock_moves`
+    with the rows of a SmartBill export.
+    Rows are COPY'd into staging, codes are resolved against `products` with one
+    UPDATE ... FROM (unknown codes keep only `sb_code`, `code` stays NULL), then
+    the partition is deleted and re-inserted in the same transaction, so
+    re-importing a period is idempotent and readers never see a half-loaded period.
+    sku_period_totals is refreshed for the period in the same transaction.
+    The same file already applied to the same period is skipped unless `force`.
+    `filename` as in import_products."""
+    digest = file_digest(file)
+    scope = f"{source_tag}:{period_start}:{period_end}"
+    if not force:
+        prev = ledger_lookup(engine, digest, KIND_MOVES, scope)
+        if prev is not None:
+            return {"skipped": True, "rows": prev["rows"], "applied_at": prev["applied_at"]}
+    total = parse_cache.cached_rows(f"moves-v{PARSER_VERSION}-{digest}")
+    if total is None:
+        total = excel_row_count(file, header=1)
+    params = {"ps": period_start, "pe": period_end, "tag": source_tag}
+    staged = 0
+    with catalog_write(engine) as conn:
+        create_stage(conn, "_stage_moves",
+                     "code TEXT, sb_code TEXT, product_name TEXT, stoc_initial NUMERIC, intrari NUMERIC, "
+                     "iesiri NUMERIC, stoc_final NUMERIC")
+        for df in iter_sb_chunks(file, digest, chunk_rows):
+            df = df.rename(columns={"code": "sb_code"})
+            copy_frame(conn, "_stage_moves", df, MOVE_STAGE_COLUMNS)
+            staged += len(df)
+            if progress:
+                progress(staged, total)
+        # Two imports of the same partition must not interleave. Taken only
+        # now: staging touches temp tables alone, and on SQLite this is the
+        # database write lock, which would block the job's progress updates.
+        xact_lock(conn, f"{source_tag}{period_start}{period_end}")
+        resolved = conn.execute(text(MOVES_RESOLVE_SQL)).rowcount if staged else 0
+        replaced = conn.execute(text(
+            "DELETE FROM stock_moves WHERE source_tag=:tag AND period_start=:ps AND period_end=:pe"
+        ), params).rowcount
+        conn.execute(text(MOVES_INSERT_SQL), params)
+        # Keep the per-SKU totals in step with the raw rows (same transaction)
+        refresh_partition_from_stage(conn, source_tag, period_start, period_end)
+        record_import(conn, digest, KIND_MOVES, scope, filename or source_name(file), staged)
+    return {"skipped": False, "rows": staged, "resolved": resolved, "unknown": staged - resolved,
+            "replaced": replaced}
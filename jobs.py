@@ -0,0 +1,198 @@
+from __future__ import annotations
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from importers import KIND_MOVES, KIND_PRODUCTS, import_products, import_stock_moves
+from parse_cache import CACHE_DIR, file_digest
+from perf import read_sql, run as perf_run
+
+# Imports run as jobs on a process-wide worker pool, outside the Streamlit
+# script run: a rerun or browser refresh no longer kills an import halfway.
+# Every job is a row in import_jobs, which the UI polls.
+MAX_WORKERS = int(os.environ.get("SERVICEPACK_IMPORT_WORKERS", "3"))
+SPOOL_DIR = CACHE_DIR / "spool"
+SPOOL_KEEP_DAYS = 7  # a failed job stays retryable this long, then its spooled file is deleted
+PROGRESS_INTERVAL = 1.0  # seconds between progress writes
+
+STATE_QUEUED, STATE_RUNNING, STATE_DONE, STATE_SKIPPED, STATE_FAILED = "queued", "running", "done", "skipped", "failed"
+ACTIVE_STATES = (STATE_QUEUED, STATE_RUNNING)
+
+log = logging.getLogger(__name__)
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+_recovered: set = set()
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="import-job")
+        return _pool
+
+def _update(engine: Engine, job_id: int, stamp: Optional[str] = None, **cols) -> None:
+    # `stamp` names a timestamp column to set to now()
+    sets = [f"{c}=:{c}" for c in cols] + ([f"{stamp}=now()"] if stamp else [])
+    with engine.begin() as conn:
+        conn.execute(text(f"UPDATE import_jobs SET {', '.join(sets)} WHERE id=:id"), {**cols, "id": job_id})
+
+def _run(engine: Engine, job_id: int) -> None:
+    # Timings of the job show up in the perf panel as their own run
+    with perf_run(f"job #{job_id}"):
+        _run_job(engine, job_id)
+
+def _run_job(engine: Engine, job_id: int) -> None:
+    with engine.connect() as conn:
+        job = conn.execute(text("SELECT * FROM import_jobs WHERE id=:id"), {"id": job_id}).mappings().one()
+    params = json.loads(job["params"] or "{}")
+    _update(engine, job_id, stamp="started_at", state=STATE_RUNNING, error=None)
+    last = [0.0]
+
+    def on_progress(done, total):
+        now = time.monotonic()
+        if now - last[0] >= PROGRESS_INTERVAL:
+            last[0] = now
+            _update(engine, job_id, rows_done=done, rows_total=total)
+
+    try:
+        path = job["spool_path"]
+        force = bool(params.get("force"))
+        # The ledger records the uploaded name, not the spool path
+        if job["kind"] == KIND_PRODUCTS:
+            stats = import_products(engine, path, progress=on_progress, force=force, filename=job["filename"])
+        else:
+            stats = import_stock_moves(
+                engine, path, date.fromisoformat(params["period_start"]), date.fromisoformat(params["period_end"]),
+                params["source_tag"], progress=on_progress, force=force, filename=job["filename"],
+            )
+    except Exception as e:
+        log.exception("import job %s failed", job_id)
+        _update(engine, job_id, stamp="finished_at", state=STATE_FAILED, error=str(e)[:2000])
+        return
+    _update(engine, job_id, stamp="finished_at", state=STATE_SKIPPED if stats.get("skipped") else STATE_DONE,
+            rows_done=stats.get("rows"), stats=json.dumps(stats, default=str))
+    Path(path).unlink(missing_ok=True)
+
+def _spool(data: bytes, digest: str, filename: str) -> Path:
+    # One file per job: a finished job deletes its own copy, never one that
+    # another job (or a later retry of it) still needs
+    SPOOL_DIR.mkdir(parents=True, exist_ok=True)
+    path = SPOOL_DIR / f"{digest}-{uuid.uuid4().hex[:12]}{Path(filename).suffix or '.xlsx'}"
+    tmp = path.with_suffix(".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+    return path
+
+def purge_spool(engine: Engine, keep_days: float = SPOOL_KEEP_DAYS) -> int:
+    """Delete spooled files older than `keep_days` that no queued/running job
+    uses: those of failed jobs never retried, or left by a crash before the
+    job row was written. Returns the number of files deleted."""
+    if not SPOOL_DIR.exists():
+        return 0
+    cutoff = time.time() - keep_days * 86400
+    with engine.connect() as conn:
+        active = set(conn.execute(text(
+            "SELECT spool_path FROM import_jobs WHERE state IN ('queued', 'running')"
+        )).scalars())
+    n = 0
+    for f in SPOOL_DIR.iterdir():
+        try:
+            if f.stat().st_mtime < cutoff and str(f) not in active:
+                f.unlink()
+                n += 1
+        except FileNotFoundError:
+            pass
+    return n
+
+def active_job(engine: Engine, digest: str, kind: str, scope: str = "", force: bool = False) -> Optional[int]:
+    """The latest queued/running job for this content and target; with `force`,
+    only one that was itself submitted with force (a plain one may end up skipped)."""
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT id, params FROM import_jobs WHERE content_hash=:h AND kind=:k AND scope=:s "
+            "AND state IN ('queued', 'running') ORDER BY id DESC"
+        ), {"h": digest, "k": kind, "s": scope}).all()
+    for job_id, params in rows:
+        if not force or json.loads(params or "{}").get("force"):
+            return job_id
+    return None
+
+def submit_import(engine: Engine, kind: str, upload,
+                  params: Optional[Dict[str, Any]] = None) -> Tuple[int, bool]:
+    """Queue an import of `upload` (products or moves). Returns (job id, whether
+    a new job was queued). The upload is spooled to disk first, so the job
+    doesn't depend on the Streamlit session. A job already queued/running for
+    the same content and target is returned instead of starting a second one,
+    unless `force` is set and that job was not forced."""
+    params = dict(params or {})
+    for k in ("period_start", "period_end"):
+        if k in params:
+            params[k] = str(params[k])
+    scope = f"{params['source_tag']}:{params['period_start']}:{params['period_end']}" if kind == KIND_MOVES else ""
+    digest = file_digest(upload)
+    existing = active_job(engine, digest, kind, scope, force=bool(params.get("force")))
+    if existing is not None:
+        return existing, False
+    filename = getattr(upload, "name", "upload.xlsx")
+    purge_spool(engine)
+    path = _spool(upload.getvalue(), digest, filename)
+    with engine.begin() as conn:
+        job_id = conn.execute(text(
+            "INSERT INTO import_jobs (kind, filename, content_hash, scope, params, spool_path, state) "
+            "VALUES (:k, :f, :h, :s, :p, :sp, :st) RETURNING id"
+        ), {"k": kind, "f": filename, "h": digest, "s": scope, "p": json.dumps(params),
+            "sp": str(path), "st": STATE_QUEUED}).scalar()
+    _executor().submit(_run, engine, job_id)
+    return job_id, True
+
+def retry_job(engine: Engine, job_id: int) -> bool:
+    """Re-queue a failed job from its spooled file. Imports are transactional,
+    so a failed job left nothing behind and simply runs again."""
+    with engine.begin() as conn:
+        row = conn.execute(text(
+            "UPDATE import_jobs SET state=:q, error=NULL, rows_done=0, started_at=NULL, finished_at=NULL "
+            "WHERE id=:id AND state=:f RETURNING spool_path"
+        ), {"q": STATE_QUEUED, "f": STATE_FAILED, "id": job_id}).first()
+    if row is None or not row[0] or not Path(row[0]).exists():
+        if row is not None:
+            _update(engine, job_id, state=STATE_FAILED, error="Fișierul sursă nu mai există; reîncarcă-l.")
+        return False
+    _executor().submit(_run, engine, job_id)
+    return True
+
+def recover_interrupted(engine: Engine) -> int:
+    """Once per process: jobs left queued/running by a previous process can't
+    still be running, so mark them failed (and retryable)."""
+    key = engine.url.render_as_string(hide_password=False)
+    if key in _recovered:
+        return 0
+    _recovered.add(key)
+    with engine.begin() as conn:
+        return conn.execute(text(
+            "UPDATE import_jobs SET state=:f, error='Întrerupt (repornire server)', finished_at=now() "
+            "WHERE state IN ('queued', 'running')"
+        ), {"f": STATE_FAILED}).rowcount
+
+def list_jobs(engine: Engine, limit: int = 20) -> pd.DataFrame:
+    df = read_sql((
+        "SELECT id, kind, filename, scope, state, rows_done, rows_total, stats, error, "
+        "created_at, started_at, finished_at "
+        "FROM import_jobs ORDER BY id DESC LIMIT :n"
+    ), engine, params={"n": limit})
+    # Elapsed time in pandas: SQLite returns the timestamps as text
+    started = pd.to_datetime(df["started_at"], utc=True, errors="coerce", format="mixed")
+    finished = pd.to_datetime(df["finished_at"], utc=True, errors="coerce", format="mixed")
+    df["seconds"] = (finished.fillna(pd.Timestamp.now(tz="UTC")) - started).dt.total_seconds()
+    return df
@@ -0,0 +1,267 @@
+from __future__ import annotations
+import threading
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from catalog import catalog_write, load_catalog
+from perf import read_sql
+from storage import copy_frame, create_stage, upsert_sql
+from utils import norm_name_series
+
+AUTO_THRESHOLD = 0.85     # applied to grup_sku without review
+REVIEW_THRESHOLD = 0.60   # shown as a suggestion
+MIN_MARGIN = 0.05         # best must beat the runner-up by this much to auto-apply
+MAX_POSTING = 500         # features shared by more products than this don't block
+BLOCK_FEATURES = 3        # rarest features per name used for candidate generation
+CANDIDATES = 20           # candidates per name rescored exactly
+BATCH = 5000              # names per vectorized batch
+
+STATUS_AUTO, STATUS_REVIEW, STATUS_NONE, STATUS_APPLIED = "auto", "review", "none", "applied"
+
+# ---------------- Features ----------------
+def name_features(keys: pd.Series) -> pd.DataFrame:
+    """(row, feature) pairs for normalized names: word unigrams plus adjacent
+    word bigrams (bigrams like "iphone 11" block far better than "iphone")."""
+    words = keys.fillna("").str.split(" ").explode()
+    words = words[words.str.len() > 0]
+    uni = pd.DataFrame({"row": words.index.to_numpy(), "feature": words.to_numpy()})
+    nxt = uni.groupby("row")["feature"].shift(-1)
+    bi = uni[nxt.notna()].assign(feature=uni["feature"] + " " + nxt[nxt.notna()])
+    return pd.concat([uni, bi], ignore_index=True).drop_duplicates()
+
+@dataclass
+class NameIndex:
+    codes: np.ndarray          # row -> products.code
+    features: pd.Index         # feature id -> feature text
+    idf: np.ndarray            # feature id -> weight
+    norms: np.ndarray          # row -> sum of its feature weights
+    ptr: np.ndarray            # CSR offsets: rows of feature f are post_rows[ptr[f]:ptr[f+1]]
+    post_rows: np.ndarray
+    keys: np.ndarray           # sorted row * n_features + feature id, for membership tests
+    version: int = -1          # catalog data_version it was built from
+    fingerprint: int = 0       # hash of the indexed (code, name_key) pairs
+
+def build_index(codes: pd.Series, name_keys: pd.Series) -> NameIndex:
+    """Inverted index (feature -> product rows) over products.name_key."""
+    codes = codes.reset_index(drop=True)
+    feats = name_features(name_keys.reset_index(drop=True))
+    rows = feats["row"].to_numpy(np.int64)
+    fid, uniques = pd.factorize(feats["feature"])
+    n_feat = len(uniques)
+    dfreq = np.bincount(fid, minlength=n_feat)
+    idf = np.log1p(max(len(codes), 1) / np.maximum(dfreq, 1))
+    norms = np.bincount(rows, weights=idf[fid], minlength=len(codes))
+    order = np.argsort(fid, kind="stable")
+    return NameIndex(
+        codes=codes.to_numpy(), features=pd.Index(uniques), idf=idf, norms=norms,
+        ptr=np.concatenate([[0], np.cumsum(dfreq)]), post_rows=rows[order],
+        keys=np.sort(rows * n_feat + fid),
+    )
+
+def _group_rank(sorted_groups: np.ndarray) -> np.ndarray:
+    # 0-based position of each element inside its run of equal (pre-sorted) values
+    n = len(sorted_groups)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    starts = np.r_[0, np.flatnonzero(np.diff(sorted_groups)) + 1]
+    return np.arange(n) - np.repeat(starts, np.diff(np.r_[starts, n]))
+
+def _expand(ptr: np.ndarray, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # CSR gather: (index into `ids`, position in the CSR payload) for every member
+    lens = ptr[ids + 1] - ptr[ids]
+    owner = np.repeat(np.arange(len(ids)), lens)
+    pos = np.repeat(ptr[ids] - np.r_[0, np.cumsum(lens)[:-1]], lens) + np.arange(lens.sum())
+    return owner, pos
+
+def match_names(index: NameIndex, name_keys: pd.Series, block_features: int = BLOCK_FEATURES,
+                candidates: int = CANDIDATES, batch: int = BATCH) -> pd.DataFrame:
+    """Best product per query name. Columns: query (position in name_keys), code,
+    score (weighted Dice over all shared features, 0..1) and runner_up score.
+
+    Blocking: each query only looks at products sharing one of its
+    `block_features` rarest features (posting lists longer than MAX_POSTING are
+    skipped); the best `candidates` of those by blocking overlap are rescored
+    exactly. Queries are processed in batches so memory stays bounded."""
+    n_prod, n_feat = len(index.codes), len(index.features)
+    if n_prod == 0:
+        return _no_matches()
+    q = name_features(name_keys.reset_index(drop=True)).sort_values("row", kind="stable")
+    qrow = q["row"].to_numpy(np.int64)
+    qfid = index.features.get_indexer(q["feature"])
+    known = qfid >= 0
+    # Features never seen in the catalog get the maximum weight
+    qw = np.where(known, index.idf[np.where(known, qfid, 0)], np.log1p(max(n_prod, 1)))
+    n_q = len(name_keys)
+    qnorm = np.bincount(qrow, weights=qw, minlength=n_q)
+    qptr = np.r_[0, np.cumsum(np.bincount(qrow, minlength=n_q))]
+
+    # Blocking features: known, selective, `block_features` rarest per query
+    plen = index.ptr[1:] - index.ptr[:-1]
+    sel = known.copy()
+    sel[known] = plen[qfid[known]] <= MAX_POSTING
+    b_row, b_fid, b_w = qrow[sel], qfid[sel], qw[sel]
+    o = np.lexsort((-b_w, b_row))
+    b_row, b_fid, b_w = b_row[o], b_fid[o], b_w[o]
+    keep = _group_rank(b_row) < block_features
+    b_row, b_fid, b_w = b_row[keep], b_fid[keep], b_w[keep]
+
+    out = []
+    for lo in range(0, n_q, batch):
+        m = (b_row >= lo) & (b_row < lo + batch)
+        if not m.any():
+            continue
+        owner, pos = _expand(index.ptr, b_fid[m])
+        cq = b_row[m][owner]
+        cp = index.post_rows[pos]
+        # Coarse score over blocking features, keep the best candidates per query
+        pair, inv = np.unique(cq * n_prod + cp, return_inverse=True)
+        coarse = np.bincount(inv, weights=b_w[m][owner])
+        pq, pp = pair // n_prod, pair % n_prod
+        o = np.lexsort((-coarse, pq))
+        top = o[_group_rank(pq[o]) < candidates]
+        pq, pp = pq[top], pp[top]
+        # Exact rescoring: every query feature, tested against the product's feature set
+        owner, pos = _expand(qptr, pq)
+        f = qfid[pos]
+        key = pp[owner] * n_feat + np.where(f >= 0, f, 0)
+        hit = (f >= 0) & (index.keys[np.minimum(np.searchsorted(index.keys, key), len(index.keys) - 1)] == key)
+        shared = np.bincount(owner, weights=qw[pos] * hit, minlength=len(pq))
+        score = 2 * shared / (qnorm[pq] + index.norms[pp])
+        o = np.lexsort((-score, pq))
+        pq, pp, score = pq[o], pp[o], score[o]
+        r = _group_rank(pq)
+        best = r == 0
+        runner = np.zeros(best.sum())
+        second = r == 1
+        runner[np.searchsorted(pq[best], pq[second])] = score[second]
+        out.append(pd.DataFrame({"query": pq[best], "code": index.codes[pp[best]],
+                                 "score": score[best], "runner_up": runner}))
+    return pd.concat(out, ignore_index=True) if out else _no_matches()
+
+def _no_matches() -> pd.DataFrame:
+    return pd.DataFrame({"query": pd.Series(dtype="int64"), "code": pd.Series(dtype="object"),
+                         "score": pd.Series(dtype="float64"), "runner_up": pd.Series(dtype="float64")})
+
+def classify(matches: pd.DataFrame) -> pd.Series:
+    score, margin = matches["score"], matches["score"] - matches["runner_up"]
+    return pd.Series(np.select(
+        [(score >= AUTO_THRESHOLD) & (margin >= MIN_MARGIN), score >= REVIEW_THRESHOLD],
+        [STATUS_AUTO, STATUS_REVIEW], STATUS_NONE,
+    ), index=matches.index)
+
+# ---------------- Catalog index cache ----------------
+# The product index is rebuilt only when the catalog snapshot changes
+# (catalog.data_version), and shared by every session in the process.
+_index_cache: Dict[str, NameIndex] = {}
+_index_lock = threading.Lock()
+
+def catalog_index(engine: Engine) -> NameIndex:
+    key = engine.url.render_as_string(hide_password=False)
+    cat = load_catalog(engine)
+    with _index_lock:
+        idx = _index_cache.get(key)
+        if idx is not None and idx.version == cat.version:
+            return idx
+    df = cat.frame[cat.frame["name_key"] != ""]
+    idx = build_index(df["code"].astype(str), df["name_key"])
+    idx.version = cat.version
+    # Order-independent, and unchanged by writes that leave product names alone
+    # (data_version moves on every write, including name_matches' own)
+    hashes = pd.util.hash_pandas_object(df[["code", "name_key"]].astype(str), index=False).to_numpy()
+    idx.fingerprint = int(hashes.sum(dtype=np.uint64).astype(np.int64))
+    with _index_lock:
+        _index_cache[key] = idx
+    return idx
+
+# ---------------- Persisted results ----------------
+# name_matches remembers every SmartBill code already processed, so later
+# runs only score names that appeared since, plus the unmatched and review ones
+# once the product names changed (a name seen before its product was imported).
+NEW_NAMES_SQL = '''
+SELECT DISTINCT t.sku AS sb_code, t.product_name
+FROM sku_period_totals t
+LEFT JOIN products p ON p.code = t.sku
+LEFT JOIN name_matches m ON m.sb_code = t.sku
+WHERE p.code IS NULL AND coalesce(t.product_name, '') <> ''
+  AND (m.sb_code IS NULL
+       OR (m.status IN ('none', 'review') AND m.index_version IS DISTINCT FROM :iv))
+'''
+MATCH_COLUMNS = ["sb_code", "product_name", "name_key", "code", "score", "status", "index_version"]
+
+def match_new_names(engine: Engine) -> pd.DataFrame:
+    """Score SmartBill names not seen before, or left unmatched / in review
+    while the product names changed, and record them in name_matches."""
+    index = catalog_index(engine)
+    names = read_sql(NEW_NAMES_SQL, engine, params={"iv": index.fingerprint})
+    if names.empty:
+        return names.assign(name_key="", code=None, score=np.nan, runner_up=np.nan, status=STATUS_NONE)
+    # One row per SmartBill code (periods can disagree on the name)
+    names = names.drop_duplicates("sb_code").reset_index(drop=True)
+    names["name_key"] = norm_name_series(names["product_name"])
+    m = match_names(index, names["name_key"]).set_index("query")
+    names = names.join(m)
+    names["runner_up"] = names["runner_up"].fillna(0)
+    names["status"] = classify(names.assign(score=names["score"].fillna(0)))
+    names["index_version"] = index.fingerprint
+    with catalog_write(engine) as conn:
+        create_stage(conn, "_stage_matches", "sb_code TEXT, product_name TEXT, name_key TEXT, code TEXT, "
+                                             "score NUMERIC, status TEXT, index_version BIGINT")
+        copy_frame(conn, "_stage_matches", names, MATCH_COLUMNS)
+        conn.execute(text(upsert_sql("name_matches", "_stage_matches", MATCH_COLUMNS, keys=["sb_code"],
+                                     touch="matched_at")))
+    return names
+
+APPLY_SQL = '''
+UPDATE products AS p SET grup_sku = s.grup_sku, updated_at = now()
+FROM _stage_grup s
+WHERE p.code = s.code AND p.grup_sku IS DISTINCT FROM s.grup_sku{only_empty}
+'''
+
+# Only the matches the product now carries: one skipped because the product
+# already had another grup_sku (no overwrite) stays pending
+APPLIED_SQL = '''
+UPDATE name_matches SET status = :st
+WHERE sb_code IN (SELECT s.grup_sku FROM _stage_grup s
+                  JOIN products p ON p.code = s.code AND p.grup_sku = s.grup_sku)
+'''
+
+def apply_matches(engine: Engine, matches: pd.DataFrame, overwrite: bool = False) -> int:
+    """Set products.grup_sku = sb_code for the given matches in one UPDATE ... FROM.
+    When several SmartBill codes point at the same product the best score wins.
+    Without `overwrite`, products that already have a grup_sku are left alone."""
+    m = matches.dropna(subset=["code"]).sort_values("score", ascending=False).drop_duplicates("code")
+    if m.empty:
+        return 0
+    stage = pd.DataFrame({"code": m["code"], "grup_sku": m["sb_code"]})
+    with catalog_write(engine) as conn:
+        create_stage(conn, "_stage_grup", "code TEXT, grup_sku TEXT")
+        copy_frame(conn, "_stage_grup", stage, ["code", "grup_sku"])
+        only_empty = "" if overwrite else " AND p.grup_sku IS NULL"
+        n = conn.execute(text(APPLY_SQL.format(only_empty=only_empty))).rowcount
+        conn.execute(text(APPLIED_SQL), {"st": STATUS_APPLIED})
+    return n
+
+def run_mapping(engine: Engine, auto_apply: bool = True) -> Dict[str, int]:
+    """Match new SmartBill names and apply the confident ones."""
+    res = match_new_names(engine)
+    applied = apply_matches(engine, res[res["status"] == STATUS_AUTO]) if auto_apply and len(res) else 0
+    counts = res["status"].value_counts() if len(res) else pd.Series(dtype="int64")
+    return {
+        "new_names": len(res),
+        "auto": int(counts.get(STATUS_AUTO, 0)),
+        "review": int(counts.get(STATUS_REVIEW, 0)),
+        "unmatched": int(counts.get(STATUS_NONE, 0)),
+        "applied": applied,
+    }
+
+def pending_reviews(engine: Engine, status: str = STATUS_REVIEW) -> pd.DataFrame:
+    return read_sql((
+        "SELECT m.sb_code, m.product_name, m.code, p.name AS matched_name, m.score "
+        "FROM name_matches m LEFT JOIN products p ON p.code = m.code "
+        "WHERE m.status = :st ORDER BY m.score DESC"
+    ), engine, params={"st": status})
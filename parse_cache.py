@@ -0,0 +1,87 @@
+from __future__ import annotations
+import hashlib
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from perf import timed_iter
+
+# On-disk Parquet cache of parsed + normalized import frames, keyed by the
+# upload's content hash. Re-opening the same export skips the openpyxl parse.
+CACHE_DIR = Path(os.environ.get("SERVICEPACK_CACHE_DIR", ".cache/servicepack"))
+CACHE_MAX_BYTES = int(float(os.environ.get("SERVICEPACK_CACHE_MB", "512")) * 1024 * 1024)
+BATCH_ROWS = 5000
+
+_lock = threading.Lock()
+
+def file_digest(file) -> str:
+    """sha256 of an uploaded file / file-like / path; file objects are rewound."""
+    h = hashlib.sha256()
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        return h.hexdigest()
+    if hasattr(file, "getbuffer"):
+        h.update(file.getbuffer())
+    else:
+        file.seek(0)
+        for block in iter(lambda: file.read(1 << 20), b""):
+            h.update(block)
+    file.seek(0)
+    return h.hexdigest()
+
+def _path(key: str) -> Path:
+    return CACHE_DIR / f"{key}.parquet"
+
+def cached_rows(key: str) -> Optional[int]:
+    path = _path(key)
+    return pq.ParquetFile(path).metadata.num_rows if path.exists() else None
+
+def evict(max_bytes: int = CACHE_MAX_BYTES) -> int:
+    """Drop least recently used entries until the cache fits in `max_bytes`."""
+    with _lock:
+        if not CACHE_DIR.exists():
+            return 0
+        entries = sorted(CACHE_DIR.glob("*.parquet"), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in entries)
+        removed = 0
+        for p in entries:
+            if total <= max_bytes:
+                break
+            total -= p.stat().st_size
+            p.unlink(missing_ok=True)
+            removed += 1
+        return removed
+
+def cached_chunks(key: str, schema: pa.Schema,
+                  produce: Callable[[], Iterator[pd.DataFrame]]) -> Iterator[pd.DataFrame]:
+    """Yield the frames for `key`: from the Parquet cache when present, else from
+    `produce()` while writing them to the cache. Memory stays bounded either way."""
+    path = _path(key)
+    if path.exists():
+        os.utime(path)  # LRU: a hit counts as a use
+        pf = pq.ParquetFile(path)
+        yield from timed_iter("parse_cache", (b.to_pandas() for b in pf.iter_batches(batch_size=BATCH_ROWS)))
+        return
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    writer: Optional[pq.ParquetWriter] = None
+    try:
+        writer = pq.ParquetWriter(tmp, schema)
+        for df in produce():
+            writer.write_table(pa.Table.from_pandas(df[schema.names], schema=schema, preserve_index=False))
+            yield df
+        writer.close()
+        writer = None
+        os.replace(tmp, path)
+    finally:
+        if writer is not None:
+            writer.close()
+        tmp.unlink(missing_ok=True)
+    evict()
@@ -0,0 +1,221 @@
+from __future__ import annotations
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import wraps
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, TypeVar
+
+import pandas as pd
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+# Timing spans for the hot paths (Excel parse, normalization, bulk writes,
+# read_sql) plus per-statement latency from SQLAlchemy cursor events.
+# Every event goes to the "servicepack.perf" logger as one JSON line, and is
+# kept in memory under the current run (a Streamlit rerun, an import job, a
+# CLI command) so the app can show the slowest stages of the last reruns.
+KEEP_RUNS = 20
+MAX_EVENTS_PER_RUN = 5000
+SLOW_QUERY_MS = 500.0  # statements slower than this are logged at WARNING
+PERF_LOG = os.environ.get("SERVICEPACK_PERF_LOG")  # optional JSON-lines file
+
+log = logging.getLogger("servicepack.perf")
+if PERF_LOG:
+    _handler = logging.FileHandler(PERF_LOG, encoding="utf-8")
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(_handler)
+    log.setLevel(logging.DEBUG)
+
+T = TypeVar("T")
+
+@dataclass
+class Run:
+    id: int
+    label: str
+    started: float = field(default_factory=time.time)
+    seconds: Optional[float] = None
+    events: List[Dict[str, Any]] = field(default_factory=list)
+    dropped: int = 0
+
+_runs: Deque[Run] = deque(maxlen=KEEP_RUNS)
+_runs_lock = threading.Lock()
+_next_id = [0]
+_local = threading.local()
+
+# ---------------- Runs ----------------
+def begin_run(label: str) -> Run:
+    """Start collecting events of this thread under a new run."""
+    with _runs_lock:
+        _next_id[0] += 1
+        r = Run(_next_id[0], label)
+        _runs.append(r)
+    _local.run = r
+    _local.t0 = time.perf_counter()
+    return r
+
+def end_run() -> None:
+    r = getattr(_local, "run", None)
+    if r is not None and r.seconds is None:
+        r.seconds = time.perf_counter() - _local.t0
+        record("run", r.label, r.seconds * 1000)
+
+@contextmanager
+def run(label: str) -> Iterator[Run]:
+    prev, prev_t0 = getattr(_local, "run", None), getattr(_local, "t0", None)
+    r = begin_run(label)
+    try:
+        yield r
+    finally:
+        end_run()
+        _local.run, _local.t0 = prev, prev_t0
+
+@contextmanager
+def muted() -> Iterator[None]:
+    """Don't record anything from this block (e.g. polling fragments)."""
+    prev = getattr(_local, "muted", False)
+    _local.muted = True
+    try:
+        yield
+    finally:
+        _local.muted = prev
+
+def recent_runs(n: int = KEEP_RUNS) -> List[Run]:
+    with _runs_lock:
+        return list(_runs)[-n:]
+
+# ---------------- Events ----------------
+def record(kind: str, name: str, ms: float, **attrs) -> None:
+    if getattr(_local, "muted", False):
+        return
+    r = getattr(_local, "run", None)
+    ev = {"ts": round(time.time(), 3), "run": r.label if r else None, "kind": kind,
+          "name": name, "ms": round(ms, 3), **attrs}
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(json.dumps(ev, default=str, ensure_ascii=False))
+    if r is not None:
+        if len(r.events) < MAX_EVENTS_PER_RUN:
+            r.events.append(ev)
+        else:
+            r.dropped += 1
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Dict[str, Any]]:
+    """Time a block. The yielded dict can take extra attributes (e.g. rows)."""
+    extra: Dict[str, Any] = dict(attrs)
+    t0 = time.perf_counter()
+    try:
+        yield extra
+    finally:
+        record("span", name, (time.perf_counter() - t0) * 1000, **extra)
+
+def timed(name: str, rows: bool = True) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    """Decorator form of span(); records len() of the result as rows."""
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name) as extra:
+                out = fn(*args, **kwargs)
+                if rows and hasattr(out, "__len__"):
+                    extra["rows"] = len(out)
+                return out
+        return wrapper
+    return deco
+
+def timed_iter(name: str, chunks: Iterable[T], **attrs) -> Iterator[T]:
+    """Wrap a chunk generator: one span with the time spent producing chunks
+    (not the consumer's time between them), recorded when the iteration ends."""
+    it = iter(chunks)
+    total, n, rows = 0.0, 0, 0
+    try:
+        while True:
+            t0 = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                total += time.perf_counter() - t0
+                break
+            total += time.perf_counter() - t0
+            n += 1
+            rows += len(item) if hasattr(item, "__len__") else 0
+            yield item
+    finally:
+        record("span", name, total * 1000, chunks=n, rows=rows, **attrs)
+
+# ---------------- SQL ----------------
+def _short(sql: str, width: int = 160) -> str:
+    s = re.sub(r"\s+", " ", str(sql)).strip()
+    return s if len(s) <= width else s[:width - 1] + "…"
+
+def read_sql(sql, con, params=None, **kwargs) -> pd.DataFrame:
+    """pd.read_sql in a span (statement time + DataFrame build)."""
+    with span("read_sql", sql=_short(sql, 80)) as extra:
+        df = pd.read_sql(text(sql) if isinstance(sql, str) else sql, con, params=params, **kwargs)
+        extra["rows"] = len(df)
+        return df
+
+def instrument_engine(engine: Engine) -> Engine:
+    """Record every statement's latency and row count (cursor events)."""
+    if engine.__dict__.get("_perf_instrumented"):
+        return engine
+    engine.__dict__["_perf_instrumented"] = True
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["perf_t0"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        t0 = conn.info.pop("perf_t0", None)
+        if t0 is None:
+            return
+        ms = (time.perf_counter() - t0) * 1000
+        attrs = {"rows": cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else None}
+        if executemany:
+            attrs["batch"] = len(parameters)
+        record("query", _short(statement), ms, **attrs)
+        if ms >= SLOW_QUERY_MS:
+            log.warning("slow query (%.0f ms): %s", ms, _short(statement))
+
+    @event.listens_for(engine, "handle_error")
+    def _error(ctx):
+        if ctx.connection is not None:
+            ctx.connection.info.pop("perf_t0", None)
+
+    return engine
+
+# ---------------- Panel data ----------------
+def slowest_stages(runs: List[Run]) -> pd.DataFrame:
+    """Spans aggregated by stage over `runs`, slowest total first."""
+    ev = [e for r in runs for e in r.events if e["kind"] == "span"]
+    if not ev:
+        return pd.DataFrame(columns=["stage", "count", "total_ms", "max_ms", "rows"])
+    df = pd.DataFrame(ev)
+    if "rows" not in df:
+        df["rows"] = None
+    out = df.groupby("name").agg(count=("ms", "size"), total_ms=("ms", "sum"), max_ms=("ms", "max"),
+                                 rows=("rows", "sum"))
+    return out.sort_values("total_ms", ascending=False).rename_axis("stage").reset_index()
+
+def slowest_queries(runs: List[Run], limit: int = 15) -> pd.DataFrame:
+    ev = [{"run": r.label, **e} for r in runs for e in r.events if e["kind"] == "query"]
+    if not ev:
+        return pd.DataFrame(columns=["run", "ms", "rows", "statement"])
+    df = pd.DataFrame(ev).rename(columns={"name": "statement"})
+    if "rows" not in df:
+        df["rows"] = None
+    return df.nlargest(limit, "ms")[["run", "ms", "rows", "statement"]].reset_index(drop=True)
+
+def run_table(runs: List[Run]) -> pd.DataFrame:
+    rows = []
+    for r in runs:
+        q = [e["ms"] for e in r.events if e["kind"] == "query"]
+        rows.append({"run": r.label, "started": time.strftime("%H:%M:%S", time.localtime(r.started)),
+                     "seconds": None if r.seconds is None else round(r.seconds, 3),
+                     "queries": len(q), "db_ms": round(sum(q), 1)})
+    return pd.DataFrame(rows, columns=["run", "started", "seconds", "queries", "db_ms"])
@@ -0,0 +1,121 @@
+from __future__ import annotations
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.engine import Engine
+
+from catalog import load_catalog
+from importers import SOURCE_30D, SOURCE_YEAR
+from perf import read_sql
+
+DEFAULT_LEAD_TIME_DAYS = 7
+DEFAULT_TARGET_DAYS = 30
+DEFAULT_WEIGHT_30D = 0.6   # share of the 30-day velocity in the blended velocity
+
+REPORT_COLUMNS = [
+    "sku", "product_name", "iesiri_an", "iesiri_30z", "vel_an", "vel_30z", "vel_blend",
+    "stoc_final", "days_cover", "reorder_qty", "purchase_price_no_vat", "order_value",
+]
+
+Period = Tuple[object, object]  # (period_start, period_end)
+
+# Reads the per-SKU totals maintained by sales_summary, not raw stock_moves
+PERIOD_TOTALS_SQL = '''
+SELECT sku, product_name, iesiri, stoc_final
+FROM sku_period_totals
+WHERE source_tag=:tag AND period_start=:ps AND period_end=:pe
+'''
+
+def latest_periods(engine: Engine) -> Dict[str, Period]:
+    """Most recent (period_start, period_end) imported for each SmartBill source."""
+    df = read_sql((
+        "SELECT DISTINCT source_tag, period_start, period_end FROM sku_period_totals "
+        "WHERE source_tag IN (:y, :m)"
+    ), engine, params={"y": SOURCE_YEAR, "m": SOURCE_30D})
+    out = {}
+    for tag, g in df.groupby("source_tag"):
+        last = g.sort_values(["period_end", "period_start"]).iloc[-1]
+        out[tag] = (last["period_start"], last["period_end"])
+    return out
+
+def load_period_totals(engine: Engine, tag: str, period: Period) -> pd.DataFrame:
+    return read_sql(PERIOD_TOTALS_SQL, engine,
+                       params={"tag": tag, "ps": period[0], "pe": period[1]})
+
+def period_days(period: Optional[Period]) -> float:
+    if period is None:
+        return np.nan
+    return float((pd.Timestamp(period[1]) - pd.Timestamp(period[0])).days + 1)
+
+def compute_order_report(year: pd.DataFrame, d30: pd.DataFrame,
+                         year_days: float, d30_days: float,
+                         lead_time_days: float = DEFAULT_LEAD_TIME_DAYS,
+                         target_days: float = DEFAULT_TARGET_DAYS,
+                         weight_30d: float = DEFAULT_WEIGHT_30D,
+                         products: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """Order proposal for every SKU, computed column-wise (no per-SKU loop).
+
+    `year` / `d30` hold per-SKU totals (sku, product_name, iesiri, stoc_final) for
+    the yearly and 30-day periods. Velocity is units/day over each period;
+    the blended velocity falls back to whichever period is available. Stock
+    comes from the 30-day period (the most recent), else from the yearly one.
+    reorder_qty covers lead time + target days of the blended velocity."""
+    # One hash join lines up both periods; everything after is plain NumPy.
+    cols = ["sku", "product_name", "iesiri", "stoc_final"]
+    df = year[cols].merge(d30[cols], on="sku", how="outer", suffixes=("_an", "_30z"), indicator=True)
+    in_y = (df["_merge"] != "right_only").to_numpy()
+    in_m = (df["_merge"] != "left_only").to_numpy()
+    df["product_name"] = df["product_name_30z"].fillna(df["product_name_an"])
+    iesiri_y = pd.to_numeric(df["iesiri_an"], errors="coerce").fillna(0).to_numpy(float)
+    iesiri_m = pd.to_numeric(df["iesiri_30z"], errors="coerce").fillna(0).to_numpy(float)
+    stock_y = pd.to_numeric(df["stoc_final_an"], errors="coerce").to_numpy(float)
+    stock_m = pd.to_numeric(df["stoc_final_30z"], errors="coerce").to_numpy(float)
+
+    yd = year_days if year_days > 0 else np.nan
+    md = d30_days if d30_days > 0 else np.nan
+    vel_y = np.where(in_y, iesiri_y / yd, np.nan)
+    vel_m = np.where(in_m, iesiri_m / md, np.nan)
+    blend = np.where(np.isnan(vel_m), vel_y,
+                     np.where(np.isnan(vel_y), vel_m, weight_30d * vel_m + (1 - weight_30d) * vel_y))
+    blend = np.clip(np.nan_to_num(blend, nan=0.0), 0, None)
+    stock = np.where(np.isnan(stock_m), stock_y, stock_m)
+    stock = np.clip(np.nan_to_num(stock, nan=0.0), 0, None)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cover = np.where(blend > 0, stock / blend, np.inf)
+    need = blend * (lead_time_days + target_days) - stock
+    df["iesiri_an"] = iesiri_y
+    df["iesiri_30z"] = iesiri_m
+    df["vel_an"] = vel_y
+    df["vel_30z"] = vel_m
+    df["vel_blend"] = blend
+    df["stoc_final"] = stock
+    df["days_cover"] = cover
+    df["reorder_qty"] = np.ceil(np.clip(need, 0, None))
+
+    if products is not None and len(products):
+        prices = products[["code", "purchase_price_no_vat"]].drop_duplicates("code")
+        df = df.merge(prices.rename(columns={"code": "sku"}), on="sku", how="left")
+        df["purchase_price_no_vat"] = pd.to_numeric(df["purchase_price_no_vat"], errors="coerce")
+    else:
+        df["purchase_price_no_vat"] = np.nan
+    df["order_value"] = df["reorder_qty"] * df["purchase_price_no_vat"]
+    return df[REPORT_COLUMNS].sort_values(["reorder_qty", "days_cover"], ascending=[False, True],
+                                          ignore_index=True)
+
+def order_report(engine: Engine, lead_time_days: float = DEFAULT_LEAD_TIME_DAYS,
+                 target_days: float = DEFAULT_TARGET_DAYS,
+                 weight_30d: float = DEFAULT_WEIGHT_30D) -> Tuple[pd.DataFrame, Dict[str, Period]]:
+    """"Ce comand azi": load the latest yearly and 30-day periods and compute
+    the order proposal. Returns (report, periods used)."""
+    periods = latest_periods(engine)
+    empty = pd.DataFrame(columns=["sku", "product_name", "iesiri", "stoc_final"])
+    year = load_period_totals(engine, SOURCE_YEAR, periods[SOURCE_YEAR]) if SOURCE_YEAR in periods else empty
+    d30 = load_period_totals(engine, SOURCE_30D, periods[SOURCE_30D]) if SOURCE_30D in periods else empty
+    products = load_catalog(engine).frame[["code", "purchase_price_no_vat"]]
+    report = compute_order_report(
+        year, d30, period_days(periods.get(SOURCE_YEAR)), period_days(periods.get(SOURCE_30D)),
+        lead_time_days, target_days, weight_30d, products,
+    )
+    return report, periods
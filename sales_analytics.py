@@ -0,0 +1,217 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from perf import timed
+
+# Time-series analytics on utils.normalize_stock_moves output (date,
+# product_code, qty). The history is one dense float32 matrix, SKUs x days, so
+# every statistic is a NumPy operation over all SKUs at once instead of a loop
+# per SKU: 50k SKUs x 3 years of days is ~220 MB. Receipts are sparse and kept
+# as (row, day, qty) triples.
+VELOCITY_WINDOWS = (7, 28, 91)
+EWMA_HALFLIFE_DAYS = 14.0
+SEASONALITY_PRIOR_UNITS = 28.0  # units sold at which a SKU's own weekday profile gets half the weight
+STOCKOUT_MIN_EXPECTED = 3.0     # a zero-sales run is a stock-out once it "should" have sold this many units
+EWMA_BLOCK_ROWS = 4096
+WEEKDAYS = ["lun", "mar", "mie", "joi", "vin", "sam", "dum"]
+
+@dataclass
+class SalesSeries:
+    skus: pd.Index            # SKU of each matrix row
+    start: pd.Timestamp       # date of column 0
+    sales: np.ndarray         # (SKUs, days) float32, units sold per day
+    receipts: pd.DataFrame    # row, day, qty for the days with units received
+    first_day: np.ndarray     # first day with any movement, per row
+
+    @property
+    def days(self) -> pd.DatetimeIndex:
+        return pd.date_range(self.start, periods=self.sales.shape[1], freq="D")
+
+# ---------------- Resampling ----------------
+@timed("build_sales_series", rows=False)
+def build_series(moves: pd.DataFrame, start=None, end=None) -> SalesSeries:
+    """Pivot moves into the daily matrix. Negative qty is a sale, positive a
+    receipt; `start` / `end` default to the range of the moves."""
+    code = moves["product_code"]
+    if not isinstance(code.dtype, pd.CategoricalDtype):
+        code = code.astype("category")
+    days = moves["date"].to_numpy().astype("datetime64[D]")
+    today = np.datetime64("today", "D")
+    start = np.datetime64(pd.Timestamp(start).date(), "D") if start is not None else days.min(initial=today)
+    end = np.datetime64(pd.Timestamp(end).date(), "D") if end is not None else days.max(initial=start - 1)
+    n_days = max(int((end - start).astype(np.int64)) + 1, 0)
+
+    day = (days - start).astype(np.int64)
+    qty = moves["qty"].to_numpy(np.float32)
+    codes = code.cat.codes.to_numpy()
+    keep = (day >= 0) & (day < n_days) & (qty != 0) & (codes >= 0)
+    # One matrix row per SKU that actually moved in the range
+    used = np.bincount(codes[keep], minlength=len(code.cat.categories)) > 0
+    row = (np.cumsum(used) - 1)[codes[keep]]
+    day, qty, n = day[keep], qty[keep], int(used.sum())
+
+    # ufunc.at sums several moves on the same SKU and day
+    out = qty < 0
+    sales = np.zeros((n, n_days), np.float32)
+    np.add.at(sales.reshape(-1), row[out] * n_days + day[out], -qty[out])
+
+    flat, inverse = np.unique(row[~out] * n_days + day[~out], return_inverse=True)
+    receipts = pd.DataFrame({"row": (flat // max(n_days, 1)).astype(np.int32),
+                             "day": (flat % max(n_days, 1)).astype(np.int32),
+                             "qty": np.bincount(inverse, weights=qty[~out], minlength=len(flat)).astype(np.float32)})
+    first = np.full(n, n_days, np.int32)
+    np.minimum.at(first, row, day.astype(np.int32))
+    skus = pd.Index(code.cat.categories[used], name="sku")
+    return SalesSeries(skus, pd.Timestamp(start), sales, receipts, first)
+
+def weekly_sales(s: SalesSeries) -> pd.DataFrame:
+    """Units sold per week (weeks start on Monday), SKUs x weeks. The first and
+    last weeks can be partial."""
+    n_days = s.sales.shape[1]
+    if n_days == 0:
+        return pd.DataFrame(index=s.skus, columns=pd.DatetimeIndex([]), dtype=np.float32)
+    bounds = np.unique(np.r_[0, np.arange((7 - s.start.weekday()) % 7, n_days, 7)])
+    starts = s.days[bounds]
+    weeks = starts - pd.to_timedelta(starts.weekday, unit="D")
+    return pd.DataFrame(np.add.reduceat(s.sales, bounds, axis=1), index=s.skus, columns=weeks)
+
+# ---------------- Stock-outs ----------------
+def _observed_from(s: SalesSeries) -> np.ndarray:
+    # Days on or after the SKU's first movement
+    return np.arange(s.sales.shape[1], dtype=np.int32)[None, :] >= s.first_day[:, None]
+
+def _zero_run_stockouts(s: SalesSeries, min_expected: float) -> np.ndarray:
+    sales = s.sales
+    n_days = sales.shape[1]
+    idx = np.int16 if n_days < 2**15 else np.int32
+    t = np.arange(n_days, dtype=idx)
+    sold = sales > 0
+    # Last and next sale day around every day -> length of the zero run it belongs to
+    last = np.where(sold, t, idx(-1))
+    np.maximum.accumulate(last, axis=1, out=last)
+    nxt = np.where(sold, t, idx(n_days))[:, ::-1]
+    nxt = np.minimum.accumulate(nxt, axis=1)[:, ::-1]
+    run = nxt.astype(np.float32) - last - 1
+    del nxt
+    days = np.maximum(n_days - s.first_day, 1).astype(np.float32)
+    rate = sales.sum(axis=1, dtype=np.float64).astype(np.float32) / days
+    # Runs before the first sale are not stock-outs (the SKU may not have been listed yet)
+    return ~sold & (last >= 0) & (run * rate[:, None] >= min_expected)
+
+def _balance_stockouts(s: SalesSeries, rows: np.ndarray, closing: np.ndarray) -> np.ndarray:
+    # Daily closing balance rebuilt backwards from the stock on hand at the end
+    bal = -s.sales[rows]
+    rec = s.receipts[np.isin(s.receipts["row"].to_numpy(), rows)]
+    pos = np.searchsorted(rows, rec["row"].to_numpy())
+    bal[pos, rec["day"].to_numpy()] += rec["qty"].to_numpy()
+    np.cumsum(bal, axis=1, out=bal)
+    bal += (closing - bal[:, -1])[:, None]
+    return (bal <= 0) & (s.sales[rows] == 0)
+
+@timed("stockout_days", rows=False)
+def stockout_days(s: SalesSeries, closing_stock: Optional[pd.Series] = None,
+                  min_expected: float = STOCKOUT_MIN_EXPECTED) -> np.ndarray:
+    """Boolean (SKUs, days) matrix of the days a SKU was out of stock.
+
+    For SKUs in `closing_stock` (units on hand at the end of the last day) the
+    daily balance is rebuilt from the moves: a day with nothing on hand and no
+    sale is a stock-out. For the others, a zero-sales run counts as a stock-out
+    once the SKU's average daily rate says it should have sold `min_expected`
+    units in it."""
+    out = _zero_run_stockouts(s, min_expected)
+    if closing_stock is not None and s.sales.shape[1]:
+        closing = pd.to_numeric(closing_stock, errors="coerce").reindex(s.skus).to_numpy(np.float32)
+        rows = np.flatnonzero(~np.isnan(closing))
+        if len(rows):
+            out[rows] = _balance_stockouts(s, rows, closing[rows])
+    return out & _observed_from(s)
+
+# ---------------- Velocity ----------------
+def window_velocity(sales: np.ndarray, observed: np.ndarray, window: int) -> np.ndarray:
+    """Units/day over the last `window` days, counting only observed (in-stock)
+    days; NaN where the window has none."""
+    n = observed[:, -window:].sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(n > 0, sales[:, -window:].sum(axis=1) / n, np.nan).astype(np.float32)
+
+def ewma_velocity(sales: np.ndarray, observed: np.ndarray, halflife: float = EWMA_HALFLIFE_DAYS,
+                  history: bool = False) -> np.ndarray:
+    """Exponentially weighted units/day (bias-corrected like pandas adjust=True).
+    Days not observed (stock-outs) are skipped rather than counted as zero
+    demand. Returns the last value per SKU, or the full (SKUs, days) history."""
+    a = np.float32(1 - 0.5 ** (1 / halflife))
+    n, n_days = sales.shape
+    last = np.full(n, np.nan, np.float32)
+    hist = np.full((n, n_days), np.nan, np.float32) if history else None
+    # Recursive over days, vectorised over SKUs; blocks of rows transposed so
+    # each day is a contiguous vector
+    for i in range(0, n, EWMA_BLOCK_ROWS):
+        x = np.ascontiguousarray(sales[i:i + EWMA_BLOCK_ROWS].T)
+        o = np.ascontiguousarray(observed[i:i + EWMA_BLOCK_ROWS].T)
+        m = np.zeros(x.shape[1], np.float32)
+        w = np.zeros(x.shape[1], np.float32)
+        h = np.empty_like(x) if history else None
+        for t in range(n_days):
+            m = np.where(o[t], (1 - a) * m + a * x[t], m)
+            w = np.where(o[t], (1 - a) * w + a, w)
+            if history:
+                h[t] = m / np.where(w > 0, w, np.nan)
+        with np.errstate(invalid="ignore"):
+            last[i:i + len(m)] = m / np.where(w > 0, w, np.nan)
+        if history:
+            hist[i:i + len(m)] = h.T
+    return hist if history else last
+
+# ---------------- Seasonality ----------------
+def _by_weekday(start: pd.Timestamp, m: np.ndarray) -> np.ndarray:
+    # (rows, 7) sums per weekday, Monday first; strided views, no copy of `m`
+    out = np.zeros((m.shape[0], 7), np.float64)
+    for k in range(min(7, m.shape[1])):
+        out[:, (start.weekday() + k) % 7] = m[:, k::7].sum(axis=1, dtype=np.float64)
+    return out
+
+def weekday_factors(s: SalesSeries, observed: np.ndarray,
+                    prior_units: float = SEASONALITY_PRIOR_UNITS) -> pd.DataFrame:
+    """Day-of-week seasonality per SKU: average units on each weekday over the
+    SKU's average day (1.0 = flat), over observed days. SKUs with little
+    history are shrunk toward the profile of all SKUs pooled."""
+    units = _by_weekday(s.start, s.sales)
+    days = _by_weekday(s.start, observed)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pooled = (units.sum(axis=0) / days.sum(axis=0)) / (units.sum() / days.sum())
+        pooled = np.where(np.isfinite(pooled), pooled, 1.0)
+        own = (units / days) / (units.sum(axis=1) / days.sum(axis=1))[:, None]
+    total = units.sum(axis=1)[:, None]
+    weight = total / (total + prior_units)
+    own = np.where(np.isfinite(own), own, pooled)
+    f = weight * own + (1 - weight) * pooled
+    return pd.DataFrame(f.astype(np.float32), index=s.skus, columns=WEEKDAYS)
+
+# ---------------- Summary ----------------
+@timed("sales_analytics")
+def sales_analytics(moves: pd.DataFrame, closing_stock: Optional[pd.Series] = None,
+                    start=None, end=None) -> pd.DataFrame:
+    """Per-SKU velocity, stock-out and weekday-seasonality summary of the moves
+    (normalize_stock_moves output). Velocities are units/day over in-stock days."""
+    s = build_series(moves, start, end)
+    out = stockout_days(s, closing_stock)
+    observed = _observed_from(s) & ~out
+    df = pd.DataFrame({"sku": pd.Categorical(s.skus),
+                       "units": s.sales.sum(axis=1, dtype=np.float64).astype(np.float32)})
+    for w in VELOCITY_WINDOWS:
+        df[f"vel_{w}z"] = window_velocity(s.sales, observed, w)
+    df["vel_ewma"] = ewma_velocity(s.sales, observed)
+    df["stockout_days"] = out.sum(axis=1).astype(np.int32)
+    df[f"stockout_{VELOCITY_WINDOWS[-1]}z"] = out[:, -VELOCITY_WINDOWS[-1]:].sum(axis=1).astype(np.int32)
+    df["out_of_stock"] = out[:, -1] if out.shape[1] else False
+    sold = s.sales > 0
+    last = np.full(len(df), -1)
+    if sold.shape[1]:
+        last = np.where(sold.any(axis=1), sold.shape[1] - 1 - sold[:, ::-1].argmax(axis=1), -1)
+    df["last_sale"] = (s.start + pd.to_timedelta(last, unit="D")).where(last >= 0)
+    df[WEEKDAYS] = weekday_factors(s, observed).to_numpy()
+    return df
@@ -0,0 +1,78 @@
+from __future__ import annotations
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from catalog import catalog_write
+from perf import read_sql
+
+# sku_period_totals holds one row per (source_tag, period, sku) with the sums of
+# that period's stock_moves rows. It is maintained in the same transaction as
+# each stock-moves import, so reports read O(#SKUs) rows instead of history.
+SUMMARY_COLUMNS = "sku, source_tag, period_start, period_end, product_name, intrari, iesiri, stoc_final"
+
+# Partition refresh straight from the import's staging table
+_STAGE_SQL = f'''
+INSERT INTO sku_period_totals ({SUMMARY_COLUMNS})
+SELECT coalesce(code, sb_code), :tag, :ps, :pe, max(product_name),
+       sum(intrari), sum(iesiri), sum(stoc_final)
+FROM _stage_moves
+WHERE coalesce(code, sb_code) IS NOT NULL
+GROUP BY coalesce(code, sb_code)
+'''
+
+# Full rebuild from the raw table
+_REBUILD_SQL = f'''
+INSERT INTO sku_period_totals ({SUMMARY_COLUMNS})
+SELECT coalesce(code, sb_code), source_tag, period_start, period_end, max(product_name),
+       sum(intrari), sum(iesiri), sum(stoc_final)
+FROM stock_moves
+WHERE coalesce(code, sb_code) IS NOT NULL
+  AND source_tag IS NOT NULL AND period_start IS NOT NULL AND period_end IS NOT NULL
+GROUP BY source_tag, period_start, period_end, coalesce(code, sb_code)
+'''
+
+def refresh_partition_from_stage(conn: Connection, source_tag: str, period_start, period_end) -> int:
+    """Replace one period's totals with the aggregate of `_stage_moves`.
+    Call inside the import transaction, after the stage has been resolved."""
+    params = {"tag": source_tag, "ps": period_start, "pe": period_end}
+    conn.execute(text(
+        "DELETE FROM sku_period_totals WHERE source_tag=:tag AND period_start=:ps AND period_end=:pe"
+    ), params)
+    return conn.execute(text(_STAGE_SQL), params).rowcount
+
+def rebuild_sales_summary(engine: Engine) -> int:
+    """Recompute sku_period_totals from stock_moves. Returns the number of rows written."""
+    with catalog_write(engine) as conn:
+        conn.execute(text("DELETE FROM sku_period_totals"))
+        return conn.execute(text(_REBUILD_SQL)).rowcount
+
+CHECK_SQL = '''
+WITH raw AS (
+    SELECT source_tag, period_start, period_end, coalesce(code, sb_code) AS sku,
+           sum(intrari) AS intrari, sum(iesiri) AS iesiri, sum(stoc_final) AS stoc_final
+    FROM stock_moves
+    WHERE coalesce(code, sb_code) IS NOT NULL
+      AND source_tag IS NOT NULL AND period_start IS NOT NULL AND period_end IS NOT NULL
+    GROUP BY source_tag, period_start, period_end, coalesce(code, sb_code)
+)
+SELECT coalesce(r.source_tag, s.source_tag) AS source_tag,
+       coalesce(r.period_start, s.period_start) AS period_start,
+       coalesce(r.period_end, s.period_end) AS period_end,
+       coalesce(r.sku, s.sku) AS sku,
+       r.intrari AS raw_intrari, s.intrari AS summary_intrari,
+       r.iesiri AS raw_iesiri, s.iesiri AS summary_iesiri,
+       r.stoc_final AS raw_stoc_final, s.stoc_final AS summary_stoc_final
+FROM raw r
+FULL OUTER JOIN sku_period_totals s
+  ON s.source_tag = r.source_tag AND s.period_start = r.period_start
+ AND s.period_end = r.period_end AND s.sku = r.sku
+WHERE r.sku IS NULL OR s.sku IS NULL
+   OR r.intrari IS DISTINCT FROM s.intrari
+   OR r.iesiri IS DISTINCT FROM s.iesiri
+   OR r.stoc_final IS DISTINCT FROM s.stoc_final
+'''
+
+def check_sales_summary(engine: Engine) -> pd.DataFrame:
+    """Rows where sku_period_totals disagrees with stock_moves (empty = consistent)."""
+    return read_sql(CHECK_SQL, engine)
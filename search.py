@@ -0,0 +1,76 @@
+from __future__ import annotations
+from typing import Any, Dict, Optional, Tuple
+
+import pandas as pd
+from sqlalchemy.engine import Engine
+
+from catalog import load_catalog
+from perf import read_sql
+from utils import norm_name_value
+
+PAGE_SIZE = 50
+LIST_COLUMNS = "code, name, grup_sku, purchase_price_no_vat, sale_price_no_vat"
+
+# Cursor = sort key of the last row on the previous page: (rank, code) when
+# searching, (name_key, code) when browsing. None means first page.
+Cursor = Optional[Tuple[Any, str]]
+
+def _like_escape(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _search_sql(dialect: str, n_tokens: int, after: Cursor) -> str:
+    token_filter = " AND ".join(f"name_key LIKE :t{i} ESCAPE '\\'" for i in range(n_tokens))
+    code_rank = "CASE WHEN lower(code) = :qc THEN 3 WHEN lower(code) LIKE :qp ESCAPE '\\' THEN 2 ELSE 0 END"
+    if dialect == "postgresql":
+        # GIN trigram index serves the LIKE tokens and the <% word-similarity
+        # operator; the lower(code) text_pattern_ops index serves the prefix match.
+        rank = f"CAST({code_rank} + word_similarity(:qn, coalesce(name_key, '')) AS double precision)"
+        where = f"lower(code) LIKE :qp ESCAPE '\\' OR ({token_filter}) OR :qn <% name_key"
+    else:
+        # Normalized-LIKE fallback: names containing the whole phrase rank
+        # higher, the earlier it appears the better; instr() is 0 when absent
+        phrase = "instr(coalesce(name_key, ''), :qn)"
+        rank = f"CAST({code_rank} + CASE WHEN {phrase} > 0 THEN 1.0 / {phrase} ELSE 0 END AS REAL)"
+        where = f"lower(code) LIKE :qp ESCAPE '\\' OR ({token_filter})"
+    sql = f"SELECT * FROM (SELECT {LIST_COLUMNS}, {rank} AS rank FROM products WHERE {where}) s"
+    if after is not None:
+        sql += " WHERE rank < :ar OR (rank = :ar AND code > :ac)"
+    return sql + " ORDER BY rank DESC, code LIMIT :lim"
+
+def _browse(engine: Engine, after: Cursor, limit: int) -> pd.DataFrame:
+    # Served from the shared catalog snapshot, already in (name_key, code) order
+    df = load_catalog(engine).frame
+    start = 0
+    if after is not None:
+        nk = df["name_key"]
+        lo, hi = nk.searchsorted(after[0], side="left"), nk.searchsorted(after[0], side="right")
+        start = lo + df["code"].iloc[lo:hi].astype(str).searchsorted(after[1], side="right")
+    cols = [c.strip() for c in LIST_COLUMNS.split(",")] + ["name_key"]
+    return df.iloc[start:start + limit][cols].reset_index(drop=True)
+
+def search_products(engine: Engine, q: str, after: Cursor = None,
+                    limit: int = PAGE_SIZE) -> Tuple[pd.DataFrame, Cursor]:
+    """One page of products matching `q` (by name_key tokens, code prefix or,
+    on Postgres, trigram similarity), best matches first. An empty `q` pages
+    through the whole catalog from the in-process snapshot (catalog.py).
+    Returns (page, cursor for the next page or None when this is the last page)."""
+    qn = norm_name_value(q)
+    if not qn:
+        df = _browse(engine, after, limit + 1)
+        key_col = "name_key"
+    else:
+        params: Dict[str, Any] = {"lim": limit + 1}
+        tokens = qn.split(" ")
+        params.update({f"t{i}": f"%{_like_escape(t)}%" for i, t in enumerate(tokens)})
+        params.update(qn=qn, qc=q.strip().lower(), qp=_like_escape(q.strip().lower()) + "%")
+        if after is not None:
+            params.update(ar=after[0], ac=after[1])
+        df = read_sql(_search_sql(engine.dialect.name, len(tokens), after), engine, params=params)
+        key_col = "rank"
+    cursor = None
+    if len(df) > limit:
+        df = df.iloc[:limit]
+        last = df.iloc[-1]
+        key = float(last[key_col]) if key_col == "rank" else last[key_col]
+        cursor = (key, last["code"])
+    return df.drop(columns=[key_col]), cursor
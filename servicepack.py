@@ -0,0 +1,201 @@
+"""Headless batch entry point: `python -m servicepack <command>`.
+
+Runs the same import / mapping / report code as the Streamlit app, so nightly
+loads can be scheduled from cron, e.g.
+
+    15 2 * * *  cd /srv/servicepack && DB_URL=... python -m servicepack import-moves --year an.xlsx --d30 30z.xlsx
+"""
+from __future__ import annotations
+import argparse
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from typing import List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from db import check_health, run_migrations
+from export import EXPORTS, iter_frame, iter_query, write_chunks
+from importers import (
+    SOURCE_30D, SOURCE_YEAR, default_period, import_products, import_stock_moves, iter_product_chunks,
+    iter_sb_chunks,
+)
+from matching import run_mapping
+from perf import run as perf_run
+from replenishment import (
+    DEFAULT_LEAD_TIME_DAYS, DEFAULT_TARGET_DAYS, DEFAULT_WEIGHT_30D, latest_periods, load_period_totals, order_report,
+)
+from sales_analytics import build_series, sales_analytics, weekly_sales
+from utils import normalize_stock_moves
+
+log = logging.getLogger("servicepack")
+
+# ---------------- Parallel parse ----------------
+def _parse_to_cache(kind: str, path: str) -> Tuple[str, int]:
+    # Runs in a worker process: parse the workbook once so the parse cache is
+    # warm; the database load then streams from the cache in the parent.
+    chunks = iter_product_chunks(path) if kind == "products" else iter_sb_chunks(path)
+    return path, sum(len(df) for df in chunks)
+
+def parse_files(kind: str, paths: Sequence[str], workers: Optional[int] = None) -> None:
+    """Parse several workbooks concurrently with a process pool."""
+    if len(paths) < 2:
+        return
+    with ProcessPoolExecutor(max_workers=workers or min(len(paths), os.cpu_count() or 1)) as pool:
+        for path, rows in pool.map(_parse_to_cache, [kind] * len(paths), paths):
+            log.info("parsed %s: %d rows", path, rows)
+
+# ---------------- Commands ----------------
+def cmd_import_products(engine, args) -> int:
+    parse_files("products", args.files, args.workers)
+    for path in args.files:
+        stats = import_products(engine, path, force=args.force)
+        if stats["skipped"]:
+            log.info("%s: already imported (%s), skipped", path, stats["applied_at"])
+        else:
+            log.info("%s: %d rows, %d new, %d changed, %d unchanged",
+                     path, stats["rows"], stats["inserted"], stats["updated"], stats["unchanged"])
+    return 0
+
+def cmd_import_moves(engine, args) -> int:
+    jobs = []
+    if args.year:
+        jobs.append((args.year, SOURCE_YEAR, args.year_start, args.year_end))
+    if args.d30:
+        jobs.append((args.d30, SOURCE_30D, args.d30_start, args.d30_end))
+    if not jobs:
+        log.error("nothing to import: pass --year and/or --d30")
+        return 2
+    parse_files("moves", [j[0] for j in jobs], args.workers)
+    for path, tag, ps, pe in jobs:
+        stats = import_stock_moves(engine, path, ps, pe, tag, force=args.force)
+        if stats["skipped"]:
+            log.info("%s: already imported for %s..%s, skipped", path, ps, pe)
+        else:
+            log.info("%s: %d rows for %s %s..%s (%d unknown codes, %d replaced)",
+                     path, stats["rows"], tag, ps, pe, stats["unknown"], stats["replaced"])
+    return 0
+
+def cmd_map(engine, args) -> int:
+    stats = run_mapping(engine, auto_apply=not args.no_apply)
+    log.info("mapping: %s", ", ".join(f"{k}={v}" for k, v in stats.items()))
+    return 0
+
+def cmd_report(engine, args) -> int:
+    report, periods = order_report(engine, args.lead_time, args.target_days, args.weight_30d)
+    if not periods:
+        log.error("no stock moves imported yet")
+        return 1
+    if args.only_order:
+        report = report[report["reorder_qty"] > 0]
+    write_chunks(iter_frame(report), args.out)
+    log.info("report: %d rows -> %s", len(report), args.out)
+    return 0
+
+def cmd_export(engine, args) -> int:
+    rows = write_chunks(iter_query(engine, EXPORTS[args.name]), args.out)
+    log.info("export %s: %d rows -> %s", args.name, rows, args.out)
+    return 0
+
+def cmd_velocity(engine, args) -> int:
+    frames = [normalize_stock_moves(pd.read_excel(p)) for p in args.files]
+    moves = pd.concat(frames, ignore_index=True)
+    moves["product_code"] = moves["product_code"].astype("category")
+    closing, end = None, args.end
+    if args.stock_from_db:
+        # Anchor the daily balance on the latest imported stock (30-day export first)
+        periods = latest_periods(engine)
+        tag = next((t for t in (SOURCE_30D, SOURCE_YEAR) if t in periods), None)
+        if tag is None:
+            log.error("no stock moves imported yet (--stock-from-db)")
+            return 1
+        closing = load_period_totals(engine, tag, periods[tag]).set_index("sku")["stoc_final"]
+        end = end or periods[tag][1]
+    report = sales_analytics(moves, closing, end=end)
+    write_chunks(iter_frame(report), args.out)
+    log.info("velocity: %d moves, %d SKUs -> %s", len(moves), len(report), args.out)
+    if args.weekly:
+        weeks = weekly_sales(build_series(moves, end=end))
+        weeks.columns = weeks.columns.strftime("%Y-%m-%d")
+        write_chunks(iter_frame(weeks.reset_index()), args.weekly)
+        log.info("velocity: %d weeks -> %s", weeks.shape[1], args.weekly)
+    return 0
+
+# ---------------- CLI ----------------
+def _date(s: str) -> date:
+    return date.fromisoformat(s)
+
+def build_parser() -> argparse.ArgumentParser:
+    today = date.today()
+    p = argparse.ArgumentParser(prog="python -m servicepack", description="ServicePack batch imports and reports")
+    p.add_argument("--db-url", default=os.environ.get("DB_URL"), help="defaults to $DB_URL")
+    p.add_argument("-v", "--verbose", action="store_true")
+    sub = p.add_subparsers(dest="command", required=True)
+
+    s = sub.add_parser("import-products", help="import product workbooks into products")
+    s.add_argument("files", nargs="+")
+    s.add_argument("--force", action="store_true", help="re-import files already in the imports ledger")
+    s.add_argument("--workers", type=int, help="parallel parse processes")
+    s.set_defaults(func=cmd_import_products)
+
+    s = sub.add_parser("import-moves", help="import SmartBill stock-move exports")
+    s.add_argument("--year", help="current-year export (.xlsx)")
+    # Same defaults as the app (importers.default_period), so a file lands in
+    # the same partition whichever way it is imported
+    year, d30 = default_period(SOURCE_YEAR, today), default_period(SOURCE_30D, today)
+    s.add_argument("--year-start", type=_date, default=year[0])
+    s.add_argument("--year-end", type=_date, default=year[1])
+    s.add_argument("--d30", help="last-30-days export (.xlsx)")
+    s.add_argument("--d30-start", type=_date, default=d30[0], help="defaults to 29 days before today")
+    s.add_argument("--d30-end", type=_date, default=d30[1])
+    s.add_argument("--force", action="store_true", help="re-import files already in the imports ledger")
+    s.add_argument("--workers", type=int, help="parallel parse processes")
+    s.set_defaults(func=cmd_import_moves)
+
+    s = sub.add_parser("map", help="match new SmartBill names to products (grup_sku)")
+    s.add_argument("--no-apply", action="store_true", help="only score, don't update grup_sku")
+    s.set_defaults(func=cmd_map)
+
+    s = sub.add_parser("report", help='write the "Ce comand azi" order report')
+    s.add_argument("--out", required=True, help=".xlsx, .csv or .parquet")
+    s.add_argument("--lead-time", type=float, default=DEFAULT_LEAD_TIME_DAYS)
+    s.add_argument("--target-days", type=float, default=DEFAULT_TARGET_DAYS)
+    s.add_argument("--weight-30d", type=float, default=DEFAULT_WEIGHT_30D)
+    s.add_argument("--only-order", action="store_true", help="only SKUs with reorder_qty > 0")
+    s.set_defaults(func=cmd_report)
+
+    s = sub.add_parser("export", help="stream a catalog-wide export to a file")
+    s.add_argument("name", choices=sorted(EXPORTS))
+    s.add_argument("--out", required=True, help=".xlsx, .csv or .parquet")
+    s.set_defaults(func=cmd_export)
+
+    s = sub.add_parser("velocity", help="per-SKU sales velocity, stock-outs and weekday seasonality from dated moves")
+    s.add_argument("files", nargs="+", help="line-level stock-move exports (.xlsx)")
+    s.add_argument("--out", required=True, help=".xlsx, .csv or .parquet")
+    s.add_argument("--end", type=_date, help="last day of the history (default: last move)")
+    s.add_argument("--weekly", help="also write units sold per SKU and week (Monday) to this file")
+    s.add_argument("--stock-from-db", action="store_true",
+                   help="detect stock-outs from the daily balance, anchored on the latest imported stoc_final")
+    s.set_defaults(func=cmd_velocity)
+    return p
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    if not args.db_url:
+        log.error("DB_URL is not set (use --db-url or the DB_URL environment variable)")
+        return 2
+    try:
+        engine = check_health(args.db_url, max_age=0)
+        run_migrations(engine)
+        with perf_run(args.command):
+            return args.func(engine, args)
+    except Exception:
+        log.exception("%s failed", args.command)
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+from __future__ import annotations
+from io import StringIO
+from typing import List, Optional, Sequence
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from perf import span
+
+# Bulk-write primitives shared by the importers, one code path per dialect:
+# Postgres gets COPY + temp tables dropped at commit; SQLite (the offline
+# mode) gets prepared executemany batches into connection-local temp tables.
+# The schema itself lives in db.py.
+COPY_BATCH = 5000
+
+def is_postgres(conn: Connection) -> bool:
+    return conn.dialect.name == "postgresql"
+
+def create_stage(conn: Connection, name: str, columns: str) -> None:
+    """Transaction-scoped staging table. SQLite has no ON COMMIT DROP, and its
+    temp tables live as long as the pooled connection, so drop a leftover first."""
+    if is_postgres(conn):
+        conn.execute(text(f"CREATE TEMP TABLE {name} ({columns}) ON COMMIT DROP"))
+    else:
+        conn.execute(text(f"DROP TABLE IF EXISTS temp.{name}"))
+        conn.execute(text(f"CREATE TEMP TABLE {name} ({columns})"))
+
+def _records(df: pd.DataFrame, columns: Sequence[str]) -> List[dict]:
+    part = df[list(columns)]
+    return part.astype(object).where(part.notna(), None).to_dict("records")
+
+def copy_frame(conn: Connection, table: str, df: pd.DataFrame, columns: List[str]) -> None:
+    """Bulk-load `df[columns]` into `table`. COPY on Postgres, executemany elsewhere."""
+    if df.empty:
+        return
+    if is_postgres(conn):
+        with span("copy_frame", table=table, rows=len(df)):
+            buf = StringIO()
+            # NULLs travel as \N so empty strings stay empty strings
+            df[columns].to_csv(buf, index=False, header=False, na_rep="\\N")
+            buf.seek(0)
+            cur = conn.connection.cursor()
+            try:
+                cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buf)
+            finally:
+                cur.close()
+    else:
+        # One prepared statement, fed in batches
+        sql = text(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})")
+        for i in range(0, len(df), COPY_BATCH):
+            part = df.iloc[i:i + COPY_BATCH]
+            with span("copy_frame", table=table, rows=len(part)):
+                conn.execute(sql, _records(part, columns))
+
+def upsert_sql(table: str, source: str, columns: Sequence[str], keys: Sequence[str],
+               touch: Optional[str] = "updated_at") -> str:
+    """INSERT ... SELECT ... ON CONFLICT (keys) DO UPDATE from a staging table,
+    valid on Postgres and SQLite. `touch` names a timestamp column set to now()
+    on insert and update. The source must not repeat a key."""
+    cols = list(columns) + ([touch] if touch else [])
+    sets = [f"{c}=EXCLUDED.{c}" for c in columns if c not in keys] + ([f"{touch}=now()"] if touch else [])
+    # "WHERE true" keeps SQLite from reading ON CONFLICT as a join constraint
+    rows = f"SELECT {', '.join(list(columns) + (['now()'] if touch else []))} FROM {source} WHERE true"
+    return (f"INSERT INTO {table} ({', '.join(cols)}) {rows} "
+            f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {', '.join(sets)}")
+
+def xact_lock(conn: Connection, key: str) -> None:
+    """Serialize writers of `key` until the transaction ends.
+    Postgres: advisory lock. SQLite has one writer at a time anyway; a no-op
+    write takes the database write lock now, before this transaction reads
+    anything, so it can't fail later on a stale read snapshot."""
+    if is_postgres(conn):
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:k))"), {"k": key})
+    else:
+        conn.execute(text("UPDATE schema_version SET version = version WHERE 1 = 0"))
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import dispose_engine, get_engine, run_migrations  # noqa: E402
+
+@pytest.fixture
+def engine(tmp_path):
+    """A migrated offline SQLite database of its own."""
+    url = f"sqlite:///{tmp_path / 'servicepack.db'}"
+    eng = get_engine(url)
+    run_migrations(eng)
+    yield eng
+    dispose_engine(url)
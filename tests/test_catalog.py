@@ -0,0 +1,15 @@
+from sqlalchemy import text
+
+from catalog import catalog_write, get_product
+
+def test_prices_round_trip_through_the_catalog(engine):
+    with catalog_write(engine) as conn:
+        conn.execute(text("INSERT INTO products (code, name, purchase_price_no_vat, sale_price_no_vat) "
+                          "VALUES ('A', 'a', 12.34, 99.99)"))
+    r = get_product(engine, "A")
+    # What the edit form shows and saves back unchanged
+    assert (str(r["purchase_price_no_vat"]), str(r["sale_price_no_vat"])) == ("12.34", "99.99")
+    with catalog_write(engine) as conn:
+        conn.execute(text("UPDATE products SET purchase_price_no_vat=:pp WHERE code='A'"),
+                     {"pp": float(r["purchase_price_no_vat"])})
+        assert conn.execute(text("SELECT purchase_price_no_vat FROM products")).scalar() == 12.34
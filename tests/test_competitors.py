@@ -0,0 +1,50 @@
+import io
+
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from competitors import competitor_names, ingest_competitor_prices, normalize_competitor_chunk
+
+def _xlsx(df: pd.DataFrame) -> io.BytesIO:
+    buf = io.BytesIO()
+    df.to_excel(buf, index=False)
+    buf.seek(0)
+    buf.name = "preturi.xlsx"
+    return buf
+
+def test_wide_file_takes_known_and_prefixed_columns():
+    raw = pd.DataFrame({"cod": ["A"], "gsmnet": [10.0], "competitor_foo": [11.0]})
+    out = normalize_competitor_chunk(raw)
+    assert sorted(out["competitor"]) == ["foo", "gsmnet"]
+
+def test_wide_file_rejects_other_columns():
+    raw = pd.DataFrame({"cod": ["A"], "moka": [10.0], "stoc": [3], "pret achizitie": [7.0]})
+    with pytest.raises(ValueError, match="stoc, pret achizitie"):
+        normalize_competitor_chunk(raw)
+
+def test_unknown_codes_are_reported_apart(engine):
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO products (code, name) VALUES ('A', 'a'), ('B', 'b')"))
+    stats = ingest_competitor_prices(engine, _xlsx(pd.DataFrame({
+        "cod": ["A", "B", "X", "Y"], "concurent": ["moka"] * 4, "pret": [10, 20, 30, 40]})))
+    assert (stats["inserted"], stats["unknown_codes"], stats["unchanged"]) == (2, 2, 0)
+    stats = ingest_competitor_prices(engine, _xlsx(pd.DataFrame({
+        "cod": ["A", "B", "X"], "concurent": ["moka"] * 3, "pret": [10, 21, 30]})))
+    assert (stats["inserted"], stats["unknown_codes"], stats["unchanged"]) == (1, 1, 1)
+    assert competitor_names(engine)[-1] == "distrizone"
+
+def test_cleared_form_price_removes_the_latest_price(engine):
+    from catalog import catalog_write
+    from competitors import latest_for_code, record_prices
+    with catalog_write(engine) as conn:
+        conn.execute(text("INSERT INTO products (code, name) VALUES ('A', 'a')"))
+        record_prices(conn, "A", {"moka": 10.0, "sep": None})
+    assert latest_for_code(engine, "A") == {"moka": 10.0}
+    with catalog_write(engine) as conn:
+        record_prices(conn, "A", {"moka": None, "sep": None})
+    assert latest_for_code(engine, "A") == {}
+    with catalog_write(engine) as conn:
+        record_prices(conn, "A", {"moka": None, "sep": None})  # saving again adds nothing
+        n = conn.execute(text("SELECT count(*) FROM competitor_prices")).scalar()
+    assert n == 2
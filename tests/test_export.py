@@ -0,0 +1,44 @@
+import pandas as pd
+import pytest
+import pyarrow.parquet as pq
+from sqlalchemy import text
+
+from export import EXPORTS, iter_query, write_chunks
+
+def test_parquet_whole_then_fractional_prices_across_chunks(engine, tmp_path):
+    # SQLite returns whole NUMERIC values as int: the first chunk is all int
+    prices = [5, 6, 10, 12, 7.25, 8.5]
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO products (code, name, purchase_price_no_vat, sale_price_no_vat) "
+                          "VALUES (:code, :name, :p, :s)"),
+                     [{"code": f"P{i:03d}", "name": f"Produs {i}", "p": p, "s": p * 2} for i, p in enumerate(prices)])
+    path = str(tmp_path / "profit.parquet")
+    assert write_chunks(iter_query(engine, EXPORTS["produse_profitabilitate"], chunk_rows=2), path) == len(prices)
+    out = pq.read_table(path).to_pandas()
+    assert out["purchase_price_no_vat"].tolist() == prices
+    assert out["profit_no_vat"].tolist() == prices
+
+def test_parquet_column_null_in_first_chunk(tmp_path):
+    chunks = [pd.DataFrame({"code": ["A", "B"], "grup": [None, None]}),
+              pd.DataFrame({"code": ["C", "D"], "grup": [1.5, None]})]
+    path = str(tmp_path / "x.parquet")
+    assert write_chunks(iter(chunks), path) == 4
+    assert pq.read_table(path).column("grup").to_pylist() == [None, None, "1.5", None]
+
+def test_profitability_percentages_with_whole_prices(engine):
+    # Whole NUMERIC values are stored as INTEGER on SQLite
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO products (code, name, purchase_price_no_vat, sale_price_no_vat) "
+                          "VALUES ('A', 'a', 100, 150)"))
+    df = next(iter_query(engine, EXPORTS["produse_profitabilitate"]))
+    assert df["margin_pct"].iloc[0] == pytest.approx(100 / 3)
+    assert df["markup_pct"].iloc[0] == pytest.approx(50.0)
+
+def test_xlsx_formats_date_objects(tmp_path):
+    # Postgres DATE columns arrive as datetime.date in object columns
+    from datetime import date, datetime
+    from openpyxl import load_workbook
+    path = str(tmp_path / "t.xlsx")
+    write_chunks(iter([pd.DataFrame({"sku": ["A"], "period_start": [date(2026, 1, 1)]})]), path)
+    cell = load_workbook(path).active["B2"]
+    assert cell.is_date and cell.value == datetime(2026, 1, 1)
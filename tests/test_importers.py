@@ -0,0 +1,28 @@
+import io
+
+from openpyxl import Workbook
+
+from importers import iter_excel_chunks, iter_sb_chunks, normalize_product_chunk
+
+def _xlsx(rows) -> io.BytesIO:
+    wb = Workbook()
+    for r in rows:
+        wb.active.append(r)
+    buf = io.BytesIO()
+    wb.save(buf)
+    buf.seek(0)
+    return buf
+
+def test_int_codes_keep_their_form_across_chunks():
+    f = _xlsx([["cod", "nume", "pret vanzare fara tva"]] + [[c, "x", 10] for c in [111, 222, None, 333]])
+    codes = [list(normalize_product_chunk(ch)["code"]) for ch in iter_excel_chunks(f, chunk_rows=2)]
+    assert codes == [["111", "222"], ["333"]]
+
+def test_smartbill_total_row_does_not_change_codes(tmp_path, monkeypatch):
+    monkeypatch.setenv("SERVICEPACK_CACHE_DIR", str(tmp_path))
+    f = _xlsx([["Situatie stocuri"], ["Nr. crt.", "Cod", "Produs", "Stoc initial", "Intrari", "Iesiri", "Stoc final"],
+               [1, 111, "a", 1, 2, 1, 2], [2, 222, "b", "3", 0, 1, 2],
+               [3, 333, "c", 0, 1, 1, 0], [None, None, "Total", 4, 3, 3, None]])
+    chunks = list(iter_sb_chunks(f, chunk_rows=2))
+    assert [c for ch in chunks for c in ch["code"]] == ["111", "222", "333"]
+    assert chunks[0]["stoc_initial"].tolist() == [1.0, 3.0]
@@ -0,0 +1,111 @@
+import io
+import json
+import time
+
+import pandas as pd
+from sqlalchemy import text
+
+import jobs
+
+def _upload() -> io.BytesIO:
+    buf = io.BytesIO()
+    pd.DataFrame({"cod": ["A", "B"], "nume": ["a", "b"], "pret vanzare fara tva": [10.0, 12.5]}).to_excel(buf, index=False)
+    buf.seek(0)
+    buf.name = "produse.xlsx"
+    return buf
+
+def _wait(engine, job_id, timeout=30.0) -> str:
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        with engine.connect() as conn:
+            state = conn.execute(text("SELECT state FROM import_jobs WHERE id=:id"), {"id": job_id}).scalar()
+        if state not in jobs.ACTIVE_STATES:
+            return state
+        time.sleep(0.05)
+    raise TimeoutError(job_id)
+
+def test_retry_after_another_job_on_the_same_file(engine, tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "SPOOL_DIR", tmp_path / "spool")
+    real = jobs.import_products
+    calls = []
+
+    def flaky(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        return real(*args, **kwargs)
+
+    monkeypatch.setattr(jobs, "import_products", flaky)
+    first, _ = jobs.submit_import(engine, jobs.KIND_PRODUCTS, _upload())
+    assert _wait(engine, first) == jobs.STATE_FAILED
+    second, queued = jobs.submit_import(engine, jobs.KIND_PRODUCTS, _upload(), {"force": True})
+    assert queued and _wait(engine, second) == jobs.STATE_DONE
+    # The second job removed only its own spool file
+    assert jobs.retry_job(engine, first)
+    assert _wait(engine, first) in (jobs.STATE_DONE, jobs.STATE_SKIPPED)
+
+def test_force_is_not_folded_into_a_plain_active_job(engine, tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "SPOOL_DIR", tmp_path / "spool")
+    up = _upload()
+    with engine.begin() as conn:
+        active = conn.execute(text(
+            "INSERT INTO import_jobs (kind, content_hash, scope, params, state) "
+            "VALUES ('products', :h, '', :p, 'running') RETURNING id"
+        ), {"h": jobs.file_digest(up), "p": json.dumps({})}).scalar()
+    assert jobs.submit_import(engine, jobs.KIND_PRODUCTS, up) == (active, False)
+    forced, queued = jobs.submit_import(engine, jobs.KIND_PRODUCTS, up, {"force": True})
+    assert queued and forced != active
+    assert _wait(engine, forced) == jobs.STATE_DONE
+
+def _smartbill_upload() -> io.BytesIO:
+    from openpyxl import Workbook
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["Situatie stocuri"])
+    ws.append(["Nr. crt.", "Cod", "Produs", "Stoc initial", "Intrari", "Iesiri", "Stoc final"])
+    for i, code in enumerate(["A", "B", "X"]):
+        ws.append([i + 1, code, f"produs {code}", 5, 10, 3, 12])
+    buf = io.BytesIO()
+    wb.save(buf)
+    buf.seek(0)
+    buf.name = "30z.xlsx"
+    return buf
+
+def test_moves_job_reports_progress_and_finishes(engine, tmp_path, monkeypatch):
+    # The job's progress updates run on other connections while the import
+    # transaction is open; on SQLite they must not wait on its write lock
+    monkeypatch.setattr(jobs, "SPOOL_DIR", tmp_path / "spool")
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO products (code, name) VALUES ('A', 'a'), ('B', 'b')"))
+    job_id, queued = jobs.submit_import(engine, jobs.KIND_MOVES, _smartbill_upload(), {
+        "source_tag": "sb_30z", "period_start": "2026-01-01", "period_end": "2026-01-30"})
+    assert queued and _wait(engine, job_id) == jobs.STATE_DONE
+    with engine.connect() as conn:
+        rows_done, stats = conn.execute(text("SELECT rows_done, stats FROM import_jobs WHERE id=:id"),
+                                        {"id": job_id}).one()
+        assert conn.execute(text("SELECT count(*) FROM stock_moves")).scalar() == 3
+    assert rows_done == 3 and json.loads(stats)["unknown"] == 1
+
+def test_ledger_records_the_uploaded_name(engine, tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "SPOOL_DIR", tmp_path / "spool")
+    job_id, _ = jobs.submit_import(engine, jobs.KIND_PRODUCTS, _upload())
+    assert _wait(engine, job_id) == jobs.STATE_DONE
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT filename FROM imports")).scalar() == "produse.xlsx"
+
+def test_purge_spool_keeps_files_of_active_jobs(engine, tmp_path, monkeypatch):
+    import os
+    spool = tmp_path / "spool"
+    monkeypatch.setattr(jobs, "SPOOL_DIR", spool)
+    spool.mkdir()
+    old, busy, fresh = spool / "old.xlsx", spool / "busy.xlsx", spool / "fresh.xlsx"
+    for f in (old, busy, fresh):
+        f.write_bytes(b"x")
+    week_ago = time.time() - 8 * 86400
+    for f in (old, busy):
+        os.utime(f, (week_ago, week_ago))
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO import_jobs (kind, spool_path, state) VALUES ('products', :p, 'running')"),
+                     {"p": str(busy)})
+    assert jobs.purge_spool(engine) == 1
+    assert not old.exists() and busy.exists() and fresh.exists()
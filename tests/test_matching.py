@@ -0,0 +1,35 @@
+import pandas as pd
+from sqlalchemy import text
+
+from matching import STATUS_APPLIED, STATUS_REVIEW, apply_matches
+
+def _status(engine, sb_code):
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT status FROM name_matches WHERE sb_code=:c"), {"c": sb_code}).scalar()
+
+def test_skipped_match_stays_pending(engine):
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO products (code, name, grup_sku) VALUES ('A', 'a', 'SB-OLD'), ('B', 'b', NULL)"))
+        conn.execute(text("INSERT INTO name_matches (sb_code, code, score, status) "
+                          "VALUES ('SB-1', 'A', 0.7, 'review'), ('SB-2', 'B', 0.7, 'review')"))
+    m = pd.DataFrame({"sb_code": ["SB-1", "SB-2"], "code": ["A", "B"], "score": [0.7, 0.7]})
+    assert apply_matches(engine, m) == 1
+    assert _status(engine, "SB-1") == STATUS_REVIEW
+    assert _status(engine, "SB-2") == STATUS_APPLIED
+    assert apply_matches(engine, m.iloc[:1], overwrite=True) == 1
+    assert _status(engine, "SB-1") == STATUS_APPLIED
+
+def test_unmatched_name_is_rescored_once_its_product_exists(engine):
+    from catalog import catalog_write
+    from matching import STATUS_AUTO, STATUS_NONE, match_new_names
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO sku_period_totals (sku, source_tag, period_start, period_end, product_name) "
+                          "VALUES ('SB-9', 'sb_an', '2026-01-01', '2026-10-17', 'Display Samsung A52 OLED negru')"))
+    assert match_new_names(engine)["status"].tolist() == [STATUS_NONE]
+    assert match_new_names(engine).empty  # nothing changed, nothing rescored
+    with catalog_write(engine) as conn:
+        conn.execute(text("INSERT INTO products (code, name, name_key) "
+                          "VALUES ('P1', 'Display Samsung A52 OLED negru', 'display samsung a52 oled negru')"))
+    res = match_new_names(engine)
+    assert res[["sb_code", "code", "status"]].values.tolist() == [["SB-9", "P1", STATUS_AUTO]]
+    assert _status(engine, "SB-9") == STATUS_AUTO
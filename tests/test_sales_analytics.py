@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+from sales_analytics import build_series, weekly_sales, window_velocity
+from servicepack import main
+
+def _moves(rows):
+    df = pd.DataFrame(rows, columns=["date", "product_code", "qty"])
+    df["date"] = pd.to_datetime(df["date"])
+    df["product_code"] = df["product_code"].astype("category")
+    df["qty"] = df["qty"].astype(np.float32)
+    return df
+
+def test_weekly_sales_partial_weeks_start_on_monday():
+    # 2024-01-03 is a Wednesday; receipts don't count as sales
+    s = build_series(_moves([("2024-01-03", "A", -2), ("2024-01-07", "A", -1), ("2024-01-08", "A", -4),
+                             ("2024-01-10", "B", 5), ("2024-01-16", "B", -3)]))
+    w = weekly_sales(s)
+    assert [d.strftime("%Y-%m-%d") for d in w.columns] == ["2024-01-01", "2024-01-08", "2024-01-15"]
+    assert w.loc["A"].tolist() == [3, 4, 0]
+    assert w.loc["B"].tolist() == [0, 0, 3]
+
+def test_weekly_sales_empty_range():
+    s = build_series(_moves([("2024-01-03", "A", -2)]), start="2024-01-05", end="2024-01-04")
+    assert weekly_sales(s).shape[1] == 0
+
+def test_window_velocity_skips_unobserved_days():
+    sales = np.array([[1, 0, 3, 2]], np.float32)
+    observed = np.array([[True, False, True, True]])
+    assert window_velocity(sales, observed, 3).tolist() == [2.5]
+    assert np.isnan(window_velocity(sales, np.zeros_like(observed), 3)[0])
+
+def test_velocity_cli_weekly_output(engine, tmp_path):
+    src = tmp_path / "miscari.xlsx"
+    pd.DataFrame({"data": ["2024-01-03", "2024-01-09"], "cod produs": ["A", "A"],
+                  "cantitate": [2, 5], "tip": ["iesire", "iesire"]}).to_excel(src, index=False)
+    weekly = tmp_path / "saptamanal.csv"
+    assert main(["--db-url", str(engine.url), "velocity", str(src),
+                 "--out", str(tmp_path / "viteza.csv"), "--weekly", str(weekly)]) == 0
+    out = pd.read_csv(weekly)
+    assert out.columns.tolist() == ["sku", "2024-01-01", "2024-01-08"]
+    assert out.iloc[0].tolist() == ["A", 2, 5]
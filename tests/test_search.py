@@ -0,0 +1,24 @@
+from sqlalchemy import text
+
+from search import search_products
+from utils import norm_name_value
+
+def _add(engine, rows):
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO products (code, name, name_key) VALUES (:code, :name, :name_key)"),
+                     [{"code": c, "name": n, "name_key": norm_name_value(n)} for c, n in rows])
+
+def test_exact_phrase_ranks_first_on_sqlite(engine):
+    # Every name has all three tokens; only P00051 has them as one phrase
+    _add(engine, [("P00010", "Display iPhone 10 negru 10"),
+                  ("P00011", "Display iPhone 11 negru"),
+                  ("P00012", "Baterie iPhone 12 negru 1"),
+                  ("P00051", "Display iPhone 1 negru")])
+    page, _ = search_products(engine, "iphone 1 negru")
+    assert page["code"].tolist()[0] == "P00051"
+    assert len(page) == 4
+
+def test_earlier_phrase_ranks_higher(engine):
+    _add(engine, [("A1", "Carcasa spate display iphone"), ("A2", "Display iphone carcasa")])
+    page, _ = search_products(engine, "display iphone")
+    assert page["code"].tolist() == ["A2", "A1"]
@@ -1,6 +1,10 @@
+import hashlib
+import re
 import pandas as pd
 import numpy as np
-from typing import Tuple, List
+from typing import Tuple, List, Optional, Sequence
+
+from perf import timed
 
 PRODUCT_COLUMN_ALIASES = {
     "code": ["cod", "product code", "sku", "id"],
@@ -13,6 +17,54 @@ PRODUCT_COLUMN_ALIASES = {
     "competitor_price": ["concurenta", "pret concurenta", "competitor price"],
 }
 
+def norm_name_value(x: str) -> str:
+    if x is None:
+        return ""
+    x = str(x).strip().lower()
+    x = re.sub(r"\s+", " ", x)
+    return x
+
+@timed("norm_name_series")
+def norm_name_series(s: pd.Series) -> pd.Series:
+    return s.fillna("").map(norm_name_value)
+
+def row_digest(df: pd.DataFrame, cols: Sequence[str]) -> pd.Series:
+    """Stable per-row content hash (hex) over `cols`. Missing values hash as
+    empty; numbers are rounded to 4 decimals so float noise doesn't count as a change."""
+    parts = []
+    for c in cols:
+        s = df[c]
+        if pd.api.types.is_numeric_dtype(s):
+            s = s.round(4).astype(str).where(s.notna(), "")
+        else:
+            s = s.fillna("").astype(str)
+        parts.append(s)
+    joined = parts[0].str.cat(parts[1:], sep="\x1f") if len(parts) > 1 else parts[0]
+    return pd.Series([hashlib.blake2b(x.encode(), digest_size=16).hexdigest() for x in joined],
+                     index=df.index, dtype=object)
+
+def to_num(s):
+    return pd.to_numeric(s, errors="coerce")
+
+def to_num_or_none(x):
+    if x is None or str(x).strip() == "":
+        return None
+    try:
+        return float(x)
+    except Exception:
+        return None
+
+def clean_header(cols) -> pd.Index:
+    # Same header cleanup as the import tabs: strip, lowercase, newlines -> spaces
+    return pd.Index(cols).astype(str).str.strip().str.lower().str.replace("\n", " ", regex=True)
+
+def find_col(columns, cands: Sequence[str]) -> Optional[str]:
+    for c in cands:
+        if c in columns:
+            return c
+    return None
+
+@timed("normalize_columns")
 def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
     # Drop unnamed columns
     df = df.loc[:, ~df.columns.astype(str).str.contains("^Unnamed", case=False)]
@@ -26,6 +78,7 @@ def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
             df[col] = pd.to_numeric(df[col], errors="coerce")
     return df
 
+@timed("map_product_columns")
 def map_product_columns(df: pd.DataFrame) -> pd.DataFrame:
     mapping = {}
     for std, aliases in PRODUCT_COLUMN_ALIASES.items():
@@ -52,6 +105,7 @@ def map_product_columns(df: pd.DataFrame) -> pd.DataFrame:
                                  (out["sale_price"] - out["purchase_price"]) / out["purchase_price"] * 100, np.nan)
     return out
 
+@timed("normalize_stock_moves")
 def normalize_stock_moves(df: pd.DataFrame) -> pd.DataFrame:
     # Attempts to map common SmartBill exports: Date, Product Code/SKU, Qty, Type (in/out)
     cols = df.columns.str.lower().str.strip()
@@ -63,12 +117,15 @@ def normalize_stock_moves(df: pd.DataFrame) -> pd.DataFrame:
     code_col = candidates_code[0] if candidates_code else None
     qty_col = candidates_qty[0] if candidates_qty else None
     out = pd.DataFrame()
-    if date_col: out["date"] = pd.to_datetime(df[date_col], errors="coerce").dt.date
+    if date_col: out["date"] = pd.to_datetime(df[date_col], errors="coerce").dt.normalize()
     if code_col: out["product_code"] = df[code_col].astype(str).str.strip()
-    if qty_col: out["qty"] = pd.to_numeric(df[qty_col], errors="coerce")
+    if qty_col: out["qty"] = pd.to_numeric(df[qty_col], errors="coerce").astype(np.float32)
     # Heuristic: negative qty for outputs (if there is a "tip" column)
     if "tip" in cols or "type" in cols:
         tcol = "tip" if "tip" in cols else "type"
         mask_out = df[tcol].astype(str).str.lower().str.contains("iesire|out")
         out.loc[mask_out, "qty"] = -out.loc[mask_out, "qty"].abs()
-    return out.dropna(subset=["product_code","date","qty"])
\ No newline at end of file
+    out = out.dropna(subset=["product_code","date","qty"])
+    # Compact dtypes for the analytics stage: one code per SKU, float32 quantities
+    if code_col: out["product_code"] = out["product_code"].astype("category")
+    return out
\ No newline at end of file